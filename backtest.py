@@ -0,0 +1,190 @@
+import argparse
+import ast
+import datetime as dt
+from types import SimpleNamespace
+
+import numpy as np
+import toml
+
+import history
+from channel import LOG_DIR, UNKNOWN
+from check import Check, load_checks_from_toml_file
+
+# Backtesting of the checks over the logged history: every condition is evaluated (vectorized,
+# see Check.simulate_eval_plan) over the values of its channels loaded from the logs, reporting
+# the time intervals in which the check would have failed.
+#
+# The channels are logged at different times (when their values change), so all the channels of
+# a check are put on a common timeline (the union of their timestamps) and every value is
+# forward-filled. Points before the first value of any of the channels are not evaluated.
+
+# logged columns used for every check attribute, in order of preference (the setpoints are not
+# logged, the monitored value is used instead)
+COLUMN_FALLBACKS = {
+    "vset": ("vset", "vmon"),
+    "iset": ("iset", "imon"),
+    "on": ("stat.ON", "stat.HV"),
+}
+
+
+def get_condition_attributes(condition : str) -> list:
+    """ (channel, attribute) pairs used in a condition. """
+    pairs = []
+    for node in ast.walk(ast.parse(condition.strip(), mode="eval")):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            if (node.value.id, node.attr) not in pairs:
+                pairs.append((node.value.id, node.attr))
+    return pairs
+
+
+def load_channel(channel, start, end, log_dir=LOG_DIR, resolution=None, cache=None):
+    """ history.load of a channel, cached in the cache dict. With a resolution, the '<value>_last' rollup columns are used. """
+    if cache is not None and channel in cache:
+        return cache[channel]
+    data = history.load(channel, start, end, log_dir=log_dir, resolution=resolution)
+    if resolution is not None:
+        data = {name[:-len("_last")] if name.endswith("_last") else name: values for name, values in data.items()}
+    if cache is not None:
+        cache[channel] = data
+    return data
+
+
+def get_column(data, attribute):
+    for column in COLUMN_FALLBACKS.get(attribute, (attribute,)):
+        if column in data and data[column].dtype.kind in "fb":
+            return column, data[column]
+        if column in data and data[column].dtype.kind == "O":
+            # status flag with unknown ('??') values, not evaluated there
+            values = data[column]
+            return column, np.where(values == UNKNOWN, np.nan, values).astype(float)
+    return None, None
+
+
+def forward_fill(times, source_times, values):
+    """ Value of the last sample at or before every time of times (NaN before the first sample). """
+    index = np.searchsorted(source_times, times, side="right") - 1
+    result = np.where(index >= 0, values[np.clip(index, 0, None)].astype(float), np.nan)
+    return result
+
+
+def get_intervals(times, failed):
+    """ [(start, end), ...] of the runs of failed points; a run ends at the next passing point (or the last point). """
+    if len(failed) == 0:
+        return []
+    edges = np.diff(np.r_[0, failed.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) # index of the first passing point after the run
+    return [(times[s], times[min(e, len(times) - 1)]) for s, e in zip(starts, ends)]
+
+
+def backtest_check(check : Check, start, end, log_dir=LOG_DIR, resolution=None, cache=None):
+    """
+    Evaluate a check over the logged history between start and end.
+    Returns a dict with the columns used, the number of points evaluated, the failed intervals
+    [(start, end), ...] and the total failed time (seconds), or with an 'error' if it cannot be evaluated.
+    """
+    try:
+        pairs = get_condition_attributes(check.condition)
+    except SyntaxError as e:
+        return {"error": f"syntax error ({e})"}
+
+    # load the logged columns of every channel attribute of the condition
+    series = {}
+    columns = {}
+    for ch, attr in pairs:
+        data = load_channel(ch, start, end, log_dir=log_dir, resolution=resolution, cache=cache)
+        column, values = get_column(data, attr)
+        if column is None:
+            return {"error": f"no logged values for '{ch}.{attr}'"}
+        valid = ~np.isnan(values) if values.dtype.kind == "f" else np.ones(len(values), dtype=bool)
+        series[f"{ch}.{attr}"] = (data["time"][valid], values[valid])
+        columns[f"{ch}.{attr}"] = f"{ch}.{column}"
+
+    # compile the condition against stand-ins of the channels with the attributes found
+    channels = {}
+    for ch, attr in pairs:
+        channels.setdefault(ch, {})[attr] = None
+    check = Check(check.name, check.condition, {ch: SimpleNamespace(**attrs) for ch, attrs in channels.items()})
+    if check.code is None:
+        return {"error": check.error}
+    if check.channel_names:
+        return {"error": "channels used as a whole cannot be backtested"}
+
+    if series and all(len(t) for t, _ in series.values()):
+        times = np.unique(np.concatenate([t for t, _ in series.values()]))
+        times = times[times >= max(t[0] for t, _ in series.values())]
+    else:
+        times = np.empty(0, dtype="datetime64[ms]")
+    parameters_values = {name: forward_fill(times, t, v) for name, (t, v) in series.items()}
+
+    passed = check.simulate_eval_plan(parameters_values, len(times))
+    failed = ~passed
+    intervals = get_intervals(times, failed)
+    failed_seconds = sum((e - s) / np.timedelta64(1, "s") for s, e in intervals)
+    return {
+        "columns": columns,
+        "points": len(times),
+        "intervals": intervals,
+        "failed_seconds": failed_seconds,
+    }
+
+
+def load_checks(file_path, groups=None):
+    """ Checks of the given groups of a TOML checks file (all the groups by default): [(group, Check), ...]. """
+    with open(file_path, "r") as file:
+        data = toml.load(file)
+    checks = []
+    for group in groups or data.keys():
+        checks.extend((group, check) for check in load_checks_from_toml_file(file_path, group))
+    return checks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the checks over the logged history and report when they would have failed")
+    parser.add_argument("start", type=str, help="Start date or datetime (ISO format)")
+    parser.add_argument("end", type=str, nargs="?", help="End date or datetime (ISO format, default: now)", default=None)
+    parser.add_argument("--config", type=str, help="Checks TOML file", default="checks_config.toml")
+    parser.add_argument("--groups", type=str, nargs="+", help="Groups of checks to evaluate (e.g. caen multidevice)", default=None)
+    parser.add_argument("--checks", type=str, nargs="+", help="Names of the checks to evaluate", default=None)
+    parser.add_argument("--condition", type=str, help="Evaluate this condition instead of the checks file (e.g. 'abs(cathode.vset*0.29 - gemtop.vset) < 101')", default=None)
+    parser.add_argument("--log-dir", type=str, help="Logs directory", default=LOG_DIR)
+    parser.add_argument("--resolution", type=float, help="Seconds between points (uses the rollup tiers if possible)", default=None)
+    parser.add_argument("--max-intervals", type=int, help="Failed intervals printed per check", default=10)
+    parser.add_argument("--output", type=str, help="Write the failed intervals to this CSV file", default=None)
+
+    args = parser.parse_args()
+
+    if args.condition:
+        checks = [("condition", Check("condition", args.condition))]
+    else:
+        checks = load_checks(args.config, args.groups)
+        if args.checks:
+            checks = [(group, check) for group, check in checks if check.name in args.checks]
+
+    cache = {} # the channels are loaded once for all the checks
+    rows = []
+    for group, check in checks:
+        t0 = dt.datetime.now()
+        result = backtest_check(check, args.start, args.end, log_dir=args.log_dir, resolution=args.resolution, cache=cache)
+        elapsed = (dt.datetime.now() - t0).total_seconds()
+        print(f"[{group}] {check.name} ( {check.condition} )")
+        if "error" in result:
+            print(f"  skipped: {result['error']}")
+            continue
+        intervals = result["intervals"]
+        replaced = [f"{k} -> {v}" for k, v in result["columns"].items() if k != v]
+        print(f"  {result['points']} points" + (f" (using {', '.join(replaced)})" if replaced else ""))
+        print(f"  {len(intervals)} failed intervals, {result['failed_seconds']:.0f} s in total ({elapsed:.2f} s)")
+        for s, e in intervals[:args.max_intervals]:
+            print(f"    {str(s).replace('T', ' ')} - {str(e).replace('T', ' ')}")
+        if len(intervals) > args.max_intervals:
+            print(f"    ... ({len(intervals) - args.max_intervals} more)")
+        for s, e in intervals:
+            rows.append((group, check.name, s, e))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write("group,check,start,end,seconds\n")
+            for group, name, s, e in rows:
+                file.write(f"{group},{name},{s},{e},{(e - s) / np.timedelta64(1, 's'):.0f}\n")
+        print(f"Saved to {args.output}")
@@ -0,0 +1,205 @@
+import json
+import os
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+
+# Binary channel log files (alternative to the text .dat files)
+#
+# File layout:
+#   - magic (8 bytes)
+#   - header length (uint32, little endian)
+#   - header: JSON with the channel name, the columns (name, type, unit) and the status flags
+#     of every status column, padded with spaces so the records start at a multiple of 8 bytes
+#   - fixed-width little endian records: time (float64 epoch seconds), one float32 per numeric
+#     value and two uint32 bitmasks per status (dict) value: the flags that are True and the flags
+#     that could not be read ('??', as StatusFlags.unknown). Missing values are stored as NaN.
+#     Files written before the unknown bitmask was added (no "status_unknown" in the header) have
+#     only the first bitmask.
+
+MAGIC = b"TRXHVTS1"
+EXTENSION = "bin"
+MAX_STATUS_FLAGS = 32
+UNKNOWN = '??' # value of a status flag that could not be read (same as channel.UNKNOWN)
+
+
+class BinaryRecordFormat:
+    """
+    Layout of the records of a binary channel log file.
+
+    Parameters:
+    - channel_name (str)
+    - columns (list): [(name, kind), ...] with kind "float" or "status"
+    - units (dict): {name: unit}
+    - status_flags (dict): {name: [flag, ...]} for the status columns (bit i is flag i)
+    - status_unknown (bool): the status columns have the bitmask of unknown flags (field '<name>_unknown')
+    """
+
+    def __init__(self, channel_name, columns, units=None, status_flags=None, status_unknown=True):
+        self.channel_name = channel_name
+        self.columns = [(name, kind) for name, kind in columns]
+        self.units = units or {}
+        self.status_flags = {name: tuple(flags)[:MAX_STATUS_FLAGS] for name, flags in (status_flags or {}).items()}
+        self.status_unknown = status_unknown
+        status_format = "II" if status_unknown else "I"
+        self.struct = struct.Struct("<d" + "".join("f" if kind == "float" else status_format for _, kind in self.columns))
+        fields = [("time", "<f8")]
+        for name, kind in self.columns:
+            if kind == "float":
+                fields.append((name, "<f4"))
+            else:
+                fields.append((name, "<u4"))
+                if status_unknown:
+                    fields.append((name + "_unknown", "<u4"))
+        self.dtype = np.dtype(fields)
+        self._header = None
+
+    @classmethod
+    def from_values(cls, channel_name, values, units=None):
+        """ Build the format from a mapping of values: numbers are stored as float32, mappings (status) as bitmasks. """
+        columns = []
+        status_flags = {}
+        for name, value in values.items():
+            if isinstance(value, Mapping):
+                columns.append((name, "status"))
+                status_flags[name] = list(value.keys())
+            elif value is None or isinstance(value, (int, float)):
+                columns.append((name, "float"))
+            # other types (strings...) are not stored
+        return cls(channel_name, columns, units=units, status_flags=status_flags)
+
+    @classmethod
+    def from_schema(cls, channel_name, value_names, status_flags=None, units=None):
+        """
+        Build the format from the declared values of a channel: the values of status_flags
+        ({name: [flag, ...]}) are stored as bitmasks and the rest as float32. Unlike from_values it
+        does not depend on a reading, so every session of a channel writes the same layout.
+        """
+        status_flags = status_flags or {}
+        columns = [(name, "status" if name in status_flags else "float") for name in value_names]
+        return cls(channel_name, columns, units=units, status_flags=status_flags)
+
+    @classmethod
+    def from_header(cls, header):
+        return cls(
+            header["channel"],
+            header["columns"],
+            units=header.get("units"),
+            status_flags=header.get("status_flags"),
+            status_unknown=header.get("status_unknown", False),
+        )
+
+    def to_header(self):
+        return {
+            "channel": self.channel_name,
+            "columns": self.columns,
+            "units": {name: self.units.get(name, "") for name, _ in self.columns},
+            "status_flags": {name: list(flags) for name, flags in self.status_flags.items()},
+            "status_unknown": self.status_unknown,
+        }
+
+    def header_bytes(self):
+        if self._header is None:
+            header = json.dumps(self.to_header()).encode("utf-8")
+            size = len(MAGIC) + 4 + len(header)
+            header += b" " * (-size % 8)
+            self._header = MAGIC + struct.pack("<I", len(header)) + header
+        return self._header
+
+    def encode_status(self, name, status):
+        """ Returns the (bits, unknown) bitmasks of a status: a flag is set only if it is True, missing or '??' flags are unknown. """
+        flags = self.status_flags.get(name, ())
+        if getattr(status, "names", None) == flags: # StatusFlags with the same flags
+            return status.bits, status.unknown
+        bits = 0
+        unknown = 0
+        for i, flag in enumerate(flags):
+            value = status.get(flag, UNKNOWN)
+            if value is True or value is False or (not isinstance(value, str) and value in (0, 1)):
+                if value:
+                    bits |= 1 << i
+            else:
+                unknown |= 1 << i
+        return bits, unknown
+
+    def encode(self, timestamp, values):
+        """ Returns the bytes of one record. timestamp is a datetime, values a dict. """
+        fields = [timestamp.timestamp()]
+        for name, kind in self.columns:
+            value = values.get(name)
+            if kind == "status":
+                bits, unknown = self.encode_status(name, value or {})
+                fields.append(bits)
+                if self.status_unknown:
+                    fields.append(unknown)
+            else:
+                try:
+                    fields.append(float(value))
+                except (TypeError, ValueError):
+                    fields.append(float("nan"))
+        return self.struct.pack(*fields)
+
+
+def segment_filename(filename, n):
+    """ Name of the segment n of a binary log file (records with another layout): 'day_ch.bin' -> 'day_ch.n.bin'. """
+    if n == 0:
+        return filename
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{n}{extension}"
+
+
+def segment_filenames(filename):
+    """ Existing segments of a binary log file, in order (the file itself is the first one). """
+    filenames = []
+    n = 0
+    while os.path.isfile(segment_filename(filename, n)):
+        filenames.append(segment_filename(filename, n))
+        n += 1
+    return filenames
+
+
+def read_header(filename):
+    """ Returns (BinaryRecordFormat, offset of the first record) of a binary log file. """
+    with open(filename, "rb") as file:
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary channel log file")
+        (size,) = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(size).decode("utf-8"))
+    return BinaryRecordFormat.from_header(header), len(MAGIC) + 4 + size
+
+
+def load_file(filename):
+    """
+    Memory-map a binary channel log file.
+    Returns (BinaryRecordFormat, numpy structured array with the records). An incomplete last
+    record (file being written) is ignored.
+    """
+    record_format, offset = read_header(filename)
+    with open(filename, "rb") as file:
+        file.seek(0, 2)
+        n_records = (file.tell() - offset) // record_format.dtype.itemsize
+    if n_records <= 0:
+        return record_format, np.empty(0, dtype=record_format.dtype)
+    records = np.memmap(filename, dtype=record_format.dtype, mode="r", offset=offset, shape=(n_records,))
+    return record_format, records
+
+
+def decode_status(record_format, records, name):
+    """
+    Returns {flag: array} for the status column name: a boolean array, or an object array with
+    True/False/'??' if the flag was unknown in some of the records.
+    """
+    bits = records[name]
+    unknown = records[name + "_unknown"] if record_format.status_unknown else None
+    decoded = {}
+    for i, flag in enumerate(record_format.status_flags.get(name, ())):
+        values = (bits & (1 << i)) != 0
+        if unknown is not None:
+            is_unknown = (unknown & (1 << i)) != 0
+            if is_unknown.any():
+                values = values.astype(object)
+                values[is_unknown] = UNKNOWN
+        decoded[flag] = values
+    return decoded
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import re
+from importlib import metadata
+
+from channel import StatusFlags
+
+# channel status bits (STAT parameter) in the order given by the CAEN manual
+CHANNEL_STATUS_BITS = ["ON", "RUP", "RDW", "OVC", "OVV", "UNV", "MAXV", "TRIP", "OVP", "OVT", "DIS", "KILL", "ILK", "NOCAL"]
+
+# hvps versions whose CaenModule internals (_serial, bd, _logger) have been checked against CaenSerialMonitor
+TESTED_HVPS_VERSIONS = ("0.1.",)
+
+
+def decode_channel_status(value) -> StatusFlags:
+    # the STAT value already is the bitmask, no need to build a dict
+    return StatusFlags(CHANNEL_STATUS_BITS, int(value) & ((1 << len(CHANNEL_STATUS_BITS)) - 1))
+
+
+def get_hvps_version() -> str | None:
+    try:
+        return metadata.version("hvps")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+class CaenSerialMonitor:
+    """
+    Monitor queries of the CAEN serial protocol written directly to the serial port of a module.
+
+    hvps does not expose the multi-channel queries, so this is the only place that uses the private
+    attributes of its CaenModule (see from_module). The replies are parsed here, e.g.
+    b"#BD:00,CMD:OK,VAL:1;2;3;4\\r\\n" -> "1;2;3;4".
+    """
+    RESPONSE_REGEX = re.compile(r"^#(?:BD:(?P<bd>\d{2}),)?CMD:OK(?:,VAL:(?P<val>.+))?$")
+
+    def __init__(self, serial, bd: int, logger=None):
+        self.serial = serial
+        self.bd = int(bd)
+        self.logger = logger
+
+    @classmethod
+    def from_module(cls, module, hvps_version: str | None = None) -> CaenSerialMonitor | None:
+        """ Returns None if the hvps version has not been tested or the module has no serial port (e.g. simulators). """
+        if hvps_version is None:
+            hvps_version = get_hvps_version()
+        if hvps_version is None or not hvps_version.startswith(TESTED_HVPS_VERSIONS):
+            return None
+        serial = getattr(module, "_serial", None)
+        if serial is None or not hasattr(module, "bd"):
+            return None
+        return cls(serial, module.bd, getattr(module, "_logger", None))
+
+    def query(self, channel: int, parameter: str) -> str:
+        if not self.serial.is_open:
+            raise ValueError("Serial port is not open")
+        command = f"$BD:{self.bd:02d},CMD:MON,CH:{channel},PAR:{parameter.upper()}\r\n".encode("utf-8")
+        if self.logger is not None:
+            self.logger.debug(f"Sending command: {command}")
+        self.serial.write(command)
+        response = self.serial.readline()
+        if self.logger is not None:
+            self.logger.debug(f"Received response: {response}")
+        return self.parse_response(response)
+
+    def parse_response(self, response: bytes) -> str:
+        if not response:
+            raise ValueError("Empty response (no reply from the module)")
+        try:
+            text = response.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            raise ValueError(f"Invalid response: {response}")
+        match = self.RESPONSE_REGEX.match(text)
+        if match is None or match.group("val") is None:
+            raise ValueError(f"Invalid response: '{text}'")
+        bd = int(match.group("bd")) if match.group("bd") else 0
+        if bd != self.bd:
+            raise ValueError(f"Invalid response: '{text}'. Expected board number {self.bd}, got {bd}")
+        return match.group("val")
+
+    def read_all_channels(self, number_of_channels: int, parameter: str) -> list[str]:
+        """ CH:<number of channels> returns the values of all the channels separated by ';' """
+        response = self.query(number_of_channels, parameter)
+        values = response.split(";")
+        if len(values) != number_of_channels:
+            raise ValueError(f"Expected {number_of_channels} values for {parameter}, got '{response}'")
+        return values
+
+
+class CaenBulkReader:
+    """
+    Reads vset, vmon, imon and stat of all the channels of a CAEN module.
+
+    It uses the multi-channel monitor queries of the firmware, i.e. one serial round-trip per
+    parameter instead of one per parameter and channel. If the module does not support it
+    (simulators, untested hvps versions or after several consecutive failures) it falls back to
+    reading channel by channel.
+    """
+    PARAMETERS = ("VSET", "VMON", "IMON", "STAT")
+    MAX_CONSECUTIVE_FAILURES = 3
+
+    def __init__(self, module, monitor: CaenSerialMonitor | None = None):
+        self.module = module
+        self.monitor = monitor if monitor is not None else CaenSerialMonitor.from_module(module)
+        self.failures = 0
+
+    @property
+    def bulk_supported(self) -> bool:
+        return self.monitor is not None
+
+    def read(self) -> list[dict]:
+        """ Returns a list with a dict {"vset", "vmon", "imon", "stat"} per channel. """
+        if self.bulk_supported:
+            try:
+                readings = self.read_bulk()
+                self.failures = 0
+                return readings
+            except Exception as e:
+                self.failures += 1
+                if self.failures >= self.MAX_CONSECUTIVE_FAILURES:
+                    self.monitor = None
+                    print(f"Multi-channel read not available for module {self.module.name} ({e}). Reading channel by channel.")
+        return self.read_per_channel()
+
+    def read_bulk(self) -> list[dict]:
+        n = self.module.number_of_channels
+        values = {parameter: self.monitor.read_all_channels(n, parameter) for parameter in self.PARAMETERS}
+        return [
+            {
+                "vset": float(values["VSET"][i]),
+                "vmon": float(values["VMON"][i]),
+                "imon": float(values["IMON"][i]),
+                "stat": decode_channel_status(values["STAT"][i]),
+            }
+            for i in range(n)
+        ]
+
+    def read_per_channel(self) -> list[dict]:
+        return [
+            {"vset": ch.vset, "vmon": ch.vmon, "imon": ch.imon, "stat": ch.stat.copy()}
+            for ch in self.module.channels
+        ]
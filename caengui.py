@@ -12,6 +12,7 @@ from check import Check
 from checkframe import ChecksFrame
 from utilsgui import ToolTip
 from devicegui import DeviceGUI
+from caenbulk import CaenBulkReader, CHANNEL_STATUS_BITS
 
 class CaenHVPSGUI(DeviceGUI):
     def __init__(self, module, channel_names=None, checks=None, parent_frame=None, log=True, silence=False):
@@ -46,6 +47,7 @@ class CaenHVPSGUI(DeviceGUI):
         self.alarm_detected = True # to avoid sending the alarm message when the GUI is started with the module alarm already active
         self.ilk_detected = True # same as above but for the interlock
         self.silence_alarm = silence
+        self.bulk_reader = CaenBulkReader(module)
 
         if len(channel_names) < module.number_of_channels:
             for i in range(module.number_of_channels):
@@ -61,6 +63,7 @@ class CaenHVPSGUI(DeviceGUI):
                     precisions={"vmon": 1, "imon": 3},
                     units={"vset": "V", "vmon": "V", "imon": "uA"},
                     save_value={"vset": False, "vmon": True, "imon": True, "stat": False},
+                    status_flags={"stat": CHANNEL_STATUS_BITS},
                 )
         channels_states["board"] = ChannelState(
                 "board",
@@ -353,7 +356,7 @@ class CaenHVPSGUI(DeviceGUI):
         security_frame.grid(row=2, column=0, padx=10, pady=10, sticky="NWE")
         channels = {self.channels_name[i] : self.device.channels[i] for i in range(self.device.number_of_channels)}
         locks = tuple([self.device_lock])
-        self.checks_frame = ChecksFrame(security_frame, checks=self.checks, channels=channels, locks=locks)
+        self.checks_frame = ChecksFrame(security_frame, checks=self.checks, channels=channels, locks=locks, channels_states=self.channels_state, snapshot_hub=self.snapshot_hub)
         return security_frame
 
     def open_channel_property_window(self, channel_number):
@@ -545,12 +548,8 @@ class CaenHVPSGUI(DeviceGUI):
         entry.insert(0, str(self.device.channels[channel_number].vset))
 
     def read_values(self):
-        for i, ch in enumerate(self.device.channels):
-            vset = ch.vset
-            vmon = ch.vmon
-            imon = ch.imon
-            self.channels_state[self.channels_name[i]].set_state(
-                {"vset": vset, "vmon": vmon, "imon": imon, "stat": ch.stat.copy()})
+        for i, values in enumerate(self.bulk_reader.read()):
+            self.channels_state[self.channels_name[i]].set_state(values)
         self.channels_state["board"].set_state({
             "board_alarm_status": self.device.board_alarm_status.copy(),
             "interlock_status": self.device.interlock_status,
@@ -626,6 +625,7 @@ class CaenHVPSGUI(DeviceGUI):
                             message += f" ({self.channels_name[int(k[-1])]})"
                         message += ", "
                 self.alarm_detected = message
+                self.trigger_trip_capture("alarm")
                 self.action_when_alarm()
         else:
             self.alarm_detected = ""
@@ -633,6 +633,7 @@ class CaenHVPSGUI(DeviceGUI):
         if ilk:
             if not self.ilk_detected:
                 self.ilk_detected = "ILK"
+                self.trigger_trip_capture("interlock")
                 self.action_when_interlock()
         else:
             self.ilk_detected = ""
@@ -6,11 +6,16 @@ import threading
 import requests
 import json
 
-import copy
+from binarystore import BinaryRecordFormat, EXTENSION as BINARY_EXTENSION, segment_filename
+from ringbuffer import ChannelHistory
+
+import atexit
 import csv
 import datetime as dt
-from dataclasses import dataclass, field
+import time
+from collections.abc import Mapping
 from pathlib import Path
+from types import MappingProxyType
 
 LOG_DIR = "logs"
 
@@ -29,34 +34,401 @@ def get_full_filename_from_date(dt_obj, suffix="", extension="dat"):
     return f"{path}/{dt_obj.strftime('%Y%m%d')}_{suffix}.{extension}"
 
 
+# ============================================================
+# Background log writer
+# ============================================================
+class ChannelLogWriter:
+    """
+    Background writer of the channel log files, so the polling threads never touch the disk.
+
+    Rows are put in a bounded queue (never blocking: if the queue is full the rows are dropped
+    with a warning) and a worker thread appends them to the files, keeping the files open and
+    buffering the writes. The buffers are flushed when they reach flush_size bytes, every
+    flush_interval seconds and at shutdown. The files of previous days are closed as soon as
+    rows of a new day arrive.
+    Rows can be text (str, one line each) or binary records (bytes, written as they are). Binary
+    records are never appended to a file with another layout (header): they go to the next segment
+    of the file instead (see binarystore.segment_filename).
+    """
+    _STOP = object()
+
+    def __init__(self, max_queue_size=10000, flush_size=64 * 1024, flush_interval=5):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.files = {} # {filename: (open file, header)}
+        self.buffers = {} # {(filename, header): [lines or records]}
+        self.segments = {} # {(filename, header): file (segment) with that header}
+        self.buffered_bytes = 0
+        self.current_date = None
+        self.dropped_rows = 0
+        self.last_drop_warning_time = float("-inf")
+        self.drop_lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    def write(self, filename, header, rows, date=None):
+        """
+        Queue rows (strings without the newline) to be appended to filename. The header is written
+        first if the file does not exist yet. date (datetime.date) is used for the daily rotation.
+        """
+        if not rows:
+            return
+        try:
+            self.queue.put_nowait((filename, header, rows, date))
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped_rows += len(rows)
+                if time.monotonic() - self.last_drop_warning_time > 60: # do not flood the output
+                    self.last_drop_warning_time = time.monotonic()
+                    print(f"Warning: channel log queue full, dropping rows of {filename} ({self.dropped_rows} dropped so far)")
+
+    def flush(self, timeout=5):
+        """ Block until everything queued so far has been written to disk. """
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5):
+        """ Write everything pending and close the files. """
+        if not self.worker.is_alive():
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.worker.join(timeout)
+
+    def _run(self):
+        next_flush_time = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, next_flush_time - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._flush()
+                self._close_files()
+                return
+            if isinstance(item, threading.Event):
+                self._flush()
+                item.set()
+                continue
+            if item is not None:
+                filename, header, rows, date = item
+                if date is not None and date != self.current_date:
+                    # new day: write what is pending and close the files of the previous day
+                    if self.current_date is not None and date > self.current_date:
+                        self._flush()
+                        self._close_files()
+                    self.current_date = max(date, self.current_date or date)
+                lines = self.buffers.setdefault((filename, header), [])
+                for row in rows:
+                    if isinstance(row, str):
+                        row += "\n"
+                    lines.append(row)
+                    self.buffered_bytes += len(row)
+
+            if self.buffered_bytes >= self.flush_size or time.monotonic() >= next_flush_time:
+                self._flush()
+                next_flush_time = time.monotonic() + self.flush_interval
+
+    def _has_header(self, filename, header):
+        """ True if the binary records with header can be appended to filename (new file or same header). """
+        if filename in self.files:
+            return self.files[filename][1] == header
+        if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+            return True
+        with open(filename, 'rb') as existing:
+            return existing.read(len(header)) == header
+
+    def _segment(self, filename, header):
+        """ First segment of filename with the layout described by header (or a new one). """
+        key = (filename, header)
+        if key not in self.segments:
+            n = 0
+            segment = filename
+            while not self._has_header(segment, header):
+                n += 1
+                segment = segment_filename(filename, n)
+            if n:
+                print(f"{filename} has a different record layout, writing to {segment}")
+            self.segments[key] = segment
+        return self.segments[key]
+
+    def _open(self, filename, header):
+        binary = isinstance(header, bytes)
+        if binary:
+            filename = self._segment(filename, header)
+        if filename in self.files:
+            return self.files[filename][0]
+        create_directory_recursive(filename)
+        new_file = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+        file = open(filename, 'ab' if binary else 'a')
+        if new_file:
+            if header:
+                file.write(header if binary else header + "\n")
+            print("Writing to new file:", filename)
+        self.files[filename] = (file, header)
+        return file
+
+    def _flush(self):
+        for (filename, header), lines in self.buffers.items():
+            try:
+                file = self._open(filename, header)
+                file.write(b"".join(lines) if isinstance(header, bytes) else "".join(lines))
+                file.flush()
+            except OSError as e:
+                print(f"Error writing to {filename}: {e}")
+                self._close_file(self.segments.get((filename, header), filename))
+        self.buffers.clear()
+        self.buffered_bytes = 0
+
+    def _close_file(self, filename):
+        file, _ = self.files.pop(filename, (None, None))
+        if file is None:
+            return
+        try:
+            file.close()
+        except OSError as e:
+            print(f"Error closing {filename}: {e}")
+
+    def _close_files(self):
+        for filename in list(self.files):
+            self._close_file(filename)
+        self.segments.clear()
+
+
+_default_log_writer = None
+_default_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    """ Returns the log writer shared by all the channels (started on first use). """
+    global _default_log_writer
+    with _default_log_writer_lock:
+        if _default_log_writer is None:
+            _default_log_writer = ChannelLogWriter()
+        return _default_log_writer
+
+
+# ============================================================
+# Recording modes
+# ============================================================
+RECORDING_MODES = ("deadband", "swinging_door")
+
+def get_recording_mode(threshold):
+    """ Recording mode of a threshold: a number is a deadband, a dict gives its mode ({"mode": ..., "value": ...}). """
+    if isinstance(threshold, dict):
+        return threshold.get("mode", "deadband")
+    return "deadband"
+
+def get_threshold_value(threshold):
+    """ Numeric value (deadband or tolerance) of a threshold. """
+    if isinstance(threshold, dict):
+        return threshold.get("value", 0)
+    return threshold
+
+
+class SwingingDoor:
+    """
+    Swinging door compression of one value. The door is the range of slopes from the last stored
+    point that keep every point seen since then within tolerance. While the slope to the newest
+    point is inside the door, the points in between can be reconstructed by linear interpolation
+    and do not need to be stored. When it falls outside (the door closes), the previous point
+    has to be stored and a new door starts from it.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.archived = None # (time, value) of the last stored point
+        self.upper = float("inf")
+        self.lower = float("-inf")
+
+    def start(self, t, value):
+        """ Start a new door from a stored point. """
+        self.archived = (t, value)
+        self.upper = float("inf")
+        self.lower = float("-inf")
+
+    def _slopes(self, t, value):
+        t0, v0 = self.archived
+        dt_ = t - t0
+        if dt_ <= 0:
+            return self.upper, self.lower
+        upper = min(self.upper, (value + self.tolerance - v0) / dt_)
+        lower = max(self.lower, (value - self.tolerance - v0) / dt_)
+        return upper, lower
+
+    def fits(self, t, value):
+        """ True if the line from the stored point to this one is within tolerance of all the points in between. """
+        if self.archived is None:
+            return False
+        t0, v0 = self.archived
+        if t <= t0:
+            return True
+        slope = (value - v0) / (t - t0)
+        return self.lower <= slope <= self.upper
+
+    def add(self, t, value):
+        if self.archived is None:
+            self.start(t, value)
+            return
+        self.upper, self.lower = self._slopes(t, value)
+
+
 # ============================================================
 # Generic immutable state snapshot
 # ============================================================
 
-@dataclass(frozen=True)
-class State:
+UNKNOWN = '??' # value of a status flag that could not be read
+
+_names_cache = {} # interned tuples of value/flag names, shared by all the snapshots with the same keys
+
+def _intern_names(names):
+    names = tuple(names)
+    return _names_cache.setdefault(names, names)
+
+
+class StatusFlags(Mapping):
+    """
+    Immutable set of status flags ({flag: True/False/'??'}) stored as two bitmasks over a shared
+    tuple of flag names. It behaves like a read-only dict, is hashable and cheap to compare.
+    """
+    __slots__ = ("names", "bits", "unknown")
+
+    def __init__(self, names, bits=0, unknown=0):
+        object.__setattr__(self, "names", _intern_names(names))
+        object.__setattr__(self, "bits", bits)
+        object.__setattr__(self, "unknown", unknown)
+
+    @classmethod
+    def from_dict(cls, flags):
+        """ Returns the StatusFlags of a dict of booleans (or '??'), None if it has other kind of values. """
+        bits = 0
+        unknown = 0
+        for i, value in enumerate(flags.values()):
+            if isinstance(value, str):
+                if value != UNKNOWN:
+                    return None
+                unknown |= 1 << i
+            elif value is True or value is False or value in (0, 1):
+                if value:
+                    bits |= 1 << i
+            else:
+                return None
+        return cls(flags.keys(), bits, unknown)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StatusFlags is immutable")
+
+    def __getitem__(self, flag):
+        try:
+            i = self.names.index(flag)
+        except ValueError:
+            raise KeyError(flag)
+        if self.unknown >> i & 1:
+            return UNKNOWN
+        return bool(self.bits >> i & 1)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other):
+        if isinstance(other, StatusFlags):
+            return self.bits == other.bits and self.unknown == other.unknown and self.names == other.names
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return hash((self.names, self.bits, self.unknown))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        return self # immutable
+
+
+def _freeze(value):
+    """ Immutable version of a reading: status dicts become StatusFlags, lists tuples. """
+    if isinstance(value, StatusFlags):
+        return value
+    if isinstance(value, Mapping):
+        flags = StatusFlags.from_dict(value)
+        return flags if flags is not None else MappingProxyType(dict(value))
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class State(Mapping):
     """
-    Generic immutable snapshot of channel/device state.
+    Generic immutable snapshot of channel/device state. It is a read-only mapping {value name: value}
+    backed by a tuple (status dicts are stored as StatusFlags), so it can be shared between the
+    reading thread, the GUI, the checks and the logger without copying. It is hashable as long as
+    its values are.
     """
-    timestamp: dt.datetime = field(default_factory=dt.datetime.now)
-    values: dict = field(default_factory=dict)
+    __slots__ = ("timestamp", "names", "data")
+
+    def __init__(self, timestamp=None, values=None):
+        values = values or {}
+        object.__setattr__(self, "timestamp", timestamp if timestamp is not None else dt.datetime.now())
+        object.__setattr__(self, "names", _intern_names(values.keys()))
+        object.__setattr__(self, "data", tuple(_freeze(value) for value in values.values()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("State is immutable")
+
+    def __getitem__(self, key):
+        try:
+            return self.data[self.names.index(key)]
+        except ValueError:
+            raise KeyError(key)
 
     def get(self, key, default=None):
-        return self.values.get(key, default)
+        try:
+            return self.data[self.names.index(key)]
+        except ValueError:
+            return default
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        return zip(self.names, self.data)
+
+    def __eq__(self, other):
+        if not isinstance(other, State):
+            return NotImplemented
+        return self.timestamp == other.timestamp and self.names == other.names and self.data == other.data
+
+    def __hash__(self):
+        return hash((self.timestamp, self.names, self.data))
+
+    def copy(self):
+        return self # immutable
 
     def to_dict(self):
         return {
             "timestamp": self.timestamp,
-            **self.values
+            **{key: dict(value) if isinstance(value, Mapping) else value for key, value in self.items()}
         }
 
-    def __str__(self):
-
-        values_str = ", ".join(
-            f"{k}: {v} ({self.units.get(k, '')})".strip()
-            for k, v in self.values.items()
-        )
+    def __repr__(self):
+        return f"State(timestamp={self.timestamp!r}, values={dict(self.items())!r})"
 
+    def __str__(self):
+        values_str = ", ".join(f"{k}: {v}" for k, v in self.items())
         return f"{self.timestamp} | {values_str}"
 
 
@@ -70,19 +442,35 @@ class ChannelState:
     Features:
     - current/previous/last_saved snapshots
     - generic variable support
-    - threshold-based logging
+    - threshold-based logging (deadband or swinging door compression) with optional heartbeat rows
     - CSV writing
     - immutable state snapshots
     """
 
-    def __init__(self, channel_name, value_names, thresholds=None, precisions=None, units=None, save_value=None):
+    STORAGE_BACKENDS = ("text", "binary", "both")
+
+    def __init__(self, channel_name, value_names, thresholds=None, precisions=None, units=None, save_value=None, log_writer=None, storage="text", heartbeat_time=None, history_capacity=86400, status_flags=None):
 
         self.name = channel_name
         self.value_names = value_names
 
+        # Flags of the status values, used for the layout of the binary log files. Example: {"stat": ["ON", "RUP", "TRIP"]}
+        # The flags of a status value not declared here are taken from its first reading.
+        self.status_flags = status_flags or {}
+
         # Thresholds for deciding whether a value changed enough to trigger logging.
         # Example: { "vmon": 0.5, "imon": 0.01, "pressure": 0.1,}
+        # A number is a deadband: a row is saved when the value moves more than it from the last saved one.
+        # A dict selects the recording mode, e.g. {"mode": "swinging_door", "value": 0.01} only saves the
+        # points needed to reconstruct the value by linear interpolation within 0.01.
         self.thresholds = thresholds or {}
+        for key, threshold in self.thresholds.items():
+            if get_recording_mode(threshold) not in RECORDING_MODES:
+                raise ValueError(f"Unknown recording mode for '{key}' in channel '{self.name}': {threshold}")
+        self.doors = {} # {key: SwingingDoor}
+
+        # Save a row at least every heartbeat_time seconds, even if nothing changed (None or 0 to disable)
+        self.heartbeat_time = heartbeat_time
 
         # Precision for file output (number of decimal places) for specific variables.Example:{"vmon": 1,"imon": 3,}
         self.precisions = precisions or {}
@@ -100,15 +488,30 @@ class ChannelState:
         
         self.lock = threading.Lock()
 
+        # rows are written to disk by a background ChannelLogWriter (the shared one if not given)
+        self.log_writer = log_writer
+
+        # "text": space delimited .dat files, "binary": fixed-width records in .bin files (see binarystore.py), "both"
+        if storage not in self.STORAGE_BACKENDS:
+            raise ValueError(f"storage must be one of {self.STORAGE_BACKENDS}")
+        self.storage = storage
+        self.binary_format = None # created from the first saved state
+
+        # in-memory history of the readings (e.g. 24 h at 1 Hz), None or 0 to disable
+        self.history = ChannelHistory(history_capacity) if history_capacity else None
+
     def set_state(self, values: dict):
         # check that values has the expected keys
         for key in self.value_names:
             if key not in values:
                 raise ValueError(f"Missing value for '{key}' in channel '{self.name}'")
 
+        state = State(values=values) # built outside the lock, it does not share anything with values
         with self.lock:
             self.previous = self.current
-            self.current = State(values=copy.deepcopy(values))
+            self.current = state
+        if self.history is not None:
+            self.history.append(state.timestamp, state)
     
     def get_value(self, key, default=None):
         with self.lock:
@@ -119,12 +522,16 @@ class ChannelState:
             return self.current
     
     def get_values(self):
+        """ Returns the current (immutable) State, which can be used as a read-only dict. """
         with self.lock:
-            return self.current.values.copy()
+            return self.current
 
     def is_different(self):
         for key, threshold in self.thresholds.items():
             current_value = self.current.get(key)
+            if get_recording_mode(threshold) == "swinging_door" and self._is_door_value(current_value):
+                continue # checked by the swinging doors
+            threshold = get_threshold_value(threshold)
             saved_value = self.last_saved.get(key)
 
             if current_value is None and saved_value is None:
@@ -147,15 +554,93 @@ class ChannelState:
     # ========================================================
     # Logging
     # ========================================================
-    def save_state(self, force=False, save_previous=True):
+    def _is_door_value(self, value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def _door_keys(self):
+        return [
+            key for key, threshold in self.thresholds.items()
+            if get_recording_mode(threshold) == "swinging_door" and self._is_door_value(self.current.get(key))
+        ]
+
+    def _start_doors(self, state):
+        for key in self._door_keys():
+            if key not in self.doors:
+                self.doors[key] = SwingingDoor(get_threshold_value(self.thresholds[key]))
+            self.doors[key].tolerance = get_threshold_value(self.thresholds[key]) # it may have been changed
+            self.doors[key].start(state.timestamp.timestamp(), state.get(key))
+
+    def _add_to_doors(self, state):
+        for key in self._door_keys():
+            self.doors[key].add(state.timestamp.timestamp(), state.get(key))
+
+    def _is_door_closed(self):
+        t = self.current.timestamp.timestamp()
+        return any(
+            key not in self.doors or not self.doors[key].fits(t, self.current.get(key))
+            for key in self._door_keys()
+        )
+
+    def _is_heartbeat_due(self):
+        if not self.heartbeat_time or not self.last_saved:
+            return False
+        return (self.current.timestamp - self.last_saved.timestamp).total_seconds() >= self.heartbeat_time
+
+    def _get_states_to_save(self, force, save_previous):
+        """ States that must be saved after the last set_state (in order), updating last_saved and the doors. """
+        states = []
+        if self._is_door_closed() and not force:
+            # the previous point is the last one the doors could reconstruct: store it and start from it
+            if self.previous and self.last_saved != self.previous:
+                states.append(self.previous)
+                self.last_saved = self.previous
+            if self.previous:
+                self._start_doors(self.previous)
+                self._add_to_doors(self.current)
+            else: # first reading
+                force = True
+        if force or self.is_different() or self._is_heartbeat_due():
+            if self.last_saved != self.previous and save_previous and self.previous and not states:
+                states.append(self.previous)
+            states.append(self.current)
+            self.last_saved = self.current
+            self._start_doors(self.current)
+        elif not states:
+            self._add_to_doors(self.current)
+        return states
+
+    def save_state(self, force=False, save_previous=True, storage=None):
+        storage = storage or self.storage
         with self.lock:
-            if not (force or self.is_different()):
+            states = self._get_states_to_save(force, save_previous)
+            if not states:
                 return
-            filename = get_full_filename_from_date(self.current.timestamp, suffix=self.name.replace(" ", ""))
-            if self.last_saved != self.previous and save_previous:
-                self.write_state_to_file(self.previous, filename, delimiter=' ')
-            self.write_state_to_file(self.current, filename, delimiter=' ')
-            self.last_saved = self.current
+            timestamp = self.current.timestamp
+
+        # the states are immutable, the rows can be built without holding the lock
+        if self.log_writer is None:
+            self.log_writer = get_log_writer()
+        suffix = self.name.replace(" ", "")
+        if storage in ("text", "both"):
+            rows = [self._state_to_str(state, delimiter=' ') for state in states]
+            rows = [row for row in rows if row] # empty if only timestamp and no values to save
+            filename = get_full_filename_from_date(timestamp, suffix=suffix)
+            self.log_writer.write(filename, self.file_header_str(delimiter=' '), rows, date=timestamp.date())
+        if storage in ("binary", "both"):
+            states = [state for state in states if state]
+            if not states:
+                return
+            if self.binary_format is None:
+                # same layout in every session (a partial first reading must not change it)
+                status_flags = dict(self.status_flags)
+                for key in self.value_names:
+                    value = states[-1].get(key)
+                    if key not in status_flags and isinstance(value, Mapping):
+                        status_flags[key] = list(value.keys())
+                self.binary_format = BinaryRecordFormat.from_schema(self.name, self.value_names, status_flags, units=self.units)
+            rows = [self.binary_format.encode(state.timestamp, state) for state in states]
+            filename = get_full_filename_from_date(timestamp, suffix=suffix, extension=BINARY_EXTENSION)
+            self.log_writer.write(filename, self.binary_format.header_bytes(), rows, date=timestamp.date())
 
     def file_header_row(self):
         header = ["Time"]
@@ -175,7 +660,7 @@ class ChannelState:
 
         row = [state.timestamp.strftime("%Y-%m-%d %H:%M:%S")]
 
-        for key, value in state.values.items():
+        for key, value in state.items():
             if not self.save_value.get(key, True):
                 continue
             precision = self.precisions.get(key)
@@ -184,7 +669,7 @@ class ChannelState:
                 and isinstance(value, (int, float))
             ):
                 value = f"{value:.{precision}f}"
-            row.append(value)
+            row.append(str(value))
 
         return row
     
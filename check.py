@@ -1,6 +1,153 @@
+import ast
+import datetime as dt
+import functools
 import toml
 from contextlib import ExitStack
 
+import numpy as np
+
+from channel import UNKNOWN
+
+# builtins that can be used in the conditions
+SAFE_BUILTINS = {"abs": abs, "int": int, "float": float, "str": str, "bool": bool}
+
+# syntax allowed in the conditions: arithmetic, comparisons, boolean logic, calls to the safe
+# builtins, channels and channel attributes (channel.attribute)
+ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Attribute, ast.Call, ast.Tuple, ast.List,
+    ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.IfExp,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+)
+
+
+# same builtins (and the boolean operators) working element-wise on NumPy arrays, to simulate many
+# steps of a plan at once (see Check.simulate_eval_plan)
+VECTOR_BUILTINS = {
+    "abs": np.abs,
+    "int": np.trunc,
+    "float": lambda x: np.asarray(x, dtype=float),
+    "bool": lambda x: np.asarray(x, dtype=bool),
+    # 'a and b' is b where a is true and a elsewhere (as in python, not only True/False)
+    "_and": lambda *args: functools.reduce(lambda a, b: np.where(a, b, a), args),
+    "_or": lambda *args: functools.reduce(lambda a, b: np.where(a, a, b), args),
+    "_not": np.logical_not,
+    "_where": np.where,
+    # booleans are numbers in the arithmetic (True + True is 2, not True as in NumPy)
+    "_num": lambda x: np.asarray(x, dtype=int) if np.asarray(x).dtype == bool else x,
+}
+
+
+# channel attributes that are not stored as such in the ChannelState snapshots:
+# {attribute: (status value name, flags to look for)}
+SNAPSHOT_STATUS_ATTRIBUTES = {"on": ("stat", ("ON", "HV"))} # CAEN ON bit, Spellman HV status
+
+
+def get_snapshot_value(state, attribute):
+    """ Value of a channel attribute in a State, None if it is not available. """
+    value = state.get(attribute)
+    if value is None and attribute in SNAPSHOT_STATUS_ATTRIBUTES:
+        status_name, flags = SNAPSHOT_STATUS_ATTRIBUTES[attribute]
+        status = state.get(status_name) or {}
+        value = next((status[flag] for flag in flags if flag in status), None)
+    if isinstance(value, str) and value == UNKNOWN: # could not be read, the live value is used instead
+        return None
+    return value
+
+
+class _ConditionCompiler(ast.NodeTransformer):
+    """
+    Validates the AST of a condition and replaces every 'channel.attribute' by a variable, so
+    the attributes are read once per evaluation without inspecting the channels again.
+    """
+
+    def __init__(self, channels : dict):
+        self.channels = channels
+        self.accessors = {} # {(channel, attribute): variable name}
+        self.channel_names = set() # channels used directly (not through an attribute)
+
+    def generic_visit(self, node):
+        if not isinstance(node, ALLOWED_NODES):
+            raise SyntaxError(f"'{type(node).__name__}' is not allowed")
+        return super().generic_visit(node)
+
+    def visit_Call(self, node):
+        if not (isinstance(node.func, ast.Name) and node.func.id in SAFE_BUILTINS):
+            raise NameError(f"only {', '.join(SAFE_BUILTINS)} can be called")
+        node.args = [self.visit(arg) for arg in node.args]
+        node.keywords = [ast.keyword(arg=k.arg, value=self.visit(k.value)) for k in node.keywords]
+        return node
+
+    def visit_Attribute(self, node):
+        if not isinstance(node.value, ast.Name) or node.value.id not in self.channels:
+            raise NameError(f"'{ast.unparse(node)}' is not an attribute of a channel")
+        channel, attribute = node.value.id, node.attr
+        if attribute.startswith("_") or attribute not in dir(self.channels[channel]):
+            raise NameError(f"channel '{channel}' has no attribute '{attribute}'")
+        key = (channel, attribute)
+        if key not in self.accessors:
+            self.accessors[key] = f"_{channel}_{attribute}_{len(self.accessors)}"
+        return ast.copy_location(ast.Name(id=self.accessors[key], ctx=ast.Load()), node)
+
+    def visit_Name(self, node):
+        if node.id in SAFE_BUILTINS:
+            return node
+        if node.id not in self.channels:
+            raise NameError(f"name '{node.id}' is not defined")
+        self.channel_names.add(node.id)
+        return node
+
+
+class _Vectorizer(ast.NodeTransformer):
+    """
+    Rewrites a compiled condition (see _ConditionCompiler) to work element-wise on arrays: boolean
+    operators, chained comparisons and conditional expressions become calls to VECTOR_BUILTINS.
+    Raises SyntaxError if the condition cannot be vectorized (str, in, is).
+    """
+
+    def _call(self, name, args, node):
+        return ast.copy_location(ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[]), node)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return self._call("_and" if isinstance(node.op, ast.And) else "_or", node.values, node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call("_not", [node.operand], node)
+        node.operand = self._call("_num", [node.operand], node)
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        node.left = self._call("_num", [node.left], node)
+        node.right = self._call("_num", [node.right], node)
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call("_where", [node.test, node.body, node.orelse], node)
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if any(isinstance(op, (ast.In, ast.NotIn, ast.Is, ast.IsNot)) for op in node.ops):
+            raise SyntaxError("'in' and 'is' cannot be vectorized")
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [
+            ast.copy_location(ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]]), node)
+            for i, op in enumerate(node.ops)
+        ]
+        return self._call("_and", pairs, node)
+
+    def visit_Name(self, node):
+        if node.id == "str":
+            raise SyntaxError("'str' cannot be vectorized")
+        return node
+
+
 class Check:
     def __init__(self, name : str, condition : str, channels : dict = None, description : str = "", active=True):
         self.name = name
@@ -14,14 +161,42 @@ class Check:
         self.condition = condition
         for ch in channels.keys():
             self.condition = self.condition.replace(ch, ch.replace(" ", "")) # erase the spaces in the channel names
-        try:
-            self.code = compile(self.condition, "<string>", "eval")
-        except SyntaxError as e:
-            # print(f"Check '{self.name}': syntax error in '{self.condition}'")
-            self.code = None
+        self.compile_condition()
 
         self.description = description
         self.active = active
+        self.channels_states = {}
+
+    def compile_condition(self):
+        """
+        Parse and validate the condition against the current channels. Sets self.code (None if
+        the condition is not valid, the reason is in self.error), self.accessors
+        ([(variable, channel, attribute), ...]) and self.channel_names.
+        """
+        self.code = None
+        self.vector_code = None # element-wise version of the condition, None if it cannot be vectorized
+        self.error = None
+        self.accessors = []
+        self.channel_names = []
+        try:
+            tree = ast.parse(self.condition.strip(), mode="eval")
+            compiler = _ConditionCompiler(self.channels)
+            tree = ast.fix_missing_locations(compiler.visit(tree))
+            self.code = compile(tree, "<string>", "eval")
+        except (SyntaxError, NameError) as e:
+            self.error = f"Check '{self.name}': invalid condition '{self.condition}' ({e})"
+            return False
+        try:
+            self.vector_code = compile(ast.fix_missing_locations(_Vectorizer().visit(tree)), "<string>", "eval")
+        except SyntaxError:
+            pass
+        self.accessors = [(variable, ch, attr) for (ch, attr), variable in compiler.accessors.items()]
+        self.channel_names = sorted(compiler.channel_names)
+        return True
+
+    def get_used_attributes(self):
+        """ Returns the (channel, attribute) pairs read by the condition. """
+        return [(ch, attr) for _, ch, attr in self.accessors]
 
     def is_available(self):
         return self.active and (self.code is not None)
@@ -33,42 +208,137 @@ class Check:
         self.channels = {k.replace(" ", ""): v for k, v in channels.items()}
         for ch in channels.keys():
             self.condition = self.condition.replace(ch, ch.replace(" ", ""))
-        try:
-            self.code = compile(self.condition, "<string>", "eval")
-        except SyntaxError as e:
-            print(f"Check '{self.name}': syntax error in '{self.condition}'")
-            self.code = None
+        if not self.compile_condition():
+            print(self.error)
+
+    def set_channels_states(self, channels_states : dict):
+        """ ChannelState of the channels ({channel name: ChannelState}), used to evaluate the condition from snapshots. """
+        self.channels_states = {k.replace(" ", ""): v for k, v in channels_states.items()}
 
-    def eval_condition(self):
+    def get_snapshot_namespace(self, max_age=None, skip=(), states=None):
+        """
+        Values of the attributes used by the condition taken from the latest ChannelState snapshots
+        (except the variables in skip), or from states ({channel name without spaces: State}, e.g. a
+        SnapshotView of all the devices) if given. Returns None if any of them is not available or
+        its snapshot is older than max_age seconds (the condition has to be evaluated with the live
+        values then).
+        """
+        if any(ch not in skip for ch in self.channel_names): # whole channel objects cannot come from a snapshot
+            return None
+        now = dt.datetime.now()
+        used_states = {}
+        namespace = {}
+        for variable, ch, attr in self.accessors:
+            if variable in skip:
+                continue
+            if ch not in used_states:
+                if states is not None:
+                    state = states.get(ch)
+                else:
+                    chstate = self.channels_states.get(ch)
+                    state = chstate.get_state() if chstate is not None else None
+                if not state or (max_age is not None and (now - state.timestamp).total_seconds() > max_age):
+                    return None
+                used_states[ch] = state
+            value = get_snapshot_value(used_states[ch], attr)
+            if value is None:
+                return None
+            namespace[variable] = value
+        return namespace
+
+    def get_live_namespace(self, skip=()):
+        # only the attributes found when compiling the condition are read, once each
+        namespace = {variable: getattr(self.channels[ch], attr) for variable, ch, attr in self.accessors if variable not in skip}
+        for ch in self.channel_names:
+            if ch not in skip:
+                namespace[ch] = self.channels[ch]
+        return namespace
+
+    def get_namespace(self, use_snapshots=False, max_age=None, skip=(), states=None):
+        namespace = self.get_snapshot_namespace(max_age, skip, states) if use_snapshots else None
+        if namespace is None:
+            namespace = self.get_live_namespace(skip)
+        return namespace
+
+    def eval_namespace(self, namespace : dict):
+        return eval(self.code, {"__builtins__": SAFE_BUILTINS}, namespace)
+
+    def eval_condition(self, use_snapshots=False, max_age=None, states=None):
+        """
+        Evaluate the condition. With use_snapshots, the values are taken from the ChannelState
+        snapshots (see set_channels_states) or from states if given, if they are not older than
+        max_age seconds, falling back to reading the channels.
+        """
         if not self.active:
             return True
         if self.code is None:
-            print(f"Check '{self.name}': syntax error in '{self.condition}'")
+            print(self.error)
             return False
+        return self.eval_namespace(self.get_namespace(use_snapshots, max_age, states=states))
 
-        # add all the channels attributes to the allowed objects
-        channels = self.channels.copy()
-        allowed_objects = {"abs", "int", "float", "str", "bool"}
-        allowed_objects.update(channels.keys())
-        for ch in channels.values():
-            ch_attr = [attr for attr in dir(ch) if not attr.startswith("_")]
-            allowed_objects.update(ch_attr)
-        #print(allowed_objects)
-        #print(self.code.co_names)
-        # safe usage of eval using a restricted set of objects
-        for name in self.code.co_names:
-            if name not in allowed_objects:
-                raise NameError(f"Check '{self.name}': name '{name}' in '{self.condition}' is not defined")
-        return eval(self.code, {"__builtins__": {"abs":abs, "int":int, "float":float, "str":str, "bool":bool}}, channels)
-
-    def simulate_eval_condition(self, channels_values : dict ):
-        condition_replaced = self.condition
-        for ch, val in channels_values.items():
-            condition_replaced = condition_replaced.replace(ch, str(val))
-        
-        code = compile(condition_replaced, "<string>", "eval")
+    def get_overrides(self, channels_values : dict):
+        """ Variables of the compiled condition for the values {"channel.attribute" or "channel": value}. """
+        variables = {f"{ch}.{attr}": variable for variable, ch, attr in self.accessors}
+        overrides = {}
+        for key, value in channels_values.items():
+            key = key.replace(" ", "")
+            if key in variables:
+                overrides[variables[key]] = value
+            elif key in self.channel_names:
+                overrides[key] = value
+        return overrides
 
-        return eval(code, {"__builtins__": {"abs":abs, "int":int, "float":float, "str":str, "bool":bool}}, self.channels.copy())
+    def simulate_eval_condition(self, channels_values : dict, use_snapshots=False, max_age=None, states=None):
+        """
+        Evaluate the condition as if the given attributes had the given values
+        ({"channel.attribute": value}, e.g. {"gemtop.vset": 300}). The other values are read as in eval_condition.
+        """
+        if self.code is None:
+            print(self.error)
+            return False
+        overrides = self.get_overrides(channels_values)
+        namespace = self.get_namespace(use_snapshots, max_age, skip=overrides, states=states)
+        namespace.update(overrides)
+        return self.eval_namespace(namespace)
+
+    def simulate_eval_plan(self, channels_values : dict, n_steps : int, use_snapshots=False, max_age=None, states=None):
+        """
+        Simulate the condition for all the steps of a plan at once. channels_values has an array of
+        n_steps values for every simulated attribute ({"channel.attribute": array}), the other values
+        are read once. Returns a boolean array with the result of every step.
+        """
+        if self.code is None:
+            print(self.error)
+            return np.zeros(n_steps, dtype=bool)
+        overrides = self.get_overrides(channels_values)
+        namespace = self.get_namespace(use_snapshots, max_age, skip=overrides, states=states)
+        result = self.eval_plan_vectorized(namespace, overrides, n_steps)
+        if result is None:
+            result = self.eval_plan_steps(namespace, overrides, n_steps)
+        return result
+
+    def eval_plan_steps(self, namespace : dict, overrides : dict, n_steps : int):
+        """ Evaluate the condition step by step, reusing the values read (namespace). """
+        return np.array([
+            bool(self.eval_namespace({**namespace, **{k: v[i] for k, v in overrides.items()}}))
+            for i in range(n_steps)
+        ], dtype=bool)
+
+    def eval_plan_vectorized(self, namespace : dict, overrides : dict, n_steps : int):
+        """
+        Evaluate all the steps at once with the element-wise version of the condition. Returns None
+        if the condition cannot be vectorized or NumPy cannot evaluate it (e.g. 2 ** -1 with integers), the steps
+        have to be evaluated one by one then.
+        """
+        if self.vector_code is None:
+            return None
+        namespace = {**namespace, **{k: np.asarray(v) for k, v in overrides.items()}}
+        try:
+            with np.errstate(all="ignore"):
+                result = eval(self.vector_code, {"__builtins__": VECTOR_BUILTINS}, namespace)
+        except (TypeError, ValueError):
+            return None
+        return np.broadcast_to(np.asarray(result, dtype=bool), (n_steps,)).copy()
 
     
     def eval_condition_with_action(self):
@@ -84,27 +354,17 @@ class CheckWithLock(Check):
         self.device_locks = devices_locks
 
     def set_devices(self, devices_locks : tuple):
-        self.devices_locks = devices_locks
+        self.device_locks = devices_locks
 
-    def eval_condition(self):
-        # ExitStack allows us to manage a dynamic number of context managers
-        with ExitStack() as stack:
-            # Acquire all locks
-            for lock in self.device_locks:
-                stack.enter_context(lock)
-            # Once all locks are acquired, perform the action
-            rtrn = super().eval_condition()
-        
-        return rtrn
-    
-    def simulate_eval_condition(self, channels_values : dict):
+    def get_live_namespace(self, skip=()):
+        # the snapshots do not need the devices locks, only the live reads
         # ExitStack allows us to manage a dynamic number of context managers
         with ExitStack() as stack:
-            # Acquire all locks
-            for lock in self.device_locks:
+            # Acquire all locks, always in the same order (by id) to avoid deadlocks with other checks
+            for lock in sorted(self.device_locks, key=id):
                 stack.enter_context(lock)
             # Once all locks are acquired, perform the action
-            rtrn = super().simulate_eval_condition(channels_values)
+            rtrn = super().get_live_namespace(skip)
         
         return rtrn
 
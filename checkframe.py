@@ -2,23 +2,30 @@ import tkinter as tk
 from tkinter import messagebox
 import threading
 import time
+import datetime as dt
 
-from check import Check, CheckWithLock
+import numpy as np
+
+from check import Check, CheckWithLock, get_snapshot_value
 from utilsgui import ToolTip
 
 class ChecksFrame:
-    def __init__(self, parent_frame = None, checks = None, channels = None, locks = None):
+    def __init__(self, parent_frame = None, checks = None, channels = None, locks = None, channels_states = None, snapshot_hub = None):
         if checks is None:
             checks = []
         if channels is None:
             channels = {}
         if locks is None:
             locks = {}
+        if channels_states is None:
+            channels_states = {}
 
         self.root = parent_frame
         self.checks = checks
         self.channels = channels
         self.locks = locks
+        self.channels_states = channels_states # {channel name: ChannelState} to evaluate the checks from the latest readings
+        self.snapshot_hub = snapshot_hub # if given, the latest complete read cycle of every device is used (see snapshothub.py)
 
         self.checks_vars = []
         self.checks_checkboxes = []
@@ -26,9 +33,25 @@ class ChecksFrame:
         self.checks_states = []
         self.edit_checks_button = None
 
+        # incremental evaluation: only the checks whose inputs changed are evaluated again
+        self.dependency_index = {} # {(channel, attribute): [check index, ...]}
+        self.indexed_checks = [] # checks of the dependency index, to detect changes in self.checks
+        self.last_inputs = {} # {(channel, attribute): value in the last evaluation}
+        self.last_full_check_time = 0
+        self.last_live_check_time = 0 # last evaluation that read the devices (some input not in the snapshots)
+        self.pending_live_checks = set() # checks waiting for the next live evaluation
+
+        # event-driven evaluation: set when a device publishes new readings of the channels of the checks
+        self.new_readings_event = threading.Event()
+
         self.config_params = {
             "show_warning_window": True,
             "seconds_between_checks": 2,
+            "use_snapshots": True, # evaluate from the latest readings instead of querying the devices
+            "snapshot_max_age": 15, # seconds, older readings are read again from the devices
+            "seconds_between_full_checks": 30, # all the checks are evaluated, even if their inputs did not change
+            "event_driven": True, # evaluate right after new readings (seconds_between_checks is then only a watchdog)
+            "check_debounce_time": 0.1, # seconds to wait for the readings of other devices before evaluating
         }
 
         self.create_security_frame()
@@ -147,6 +170,7 @@ class ChecksFrame:
                 description = description_entries[i].get()
                 channels = self.channels.copy() # set all the channels for the checks
                 self.checks[i] = Check(name, condition, channels, description)
+                self.checks[i].set_channels_states(self.channels_states)
                 self.checks_checkboxes[i].config(text=f" {name}")
                 self.checks_tooltips[i].change_text(description)
             new_window.destroy()
@@ -217,21 +241,107 @@ class ChecksFrame:
         # set all the channels for the checks, just in case the channels are not initialized
         for check in self.checks:
             check.set_channels(self.channels)
+            check.set_channels_states(self.channels_states)
         # set all the devices locks for the checks, just in case the devices locks are not initialized
         for check in self.checks:
             if isinstance(check, CheckWithLock):
                 check.set_devices(self.locks)
 
+    def build_dependency_index(self):
+        """ Reverse index of the (channel, attribute) pairs read by the checks. The next evaluation is a full sweep. """
+        self.dependency_index = {}
+        for i, check in enumerate(self.checks):
+            for key in check.get_used_attributes():
+                self.dependency_index.setdefault(key, []).append(i)
+        self.indexed_checks = list(self.checks)
+        self.last_inputs = {}
+        self.last_full_check_time = 0
+        self.pending_live_checks = set()
+
+    def get_snapshot_states(self):
+        """
+        Latest State of every channel ({channel name without spaces: State}), taken once per evaluation
+        so all the checks see the same readings. The snapshot hub view (if any) has priority over the
+        current States of the channels.
+        """
+        states = {k.replace(" ", ""): v.get_state() for k, v in self.channels_states.items()}
+        if self.snapshot_hub is not None:
+            states.update({k.replace(" ", ""): v for k, v in self.snapshot_hub.get_view().states.items()})
+        return states
+
+    def read_inputs(self, states):
+        """ Snapshot value of every indexed (channel, attribute) in states, None if not available or too old. """
+        max_age = self.config_params["snapshot_max_age"]
+        now = dt.datetime.now()
+        inputs = {}
+        for ch, attr in self.dependency_index:
+            state = states.get(ch)
+            if state and max_age is not None and (now - state.timestamp).total_seconds() > max_age:
+                state = None
+            inputs[(ch, attr)] = get_snapshot_value(state, attr) if state else None
+        return inputs
+
+    def get_checks_to_evaluate(self, states):
+        """
+        Indices of the checks to evaluate: the ones with an input that changed in the latest snapshots
+        (or that is not available from them) and the ones that were not available. All of them without
+        snapshots or every seconds_between_full_checks.
+        The checks that have to read the devices (an input not available from the snapshots or channels
+        used as a whole) are evaluated at most every seconds_between_checks, not after every publication.
+        """
+        if self.indexed_checks != self.checks:
+            self.build_dependency_index()
+        now = time.time()
+        if not self.config_params["use_snapshots"]:
+            return range(len(self.checks))
+        inputs = self.read_inputs(states)
+        if now - self.last_full_check_time >= self.config_params["seconds_between_full_checks"]:
+            self.last_full_check_time = now
+            self.last_live_check_time = now
+            self.pending_live_checks = set()
+            self.last_inputs = inputs
+            return range(len(self.checks))
+
+        changed = set(self.pending_live_checks)
+        for key, value in inputs.items():
+            if value is None or value != self.last_inputs.get(key):
+                changed.update(self.dependency_index[key])
+        for i, check in enumerate(self.checks):
+            # channels used as a whole (not only their attributes) cannot be tracked
+            if check.channel_names or (self.checks_states[i] == "unavailable" and check.is_available()):
+                changed.add(i)
+        self.last_inputs = inputs
+
+        live_allowed = now - self.last_live_check_time >= self.config_params["seconds_between_checks"]
+        to_evaluate = set()
+        self.pending_live_checks = set()
+        for i in changed:
+            check = self.checks[i]
+            live = check.channel_names or any(inputs.get(key) is None for key in check.get_used_attributes())
+            if not live:
+                to_evaluate.add(i)
+            elif live_allowed:
+                to_evaluate.add(i)
+                self.last_live_check_time = now
+            else:
+                self.pending_live_checks.add(i)
+        return sorted(to_evaluate)
+
     def check_conditions(self):
         failed_checks = []
+        states = self.get_snapshot_states() if self.config_params["use_snapshots"] else None
+        to_evaluate = set(self.get_checks_to_evaluate(states))
         for i, check in enumerate(self.checks):
-            frame_bg_color = self.frame.cget("bg")
-            current_bg_color = self.checks_checkboxes[i].cget("bg")
-            current_fg_color = self.checks_checkboxes[i].cget("fg")
             if not check.is_available():
                 self.checks_states[i] = "unavailable"
                 continue
-            if check.eval_condition():
+            if i not in to_evaluate:
+                continue
+            if check.eval_condition(
+                use_snapshots=self.config_params["use_snapshots"],
+                max_age=self.config_params["snapshot_max_age"],
+                states=states,
+            ):
                 self.checks_states[i] = "passed"
             else:
                 if self.checks_states[i] != "failed":
@@ -250,6 +360,7 @@ class ChecksFrame:
     
     def simulate_check_conditions(self, parameters_values : dict):
         failed_checks = []
+        states = self.get_snapshot_states() if self.config_params["use_snapshots"] else None
         for i, check in enumerate(self.checks):
             frame_bg_color = self.frame.cget("bg")
             current_bg_color = self.checks_checkboxes[i].cget("bg")
@@ -257,12 +368,18 @@ class ChecksFrame:
             if not check.is_available():
                 self.checks_states[i] = "unavailable"
                 continue
-            if check.simulate_eval_condition(parameters_values):
+            if check.simulate_eval_condition(
+                parameters_values,
+                use_snapshots=self.config_params["use_snapshots"],
+                max_age=self.config_params["snapshot_max_age"],
+                states=states,
+            ):
                 self.checks_states[i] = "passed"
             else:
                 if self.checks_states[i] != "failed":
                     self.checks_states[i] = "failed"
                     failed_checks.append(check)
+        self.last_full_check_time = 0 # the simulation changed the states, the next check is a full sweep
         if failed_checks:
             message = "\n".join([f"Simulated check '{check.name}' failed." for check in failed_checks])
             if self.config_params["show_warning_window"]:
@@ -274,6 +391,36 @@ class ChecksFrame:
         self.root.after(10, self.update_gui)
         return failed_checks == []
     
+    def simulate_plan(self, parameters_values : dict, n_steps : int):
+        """
+        Simulate all the steps of a plan at once ({"channel.attribute": array with the value of every step}).
+        Returns {check name: first failing step index} of the active checks that fail in any step.
+        The check states shown are not changed.
+        """
+        failed_checks = {}
+        states = self.get_snapshot_states() if self.config_params["use_snapshots"] else None
+        for check in self.checks:
+            if not check.is_available():
+                continue
+            results = check.simulate_eval_plan(
+                parameters_values,
+                n_steps,
+                use_snapshots=self.config_params["use_snapshots"],
+                max_age=self.config_params["snapshot_max_age"],
+                states=states,
+            )
+            if not results.all():
+                failed_checks[check.name] = int(np.argmin(results))
+        if failed_checks:
+            message = "\n".join([f"Planned step {step+1} fails check '{name}'." for name, step in failed_checks.items()])
+            if self.config_params["show_warning_window"]:
+                threading.Thread(
+                    target=lambda: messagebox.showwarning(
+                        "Warning", message, parent=self.root
+                    )
+                ).start() # show the warning in a new thread to avoid blocking the main thread until the warning is closed
+        return failed_checks
+
     def update_gui(self):
         for i, check_state in enumerate(self.checks_states):
             frame_bg_color = self.frame.cget("bg")
@@ -298,12 +445,27 @@ class ChecksFrame:
                 print(f"Warning: check state '{check_state}' is not valid.")
                 self.checks_checkboxes[i].config(bg="blue", fg="orange")
 
+    def on_new_readings(self, device, epoch, channels):
+        """ Snapshot hub subscriber: wake up the check loop if the readings are of channels of the checks. """
+        channels_names = {k.replace(" ", "") for k in self.channels}
+        if any(ch.replace(" ", "") in channels_names for ch in channels):
+            self.new_readings_event.set()
+
     def check_loop(self):
         while True:
             self.check_conditions()
-            time.sleep(self.config_params.get("seconds_between_checks", 2)) # better to sleep for a while to avoid locking the devices with too many checks
+            seconds_between_checks = self.config_params.get("seconds_between_checks", 2)
+            if not (self.config_params["event_driven"] and self.snapshot_hub is not None):
+                time.sleep(seconds_between_checks) # better to sleep for a while to avoid locking the devices with too many checks
+                continue
+            # wait for new readings, evaluating anyway every seconds_between_checks (watchdog)
+            if self.new_readings_event.wait(seconds_between_checks):
+                time.sleep(self.config_params["check_debounce_time"]) # group the readings published together
+            self.new_readings_event.clear()
 
     def start_background_threads(self):
+        if self.snapshot_hub is not None:
+            self.snapshot_hub.subscribe(self.on_new_readings)
         threading.Thread(target=self.check_loop, daemon=True).start()
 
 if __name__ == "__main__":
@@ -3,10 +3,44 @@ import queue
 import threading
 import time
 import logging
+import itertools
+from collections.abc import Mapping
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Callable
+
+import rollup
+from channel import ChannelState, get_threshold_value
+from logger import configure_basic_logger
+from utilsgui import validate_numeric_entry_input, PerformanceWindow
+from performance import CommandStats
+from tripcapture import TripCapture
+from snapshothub import get_snapshot_hub
+
+# command priorities (lower value is executed first)
+PRIORITY_OPERATOR = 0 # commands issued by the user or a protocol, safety ones included (in order of arrival)
+PRIORITY_READ = 1 # background reading of the values
+
+@dataclass(order=True)
+class Command:
+    """
+    Command waiting in (or executed from) the DeviceGUI command queue.
+    Commands are ordered by priority and then by arrival (seq).
+    """
+    priority: int
+    seq: int
+    func: Callable = field(compare=False)
+    args: tuple = field(default=(), compare=False)
+    kwargs: dict = field(default_factory=dict, compare=False)
+    enqueue_time: float = field(default_factory=time.monotonic, compare=False)
+    dequeue_time: float = field(default=None, compare=False)
+    start_time: float = field(default=None, compare=False)
+    finish_time: float = field(default=None, compare=False)
+
+    @property
+    def name(self):
+        return self.func.__name__
 
-from logger import ChannelState, configure_basic_logger
-from utilsgui import validate_numeric_entry_input
 
 class DeviceGUI(ABC):
     """
@@ -25,7 +59,19 @@ class DeviceGUI(ABC):
         - channel_state_prec_vmon (int): Voltage precision (default: 1).
         - channel_state_prec_imon (int): Current precision (default: 3).
         - read_loop_time (float): Time interval for reading channel data (default: 1 second).
+        - adaptive_polling (bool): Whether to adapt the reading interval to the activity of the device (default: True).
+        - fast_read_loop_time (float): Reading interval while there is activity: ramps, trips, fast changing values
+          or a requested fast polling e.g. during a protocol (default: 0.25 seconds or read_loop_time if smaller).
+        - slow_read_loop_time (float): Reading interval when everything has been stable for a while (default: 5*read_loop_time). If the trip capture has a sample_period (opt-in), no interval is longer than it, not even the slow one (see tripcapture.py).
+        - stable_time_before_slow (float): Seconds without activity before switching to the slow interval (default: 60).
+        - performance_log_time (float): Seconds between the command latency log lines (default: 600, 0 to disable).
+        - log_storage (str): Format of the channel log files: "text" (.dat), "binary" (.bin) or "both" (default: "text").
+        - rollup_time (float): Seconds between updates of the downsampled log tiers (see rollup.py) (default: 600, 0 to disable).
     """
+    ACTIVITY_STATUS_FLAGS = ("RUP", "RDW", "TRIP", "ARC") # status flags that trigger the fast polling
+    # commands that are not queued again while one of them is already waiting in the queue
+    COALESCED_COMMANDS = {"read_values"}
+    READ_FAILURE_LOG_INTERVAL = 60 # seconds between warnings while the periodic reads keep failing
 
     def __init__(self, device, channels_states, parent_frame=None, **kwargs):
         self.device = device
@@ -36,7 +82,17 @@ class DeviceGUI(ABC):
             "logging_enabled" : kwargs.get("logging_enabled", True),
             "read_loop_time" : kwargs.get("read_loop_time", 1),
             "gui_update_time" : kwargs.get("gui_update_time", 1),
+            "adaptive_polling" : kwargs.get("adaptive_polling", True),
+            "performance_log_time" : kwargs.get("performance_log_time", 600),
+            "log_storage" : kwargs.get("log_storage", "text"),
+            "rollup_time" : kwargs.get("rollup_time", 600),
         }
+        read_loop_time = self.config_params["read_loop_time"]
+        self.config_params.update({
+            "fast_read_loop_time" : kwargs.get("fast_read_loop_time", min(0.25, read_loop_time)),
+            "slow_read_loop_time" : kwargs.get("slow_read_loop_time", 5 * read_loop_time),
+            "stable_time_before_slow" : kwargs.get("stable_time_before_slow", 60),
+        })
         
         base_channel_params = {
             "save_previous": False,
@@ -59,6 +115,8 @@ class DeviceGUI(ABC):
             raise ValueError("logging_enabled must be a boolean")
         if not isinstance(self.config_params["read_loop_time"], (int, float)) or self.config_params["read_loop_time"] <= 0:
             raise ValueError("read_loop_time must be a positive number")
+        if self.config_params["log_storage"] not in ChannelState.STORAGE_BACKENDS:
+            raise ValueError(f"log_storage must be one of {ChannelState.STORAGE_BACKENDS}")
 
         # Initialize GUI basic components
         start_mainloop = False
@@ -74,6 +132,7 @@ class DeviceGUI(ABC):
             self.menu_config = tk.Menu(self.menu_bar, tearoff=0)
             # self.menu_config.add_command(label="Load checks") # TODO: implement load checks
             self.menu_config.add_command(label="Advanced options", command=self.open_config_menu)
+            self.menu_config.add_command(label="Performance", command=self.open_performance_window)
             self.menu_bar.add_cascade(label="Config", menu=self.menu_config)
             self.root.config(menu=self.menu_bar)
             start_mainloop = True
@@ -81,8 +140,22 @@ class DeviceGUI(ABC):
             self.root = parent_frame
         self.validate_numeric_input = (self.root.register(validate_numeric_entry_input), "%P")
         
-        self.command_queue = queue.Queue()
-        self.device_lock = threading.Lock()
+        self.command_queue = queue.PriorityQueue()
+        self.command_counter = itertools.count() # keeps the order of arrival for the same priority
+        self.pending_commands = set() # names of the coalesced commands waiting in the queue
+        self.pending_commands_lock = threading.Lock()
+        self.device_lock = threading.RLock() # reentrant: the checks simulated from a command (e.g. set_vset) may need it again
+        self.performance = CommandStats(self.device.name) # command latency statistics
+        self.trip_capture = TripCapture(self.channels_state) # replaced by a shared one in the main GUI
+        self.snapshot_hub = get_snapshot_hub() # latest readings of every device, used by the checks
+        self.read_failures = 0 # consecutive read_values failures
+        self.last_read_failure_log_time = 0
+        self.last_performance_log_time = time.monotonic()
+
+        # adaptive polling
+        self.fast_polling_requested = False
+        self.last_activity_time = time.monotonic()
+        self.read_loop_wakeup = threading.Event()
 
         #Initialize logger
         try:
@@ -104,24 +177,88 @@ class DeviceGUI(ABC):
 
     def process_commands(self):
         while True:
-            func, args, kwargs = self.command_queue.get()
-            with self.device_lock:
-                func(*args, **kwargs)
-            self.command_queue.task_done()
-            if self.root.cget("cursor") == "watch" and func.__name__ != "read_values":
-                self.root.config(cursor="")
+            self.process_next_command()
+
+    def process_next_command(self, block=True):
+        """ Execute the next command of the queue. Returns False if the queue was empty (only with block=False). """
+        try:
+            command = self.command_queue.get(block=block)
+        except queue.Empty:
+            return False
+        command.dequeue_time = time.monotonic()
+        if command.name in self.COALESCED_COMMANDS:
+            with self.pending_commands_lock:
+                self.pending_commands.discard(command.name)
+        succeeded = False
+        with self.device_lock:
+            command.start_time = time.monotonic()
+            try:
+                command.func(*command.args, **command.kwargs)
+                succeeded = True
+            except Exception as e:
+                if command.name == "read_values":
+                    self.log_read_failure(e)
+                else:
+                    self.logger.exception(f"{command.name} failed: {e}")
+            finally:
+                command.finish_time = time.monotonic()
+        if succeeded and command.name == "read_values":
+            self.log_read_recovery()
+            self.publish_snapshot()
+        self.performance.record_command(command)
+        self.command_queue.task_done()
+        if self.root.cget("cursor") == "watch" and command.name != "read_values":
+            self.root.config(cursor="")
+        return True
+
+    def log_read_failure(self, e):
+        """
+        The periodic reads fail at the polling rate while the device is disconnected: only the first
+        failure is logged as an error (sent to the chat handlers), the next ones at debug level with
+        a warning every READ_FAILURE_LOG_INTERVAL seconds.
+        """
+        self.read_failures += 1
+        now = time.monotonic()
+        if self.read_failures == 1:
+            self.logger.exception(f"read_values failed: {e}")
+            self.last_read_failure_log_time = now
+        elif now - self.last_read_failure_log_time >= self.READ_FAILURE_LOG_INTERVAL:
+            self.logger.warning(f"read_values still failing ({self.read_failures} consecutive failures): {e}")
+            self.last_read_failure_log_time = now
+        else:
+            self.logger.debug(f"read_values failed ({self.read_failures} consecutive failures): {e}")
+
+    def log_read_recovery(self):
+        if self.read_failures:
+            self.logger.warning(f"read_values working again after {self.read_failures} consecutive failures")
+            self.read_failures = 0
+
+    def publish_snapshot(self):
+        """ Publish the States of all the channels, read in the same cycle, to the snapshot hub. """
+        self.snapshot_hub.publish(
+            self.device.name,
+            {name: chstate.get_state() for name, chstate in self.channels_state.items()},
+        )
+
+    def command_priority(self, name):
+        # the safety commands (turn off, kill...) only go before the background reads: a turn on
+        # queued before a turn off must not be executed after it
+        if name == "read_values":
+            return PRIORITY_READ
+        return PRIORITY_OPERATOR
 
     def issue_command(self, func, *args, **kwargs):
+        name = func.__name__
         # do not stack read_values commands (critical if reading values is slow)
+        if name in self.COALESCED_COMMANDS:
+            with self.pending_commands_lock:
+                if name in self.pending_commands:
+                    return
+                self.pending_commands.add(name)
+        command = Command(self.command_priority(name), next(self.command_counter), func, args, kwargs)
+        self.command_queue.put(command)
         if (
-            func.__name__ == "read_values"
-            and (func, args, kwargs) in self.command_queue.queue
-        ):
-            return
-        # print('\n'), [print(i) for i in self.command_queue.queue] # debug
-        self.command_queue.put((func, args, kwargs))
-        if (
-            func.__name__ != "read_values"
+            name != "read_values"
         ):  # because it is constantly reading values in the background
             self.root.config(cursor="watch")
             self.root.update()
@@ -129,6 +266,7 @@ class DeviceGUI(ABC):
     def start_background_threads(self):
         threading.Thread(target=self.read_loop, daemon=True).start()
         threading.Thread(target=self.process_commands, daemon=True).start()
+        threading.Thread(target=self.rollup_loop, daemon=True).start()
 
     def schedule_gui_update(self):
             try:
@@ -149,11 +287,95 @@ class DeviceGUI(ABC):
                     chstate.save_state(
                         save_previous=self.config_channels_params[name]["save_previous"],
                         force=self.config_channels_params[name]["save_force"],
+                        storage=self.config_params["log_storage"],
                     )
-            time.sleep(self.config_params["read_loop_time"])
+            self.log_performance()
+            self.read_loop_wakeup.wait(self.get_read_loop_time())
+            self.read_loop_wakeup.clear()
+
+    def rollup_loop(self):
+        while True:
+            rollup_time = self.config_params["rollup_time"]
+            time.sleep(rollup_time if rollup_time > 0 else 60)
+            if self.config_params["rollup_time"] <= 0 or not self.config_params["logging_enabled"]:
+                continue
+            for chstate in self.channels_state.values():
+                try:
+                    rollup.update_channel(chstate.name)
+                except Exception as e:
+                    self.logger.exception(f"Rollup of {chstate.name} failed: {e}")
+
+    def set_trip_capture(self, trip_capture):
+        """ Use a TripCapture shared with other devices (all their channels are saved on any trip). """
+        trip_capture.add_channels(self.channels_state)
+        self.trip_capture = trip_capture
+
+    def trigger_trip_capture(self, reason):
+        """ Save the readings of the channels around this moment (see tripcapture.py), it does not block. """
+        self.trip_capture.trigger(reason, source=self.device.name)
+
+    def log_performance(self):
+        log_time = self.config_params["performance_log_time"]
+        if not log_time or time.monotonic() - self.last_performance_log_time < log_time:
+            return
+        self.last_performance_log_time = time.monotonic()
+        self.logger.debug(self.performance.format_log_line())
+
+    def request_fast_polling(self, fast=True):
+        """ Force the fast reading interval (e.g. while a protocol is running) until called with False. """
+        self.fast_polling_requested = fast
+        if fast:
+            self.read_loop_wakeup.set() # do not wait for the end of a slow interval
+
+    def get_read_loop_time(self):
+        read_loop_time = self.get_polling_time()
+        capture_interval = self.trip_capture.max_read_interval()
+        if capture_interval:
+            # the trip capture was asked for a reading at least every sample_period (see tripcapture.py),
+            # it overrides the slow polling if it is shorter
+            read_loop_time = min(read_loop_time, capture_interval)
+        return read_loop_time
+
+    def get_polling_time(self):
+        """ Reading interval of the adaptive polling (fast, normal or slow). """
+        if not self.config_params["adaptive_polling"]:
+            return self.config_params["read_loop_time"]
+        now = time.monotonic()
+        if self.fast_polling_requested or self.is_activity_detected():
+            self.last_activity_time = now
+            return self.config_params["fast_read_loop_time"]
+        if now - self.last_activity_time > self.config_params["stable_time_before_slow"]:
+            return self.config_params["slow_read_loop_time"]
+        return self.config_params["read_loop_time"]
+
+    def is_activity_detected(self):
+        """
+        Returns True if any channel is ramping, tripped or arcing (ACTIVITY_STATUS_FLAGS) or if any
+        value changed more than its logging threshold between the last two readings.
+        """
+        for chstate in self.channels_state.values():
+            current = chstate.get_state()
+            stat = current.get("stat")
+            if isinstance(stat, Mapping) and any(stat.get(flag) is True for flag in self.ACTIVITY_STATUS_FLAGS):
+                return True
+            previous = chstate.previous
+            for key, threshold in chstate.thresholds.items():
+                threshold = get_threshold_value(threshold)
+                value = current.get(key)
+                previous_value = previous.get(key)
+                if (
+                    threshold > 0
+                    and isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and isinstance(previous_value, (int, float)) and not isinstance(previous_value, bool)
+                    and abs(value - previous_value) >= threshold
+                ):
+                    return True
+        return False
 
     def set_config_param(self, key : str, value):
-        if key in self.config_params:
+        if key == "log_storage" and value not in ChannelState.STORAGE_BACKENDS:
+            print(f"Warning: log_storage must be one of {ChannelState.STORAGE_BACKENDS}.")
+        elif key in self.config_params:
             self.config_params[key] = value
         else:
             print(f"Warning: {key} is not a valid config parameter.")
@@ -161,10 +383,7 @@ class DeviceGUI(ABC):
 
     def set_config_params(self, config_params : dict):
         for key, value in config_params.items():
-            if key in self.config_params:
-                self.config_params[key] = value
-            else:
-                print(f"Warning: {key} is not a valid config parameter.")
+            self.set_config_param(key, value)
         return self.config_params
 
     def get_config_param(self, key : str):
@@ -173,6 +392,9 @@ class DeviceGUI(ABC):
     def get_config_params(self):
         return self.config_params
 
+    def open_performance_window(self):
+        PerformanceWindow(self.root, {self.performance.device_name: self.performance})
+
     def open_config_menu(self):
         new_window = tk.Toplevel(self.root)
         new_window.title("Configuration")
@@ -0,0 +1,340 @@
+import argparse
+import datetime as dt
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+import binarystore
+from channel import LOG_DIR, get_full_filename_from_date
+
+INDEX_FILENAME = ".history_index.json"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# downsampled copies of the channel logs written by rollup.py: {tier name: bucket seconds}
+ROLLUP_TIERS = {"10s": 10, "1min": 60, "1h": 3600}
+ROLLUP_STATS = ("min", "max", "mean", "last")
+
+_index_lock = threading.Lock() # FileIndex.save of the readers of all the threads
+
+
+def rollup_channel_name(channel, tier):
+    """ Name used for the log files of a rollup tier (e.g. 'cathode_1min'). """
+    return f"{channel.replace(' ', '')}_{tier}"
+
+
+def select_rollup_tier(resolution):
+    """ Coarsest rollup tier with buckets not larger than resolution (seconds), None if the raw data is needed. """
+    tiers = [tier for tier, seconds in ROLLUP_TIERS.items() if seconds <= resolution]
+    return max(tiers, key=ROLLUP_TIERS.get) if tiers else None
+
+
+def _to_datetime(value, end_of_day=False):
+    if value is None:
+        return dt.datetime.now()
+    if isinstance(value, str):
+        value = dt.datetime.fromisoformat(value) if (":" in value or "T" in value) else dt.date.fromisoformat(value)
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, dt.date):
+        return dt.datetime.combine(value, dt.time.max if end_of_day else dt.time.min)
+    raise TypeError(f"cannot convert {value!r} to datetime")
+
+
+def _column_name(header_field):
+    """ 'vmon[V]' -> 'vmon' (also the old 'Vmon(V)' headers). """
+    return re.split(r"[\[(]", header_field, 1)[0].lower()
+
+
+def _epoch_to_local(epoch):
+    """ Epoch seconds (float array) to naive local datetime64[ms], like the timestamps of the text files. """
+    if len(epoch) == 0:
+        return np.empty(0, dtype="datetime64[ms]")
+    offsets = {}
+    for t in (epoch[0], epoch[-1]):
+        offsets[t] = dt.datetime.fromtimestamp(t).replace(tzinfo=dt.timezone.utc).timestamp() - t
+    if len(set(offsets.values())) == 1:
+        local = epoch + offsets[epoch[0]]
+    else: # daylight saving time change in the middle of the file
+        local = np.array([dt.datetime.fromtimestamp(t).replace(tzinfo=dt.timezone.utc).timestamp() for t in epoch])
+    return (local * 1000).astype("datetime64[ms]")
+
+
+class FileIndex:
+    """
+    First and last timestamp of every log file, cached in a JSON file in the logs directory so
+    range queries can skip the files (or the whole days) they do not need. An entry is recomputed
+    if the size or the modification time of its file changed.
+    """
+
+    def __init__(self, log_dir=LOG_DIR):
+        self.path = os.path.join(log_dir, INDEX_FILENAME)
+        self.entries = {}
+        self.modified = False
+        try:
+            with open(self.path) as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, filename):
+        """ Returns (first, last) datetimes of the file or None if it is empty. """
+        stat = os.stat(filename)
+        entry = self.entries.get(filename)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            first_last = self._read_first_last(filename)
+            entry = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "first": first_last[0].strftime(TIME_FORMAT) if first_last else None,
+                "last": first_last[1].strftime(TIME_FORMAT) if first_last else None,
+            }
+            self.entries[filename] = entry
+            self.modified = True
+        if entry["first"] is None:
+            return None
+        # the binary files have sub-second timestamps: widen the range to whole seconds
+        return (
+            dt.datetime.strptime(entry["first"], TIME_FORMAT),
+            dt.datetime.strptime(entry["last"], TIME_FORMAT) + dt.timedelta(seconds=1),
+        )
+
+    def save(self):
+        """ Write the index atomically (temporary file + os.replace), merged with the entries saved by other readers. """
+        if not self.modified:
+            return
+        with _index_lock:
+            try:
+                with open(self.path) as file:
+                    entries = json.load(file)
+            except (OSError, ValueError):
+                entries = {}
+            entries.update(self.entries)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp" # other processes may be saving the index too
+            try:
+                with open(tmp_path, "w") as file:
+                    json.dump(entries, file)
+                os.replace(tmp_path, self.path)
+                self.entries = entries
+                self.modified = False
+            except OSError as e:
+                print(f"Could not save the history index {self.path}: {e}")
+
+    def _read_first_last(self, filename):
+        if filename.endswith("." + binarystore.EXTENSION):
+            _, records = binarystore.load_file(filename)
+            if len(records) == 0:
+                return None
+            return dt.datetime.fromtimestamp(records["time"][0]), dt.datetime.fromtimestamp(records["time"][-1])
+
+        with open(filename, "rb") as file:
+            file.readline() # header
+            first_line = file.readline()
+            file.seek(0, 2)
+            size = file.tell()
+            file.seek(max(0, size - 4096))
+            tail = file.read().splitlines()
+        first = self._parse_line_time(first_line)
+        # the last line may be incomplete if the file is being written
+        last = next((t for t in map(self._parse_line_time, reversed(tail)) if t is not None), None)
+        if first is None or last is None:
+            return None
+        return first, last
+
+    def _parse_line_time(self, line):
+        try:
+            return dt.datetime.strptime(" ".join(line.decode().split()[:2]), TIME_FORMAT)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+
+def read_text_file(filename):
+    """
+    Parse a text (.dat) channel log file. Returns {"time": datetime64 array, column: array}.
+    Numeric columns are returned as float arrays, the rest as string arrays.
+    """
+    with open(filename) as file:
+        header = file.readline().split()
+        content = file.read()
+    names = [_column_name(name) for name in header[1:]] # header[0] is "Time"
+    n_tokens = len(names) + 2 # the timestamp is two tokens (date and time)
+
+    if not content.endswith("\n"):
+        content = content[:content.rfind("\n") + 1] # last line still being written
+    tokens = content.split()
+    if len(tokens) % n_tokens != 0:
+        # malformed lines: keep only the good ones
+        tokens = []
+        for line in content.splitlines():
+            fields = line.split()
+            if len(fields) == n_tokens:
+                tokens.extend(fields)
+
+    # the numpy conversions work on one column at a time (every n_tokens-th token)
+    data = {}
+    try:
+        days = np.array(tokens[0::n_tokens], dtype="datetime64[D]")
+        times = np.array(tokens[1::n_tokens], dtype="U8") # HH:MM:SS
+        digits = times.view(np.uint32).reshape(-1, 8).astype(np.int64) - ord("0")
+        seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 3] * 10 + digits[:, 4]) * 60 + digits[:, 6] * 10 + digits[:, 7]
+        data["time"] = days.astype("datetime64[ms]") + (seconds * 1000).astype("timedelta64[ms]")
+    except ValueError:
+        print(f"Invalid timestamps in {filename}, skipping it")
+        return {"time": np.empty(0, dtype="datetime64[ms]")}
+    for i, name in enumerate(names):
+        column = tokens[i + 2::n_tokens]
+        try:
+            data[name] = np.array(column, dtype=float)
+        except ValueError:
+            data[name] = np.array(column, dtype=str)
+    return data
+
+
+def read_binary_file(filename):
+    """ Read a binary (.bin) channel log file. Status columns are decoded to one boolean array per flag ('stat.ON'...). Flags that were unknown in some records are object arrays with True/False/'??'. """
+    record_format, records = binarystore.load_file(filename)
+    data = {"time": _epoch_to_local(np.asarray(records["time"]))}
+    for name, kind in record_format.columns:
+        if kind == "status":
+            for flag, values in binarystore.decode_status(record_format, records, name).items():
+                data[f"{name}.{flag}"] = values
+        else:
+            data[name] = np.asarray(records[name], dtype=float)
+    return data
+
+
+def get_day_files(channel, day, log_dir=LOG_DIR):
+    """
+    Log files of a channel for a day: the binary file and its segments (records with another
+    layout, see ChannelLogWriter) or the text file if there is no binary one. Empty if there are none.
+    """
+    suffix = channel.replace(" ", "")
+    day_dt = dt.datetime.combine(day, dt.time.min)
+    for extension in (binarystore.EXTENSION, "dat"):
+        filename = get_full_filename_from_date(day_dt, suffix=suffix, extension=extension)
+        if log_dir != LOG_DIR:
+            filename = os.path.join(log_dir, os.path.relpath(filename, LOG_DIR))
+        if os.path.isfile(filename):
+            return binarystore.segment_filenames(filename) if extension == binarystore.EXTENSION else [filename]
+    return []
+
+
+def get_files(channel, start, end, log_dir=LOG_DIR):
+    """ Existing log files of a channel between two datetimes (the binary file of a day is preferred if both exist). """
+    files = []
+    day = start.date()
+    while day <= end.date():
+        files.extend(get_day_files(channel, day, log_dir=log_dir))
+        day += dt.timedelta(days=1)
+    return files
+
+
+def rollup_data(data, seconds):
+    """ Rollup columns ('<value>_<stat>') of raw data, for the days without a rollup tier file. """
+    from rollup import compute_rollup # rollup.py imports this module
+    order = np.argsort(data["time"], kind="stable")
+    values = {name: v[order] for name, v in data.items() if name != "time" and v.dtype.kind in "fb"}
+    times, columns = compute_rollup(data["time"][order], values, seconds)
+    return {"time": times, **columns}
+
+
+def load(channel, start, end=None, columns=None, as_dataframe=False, log_dir=LOG_DIR, resolution=None):
+    """
+    Load the logged values of a channel between start and end.
+
+    Parameters:
+    - channel (str): channel name, as given to its ChannelState (e.g. "cathode", "mesh left").
+    - start, end: datetime, date or ISO string (end defaults to now, a date end includes the whole day).
+    - columns (list): columns to return (default: all the columns found).
+    - as_dataframe (bool): return a pandas DataFrame indexed by time instead of a dict of arrays.
+    - log_dir (str): logs directory.
+    - resolution (float): seconds between points that are enough for the query (e.g. for a plot).
+      If given, the coarsest rollup tier (see rollup.py) not coarser than it is used. The rollup
+      columns are '<value>_min', '<value>_max', '<value>_mean' and '<value>_last' and the time is
+      the start of each bucket. The days without a file of that tier are read from the raw logs
+      and rolled up on the fly to the same buckets.
+
+    Returns {"time": datetime64 array, column: array, ...} (or a DataFrame). Columns missing in
+    some files are filled with NaN.
+    """
+    start = _to_datetime(start)
+    end = _to_datetime(end, end_of_day=True)
+
+    tier = select_rollup_tier(resolution) if resolution is not None else None
+    if tier is not None and columns is not None:
+        columns = [f"{name}_{stat}" for name in columns for stat in ROLLUP_STATS]
+
+    # file of every day: the rollup tier file if it exists, the raw log file otherwise
+    files = [] # [(filename, raw file to roll up)]
+    day = start.date()
+    while day <= end.date():
+        day_files = get_day_files(rollup_channel_name(channel, tier), day, log_dir=log_dir) if tier is not None else []
+        if day_files:
+            files.extend((filename, False) for filename in day_files)
+        else:
+            files.extend((filename, tier is not None) for filename in get_day_files(channel, day, log_dir=log_dir))
+        day += dt.timedelta(days=1)
+
+    index = FileIndex(log_dir)
+    parts = []
+    for filename, raw_rollup in files:
+        first_last = index.get(filename)
+        if first_last is None or first_last[1] < start or first_last[0] > end:
+            continue
+        if filename.endswith("." + binarystore.EXTENSION):
+            data = read_binary_file(filename)
+        else:
+            data = read_text_file(filename)
+        mask = (data["time"] >= np.datetime64(start, "ms")) & (data["time"] <= np.datetime64(end, "ms"))
+        if not mask.all():
+            data = {name: values[mask] for name, values in data.items()}
+        if raw_rollup and len(data["time"]):
+            data = rollup_data(data, ROLLUP_TIERS[tier])
+        if len(data["time"]):
+            parts.append(data)
+    index.save()
+
+    if columns is None:
+        columns = []
+        for data in parts:
+            columns.extend(name for name in data if name != "time" and name not in columns)
+    result = {"time": np.concatenate([data["time"] for data in parts]) if parts else np.empty(0, dtype="datetime64[ms]")}
+    for name in columns:
+        arrays = [data[name] if name in data else np.full(len(data["time"]), np.nan) for data in parts]
+        result[name] = np.concatenate(arrays) if arrays else np.empty(0)
+
+    if as_dataframe:
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("pandas is required for as_dataframe=True")
+        return pd.DataFrame({name: values for name, values in result.items() if name != "time"},
+                            index=pd.DatetimeIndex(result["time"], name="time"))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print or export the logged values of a channel")
+    parser.add_argument("channel", type=str, help="Channel name (e.g. cathode)")
+    parser.add_argument("start", type=str, help="Start date or datetime (ISO format)")
+    parser.add_argument("end", type=str, nargs="?", help="End date or datetime (ISO format, default: now)", default=None)
+    parser.add_argument("--columns", type=str, nargs="+", help="Columns to load", default=None)
+    parser.add_argument("--output", type=str, help="Write the values to this CSV file", default=None)
+    parser.add_argument("--log-dir", type=str, help="Logs directory", default=LOG_DIR)
+    parser.add_argument("--resolution", type=float, help="Seconds between points (uses the rollup tiers if possible)", default=None)
+
+    args = parser.parse_args()
+
+    data = load(args.channel, args.start, args.end, columns=args.columns, log_dir=args.log_dir, resolution=args.resolution)
+    print(f"{len(data['time'])} rows of {args.channel}")
+    for name, values in data.items():
+        if name != "time" and values.dtype.kind in "fb" and len(values):
+            print(f"  {name}: min {np.nanmin(values):.4g}, max {np.nanmax(values):.4g}, mean {np.nanmean(values):.4g}")
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(",".join(data.keys()) + "\n")
+            for row in zip(*data.values()):
+                file.write(",".join(str(value) for value in row) + "\n")
+        print(f"Saved to {args.output}")
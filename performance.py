@@ -0,0 +1,100 @@
+import threading
+from collections import deque
+
+
+class RollingStats:
+    """
+    Keeps the last `window` samples of a quantity and computes its percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0 # total number of samples, including those already out of the window
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, sorted_samples, q):
+        if not sorted_samples:
+            return float("nan")
+        index = min(len(sorted_samples) - 1, int(round(q / 100 * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "p50": self.percentile(samples, 50),
+            "p95": self.percentile(samples, 95),
+            "p99": self.percentile(samples, 99),
+            "max": samples[-1] if samples else float("nan"),
+        }
+
+
+class CommandStats:
+    """
+    Latency instrumentation of the command queue of a device.
+    For every command name it records (in seconds):
+    - queue_wait: time between issuing the command and taking it out of the queue.
+    - lock_wait: time waiting to acquire the device lock.
+    - execution: time running the command while holding the device lock.
+    """
+    METRICS = ("queue_wait", "lock_wait", "execution")
+
+    def __init__(self, device_name, window=1000):
+        self.device_name = device_name
+        self.window = window
+        self.stats = {} # {command_name: {metric: RollingStats}}
+        self.lock = threading.Lock()
+
+    def record(self, command_name, queue_wait, lock_wait, execution):
+        with self.lock:
+            if command_name not in self.stats:
+                self.stats[command_name] = {metric: RollingStats(self.window) for metric in self.METRICS}
+            command_stats = self.stats[command_name]
+            command_stats["queue_wait"].add(queue_wait)
+            command_stats["lock_wait"].add(lock_wait)
+            command_stats["execution"].add(execution)
+
+    def record_command(self, command):
+        """ Record a finished devicegui.Command using its timestamps. """
+        self.record(
+            command.name,
+            queue_wait=command.dequeue_time - command.enqueue_time,
+            lock_wait=command.start_time - command.dequeue_time,
+            execution=command.finish_time - command.start_time,
+        )
+
+    def summary(self):
+        with self.lock:
+            return {
+                name: {metric: rolling.summary() for metric, rolling in command_stats.items()}
+                for name, command_stats in self.stats.items()
+            }
+
+    def format_table(self):
+        """ Returns a text table with the percentiles in milliseconds. """
+        lines = [f"{'command':<28}{'metric':<12}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+        for name, metrics in sorted(self.summary().items()):
+            for metric, s in metrics.items():
+                lines.append(
+                    f"{name:<28}{metric:<12}{s['count']:>7}"
+                    f"{s['p50']*1e3:>9.1f}{s['p95']*1e3:>9.1f}{s['p99']*1e3:>9.1f}{s['max']*1e3:>9.1f}"
+                )
+        return "\n".join(lines)
+
+    def format_log_line(self):
+        """ Returns a one line summary (p95 and max in milliseconds) for the periodic log. """
+        parts = []
+        for name, metrics in sorted(self.summary().items()):
+            queue_wait = metrics["queue_wait"]
+            lock_wait = metrics["lock_wait"]
+            execution = metrics["execution"]
+            parts.append(
+                f"{name} (n={execution['count']}): "
+                f"queue p95 {queue_wait['p95']*1e3:.0f}/max {queue_wait['max']*1e3:.0f} ms, "
+                f"lock p95 {lock_wait['p95']*1e3:.0f}/max {lock_wait['max']*1e3:.0f} ms, "
+                f"exec p95 {execution['p95']*1e3:.0f}/max {execution['max']*1e3:.0f} ms"
+            )
+        return f"{self.device_name} performance: " + "; ".join(parts)
@@ -0,0 +1,85 @@
+import numpy as np
+
+# Pre-flight planning of the multichannel voltage protocols (see trex_HV_gui.py): all the
+# intermediate setpoints are computed before anything is applied, so the whole plan can be
+# simulated against the checks at once.
+
+
+def raise_voltage_steps(final_vset : dict, factors : dict, step : float) -> list:
+    """
+    Setpoints of every step of the raise voltage protocol ([{channel: vset}, ...]). At every step
+    the 'reference' voltage increases by step and each channel is set to reference/factor, without
+    going above its final vset.
+    """
+    max_vset = max([round(v*f) for v, f in zip(final_vset.values(), factors.values())])
+    n_steps = int( max_vset / step ) + 1
+    steps = []
+    vset = 0
+    for _ in range(n_steps):
+        vset = vset + step
+        temp_vset = {k: round(vset/f) for k, f in zip(final_vset.keys(), factors.values())}
+        for ch, f in final_vset.items():
+            temp_vset[ch] = f if temp_vset[ch] >= f else temp_vset[ch]
+        steps.append(temp_vset)
+    return steps
+
+
+def turn_off_steps(current_vset : dict, factors : dict, step : float) -> list:
+    """ Setpoints of every step of the turn off protocol ([{channel: vset}, ...]), down to 0. """
+    max_vset = max([round(v*f) for v, f in zip(current_vset.values(), factors.values())])
+    n_steps = int( max_vset / step ) + 1
+    steps = []
+    temp_vset = current_vset
+    for _ in range(n_steps):
+        temp_vset = {k: round(t-step/f) for k, t, f in zip(current_vset.keys(), temp_vset.values(), factors.values())}
+        for ch in temp_vset.keys():
+            temp_vset[ch] = 0 if temp_vset[ch] <= 0 else temp_vset[ch]
+        steps.append(temp_vset)
+    return steps
+
+
+def pending_steps(steps : list, vset : dict, vmon : dict, precision : dict, raising : bool = True) -> list:
+    """
+    Steps that a protocol will apply, starting from the current vset and vmon of the channels:
+    [(step index, {channel: vset to apply}, {channel: vset of every channel after the step}), ...].
+    The protocol loops (trex_HV_gui.py) apply exactly these steps, so the pre-flight simulation
+    sees the same setpoints:
+    - raising: a step is skipped if every channel has a vset not below it and has reached it, and a
+      channel is not set if its vmon is already above the step.
+    - turning off: a channel is not set if its vmon is already below the step.
+    The channels are assumed to reach every applied setpoint (the protocols wait for it).
+    """
+    vset = dict(vset)
+    vmon = dict(vmon)
+    pending = []
+    for i, step_vset in enumerate(steps):
+        if raising and all(vset[ch] >= v and v - vmon[ch] <= precision.get(ch, 1) for ch, v in step_vset.items()):
+            continue
+        applied = {ch: v for ch, v in step_vset.items() if (vmon[ch] <= v if raising else vmon[ch] >= v)}
+        for ch, v in applied.items():
+            vset[ch] = v
+            vmon[ch] = v
+        pending.append((i, applied, dict(vset)))
+    return pending
+
+
+def steps_to_parameters(steps : list, attribute : str = "vset") -> dict:
+    """ {"channel.attribute": array with the value of every step}, as used by ChecksFrame.simulate_plan. """
+    parameters_values = {}
+    for ch in steps[0].keys() if steps else []:
+        parameters_values[ch.replace(" ", "") + "." + attribute] = np.array([s[ch] for s in steps], dtype=float)
+    return parameters_values
+
+
+def simulate_plan(steps : list, checks_frames : dict) -> dict:
+    """
+    Simulate all the steps against the active checks of every ChecksFrame ({name: ChecksFrame}).
+    Returns {frame name: {check name: first failing step index}} with the frames that fail.
+    """
+    parameters_values = steps_to_parameters(steps)
+    failed = {}
+    for name, checks_frame in checks_frames.items():
+        failed_checks = checks_frame.simulate_plan(parameters_values, len(steps))
+        if failed_checks:
+            failed[name] = failed_checks
+    return failed
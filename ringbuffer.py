@@ -0,0 +1,146 @@
+import threading
+
+import numpy as np
+
+
+class ChannelHistory:
+    """
+    Fixed-capacity in-memory history of the readings of a channel: one NumPy ring buffer per
+    value sharing a ring buffer of timestamps (epoch seconds). Appending is O(1) and the window
+    queries (values of the last N seconds, mean, min, max, slope) are vectorized.
+
+    Numeric values are stored as float64 (NaN if missing in a reading) and status flags
+    (StatusFlags) as their int64 bitmask, see status_window. Other values are ignored.
+    """
+
+    def __init__(self, capacity=86400):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = {} # {name: ring buffer array}
+        self.status_names = {} # {name: flag names of the bitmask}
+        self.index = 0 # next position to write
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, values):
+        """ Add a reading. timestamp is a datetime (or epoch seconds), values a mapping {name: value}. """
+        t = timestamp if isinstance(timestamp, (int, float)) else timestamp.timestamp()
+        with self.lock:
+            i = self.index
+            self.times[i] = t
+            updated = set()
+            for name, value in values.items():
+                bits = getattr(value, "bits", None) # StatusFlags (not imported to avoid a circular import)
+                if bits is not None:
+                    array = self.values.get(name)
+                    if array is None:
+                        array = self.values[name] = np.zeros(self.capacity, dtype=np.int64)
+                    self.status_names[name] = value.names
+                    array[i] = bits
+                elif isinstance(value, (int, float)):
+                    array = self.values.get(name)
+                    if array is None:
+                        array = self.values[name] = np.full(self.capacity, np.nan)
+                    array[i] = value
+                else:
+                    continue
+                updated.add(name)
+            for name, array in self.values.items():
+                if name not in updated and array.dtype.kind == "f":
+                    array[i] = np.nan
+            self.index = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def _window_slices(self, start, end):
+        """ Slices of the ring buffers (in chronological order) with the samples between start and end. """
+        if self.size < self.capacity:
+            segments = [slice(0, self.size)]
+        else:
+            segments = [slice(self.index, self.capacity), slice(0, self.index)]
+        slices = []
+        for segment in segments:
+            times = self.times[segment]
+            lo = np.searchsorted(times, start, side="left")
+            hi = np.searchsorted(times, end, side="right")
+            if hi > lo:
+                slices.append(slice(segment.start + lo, segment.start + hi))
+        return slices
+
+    def last_time(self):
+        with self.lock:
+            if self.size == 0:
+                return None
+            return self.times[(self.index - 1) % self.capacity]
+
+    def window(self, name, seconds=None, end=None):
+        """
+        Returns (times, values) arrays (copies) of the samples of the last seconds before end
+        (default: the last sample). Without seconds, all the samples in the buffer.
+        """
+        with self.lock:
+            array = self.values.get(name)
+            if array is None or self.size == 0:
+                return np.empty(0), np.empty(0)
+            if end is None:
+                end = self.times[(self.index - 1) % self.capacity]
+            start = -np.inf if seconds is None else end - seconds
+            slices = self._window_slices(start, end)
+            if not slices:
+                return np.empty(0), np.empty(0, dtype=array.dtype)
+            return (
+                np.concatenate([self.times[s] for s in slices]),
+                np.concatenate([array[s] for s in slices]),
+            )
+
+    def snapshot(self, seconds=None, end=None):
+        """ Returns (times, {name: values}) with all the values of the samples of the last seconds before end. """
+        with self.lock:
+            if self.size == 0:
+                return np.empty(0), {}
+            if end is None:
+                end = self.times[(self.index - 1) % self.capacity]
+            start = -np.inf if seconds is None else end - seconds
+            slices = self._window_slices(start, end)
+            if not slices:
+                return np.empty(0), {name: np.empty(0, dtype=array.dtype) for name, array in self.values.items()}
+            return (
+                np.concatenate([self.times[s] for s in slices]),
+                {name: np.concatenate([array[s] for s in slices]) for name, array in self.values.items()},
+            )
+
+    def status_window(self, name, flag, seconds=None, end=None):
+        """ Returns (times, boolean array) of a status flag in the last seconds. """
+        times, bits = self.window(name, seconds, end)
+        names = self.status_names.get(name, ())
+        if flag not in names:
+            return times, np.zeros(len(times), dtype=bool)
+        return times, (bits >> names.index(flag) & 1).astype(bool)
+
+    def mean(self, name, seconds=None, end=None):
+        _, values = self.window(name, seconds, end)
+        return np.nanmean(values) if np.any(~np.isnan(values)) else np.nan
+
+    def min(self, name, seconds=None, end=None):
+        _, values = self.window(name, seconds, end)
+        return np.nanmin(values) if np.any(~np.isnan(values)) else np.nan
+
+    def max(self, name, seconds=None, end=None):
+        _, values = self.window(name, seconds, end)
+        return np.nanmax(values) if np.any(~np.isnan(values)) else np.nan
+
+    def slope(self, name, seconds=None, end=None):
+        """ Least squares slope (units per second) of the value in the last seconds. """
+        times, values = self.window(name, seconds, end)
+        valid = ~np.isnan(values)
+        if np.count_nonzero(valid) < 2:
+            return np.nan
+        t = times[valid] - times[valid][0]
+        v = values[valid]
+        t_mean = t.mean()
+        denominator = np.sum((t - t_mean) ** 2)
+        if denominator == 0:
+            return np.nan
+        return np.sum((t - t_mean) * (v - v.mean())) / denominator
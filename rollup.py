@@ -0,0 +1,160 @@
+import argparse
+import datetime as dt
+import json
+import os
+import threading
+
+import numpy as np
+
+import history
+from channel import LOG_DIR, create_directory_recursive, get_full_filename_from_date
+from history import ROLLUP_TIERS, ROLLUP_STATS, rollup_channel_name
+
+# Downsampled tiers of the channel logs (see history.ROLLUP_TIERS). For every bucket of a tier
+# the min, max, mean and last value of each numeric column are written to a text log file of
+# its own ('<channel>_<tier>', same layout and format as the raw logs). The tiers are updated
+# incrementally: the end of the last complete bucket written of every channel and tier (the
+# watermark) is kept in logs/.rollup_state.json.
+
+STATE_FILENAME = ".rollup_state.json"
+WRITE_DELAY = 30 # seconds, the newest rows may still be in the log writer buffers
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+_state_lock = threading.Lock()
+
+
+def _log_path(filename, log_dir):
+    if log_dir == LOG_DIR:
+        return filename
+    return os.path.join(log_dir, os.path.relpath(filename, LOG_DIR))
+
+
+def load_state(log_dir=LOG_DIR):
+    try:
+        with open(os.path.join(log_dir, STATE_FILENAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_watermark(channel, tier, watermark, log_dir=LOG_DIR):
+    with _state_lock:
+        state = load_state(log_dir)
+        state.setdefault(channel, {})[tier] = watermark.strftime(TIME_FORMAT)
+        path = os.path.join(log_dir, STATE_FILENAME)
+        create_directory_recursive(path)
+        with open(path + ".tmp", "w") as file:
+            json.dump(state, file, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+def _floor(timestamp, seconds):
+    """ Start of the bucket of a (naive) datetime, with the same bucket boundaries as compute_rollup. """
+    ms = np.datetime64(timestamp, "ms").astype(np.int64)
+    return (ms // (seconds * 1000) * seconds * 1000).astype("datetime64[ms]").astype(dt.datetime)
+
+
+def compute_rollup(times, values, bucket_seconds):
+    """
+    Downsample the values (dict of float arrays) of the sorted datetime64 array times.
+    Returns (bucket start times, {'<name>_<stat>': array}) for the buckets with at least one row.
+    NaN values are ignored (a bucket with only NaN gives NaN).
+    """
+    ms = times.astype("datetime64[ms]").astype(np.int64)
+    buckets = ms // (bucket_seconds * 1000)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ms)]
+
+    result = {}
+    for name, v in values.items():
+        v = np.asarray(v, dtype=float)
+        valid = ~np.isnan(v)
+        count = np.add.reduceat(valid.astype(np.int64), starts)
+        total = np.add.reduceat(np.where(valid, v, 0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats = {
+                "min": np.fmin.reduceat(v, starts),
+                "max": np.fmax.reduceat(v, starts),
+                "mean": total / count,
+                "last": v[ends - 1],
+            }
+        for stat in ROLLUP_STATS:
+            result[f"{name}_{stat}"] = stats[stat]
+    return (buckets[starts] * bucket_seconds * 1000).astype("datetime64[ms]"), result
+
+
+def _append_rows(filename, times, columns):
+    """ Append the rows to a tier file, following the header of the file if it already exists. """
+    create_directory_recursive(filename)
+    if os.path.isfile(filename):
+        with open(filename) as file:
+            names = file.readline().split()[1:]
+    else:
+        names = list(columns)
+        with open(filename, "w") as file:
+            file.write(" ".join(["Time"] + names) + "\n")
+    n = len(times)
+    arrays = [columns.get(name, np.full(n, np.nan)) for name in names]
+    time_strings = np.datetime_as_string(times.astype("datetime64[s]"))
+    lines = []
+    for i in range(n):
+        lines.append(" ".join([time_strings[i].replace("T", " ")] + [f"{array[i]:.6g}" for array in arrays]) + "\n")
+    with open(filename, "a") as file:
+        file.write("".join(lines))
+
+
+def update_channel(channel, now=None, log_dir=LOG_DIR, backfill_days=1):
+    """
+    Add the complete buckets not written yet to all the rollup tiers of a channel.
+    Without a previous watermark the rollup starts backfill_days days before today.
+    """
+    now = now or dt.datetime.now()
+    limit = now - dt.timedelta(seconds=WRITE_DELAY)
+    default_start = dt.datetime.combine(limit.date() - dt.timedelta(days=backfill_days), dt.time.min)
+    channel_state = load_state(log_dir).get(channel, {})
+    watermarks = {}
+    for tier, seconds in ROLLUP_TIERS.items():
+        watermark = channel_state.get(tier)
+        watermarks[tier] = dt.datetime.strptime(watermark, TIME_FORMAT) if watermark else default_start
+
+    day = min(watermarks.values()).date()
+    while day <= limit.date():
+        day_start = dt.datetime.combine(day, dt.time.min)
+        day_end = day_start + dt.timedelta(days=1)
+        data = history.load(
+            channel, max(min(watermarks.values()), day_start), min(limit, day_end - dt.timedelta(microseconds=1)),
+            log_dir=log_dir,
+        )
+        times = data.pop("time")
+        if len(times) and np.any(np.diff(times.astype(np.int64)) < 0):
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+            data = {name: values[order] for name, values in data.items()}
+        values = {name: array for name, array in data.items() if array.dtype.kind in "fb"}
+
+        for tier, seconds in ROLLUP_TIERS.items():
+            # only complete buckets: the ones that end before the limit (and before the end of the day)
+            tier_limit = min(day_end, _floor(limit, seconds))
+            if tier_limit <= watermarks[tier]:
+                continue
+            mask = (times >= np.datetime64(watermarks[tier], "ms")) & (times < np.datetime64(tier_limit, "ms"))
+            if mask.any() and values:
+                bucket_times, columns = compute_rollup(times[mask], {name: v[mask] for name, v in values.items()}, seconds)
+                filename = get_full_filename_from_date(day_start, suffix=rollup_channel_name(channel, tier))
+                _append_rows(_log_path(filename, log_dir), bucket_times, columns)
+            watermarks[tier] = tier_limit
+            save_watermark(channel, tier, tier_limit, log_dir=log_dir)
+        day += dt.timedelta(days=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the rollup tiers (10s, 1min, 1h) of the channel logs")
+    parser.add_argument("channels", type=str, nargs="+", help="Channel names (e.g. cathode)")
+    parser.add_argument("--backfill-days", type=int, help="Days to process for channels without previous rollups", default=1)
+    parser.add_argument("--log-dir", type=str, help="Logs directory", default=LOG_DIR)
+
+    args = parser.parse_args()
+
+    for channel in args.channels:
+        update_channel(channel, log_dir=args.log_dir, backfill_days=args.backfill_days)
+        print(f"{channel}: rollups updated")
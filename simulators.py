@@ -1,6 +1,9 @@
 import threading
 import time
 import random
+from types import MappingProxyType
+
+from spellmanClass import SpellmanSnapshot
 
 
 # class that simulates the channel of the caen by giving a random value to its attributes vmon, imon and
@@ -225,6 +228,15 @@ class SpellmanSimulator:
     
     def get_status(self):
         return self.stat
+
+    def read_snapshot(self):
+        return SpellmanSnapshot(
+            vset=self.vset,
+            iset=self.iset,
+            vmon=self.vmon,
+            imon=self.imon,
+            stat=MappingProxyType(self.stat.copy()),
+        )
     
     def turn_remote_on(self):
         self.stat['REMOTE'] = True
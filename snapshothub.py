@@ -0,0 +1,101 @@
+import threading
+import time
+
+
+class SnapshotView:
+    """
+    Coherent view of the latest readings of all the devices, as returned by SnapshotHub.get_view.
+
+    - epoch (int): global epoch of the view (increases with every publication of any device).
+    - devices (dict): {device name: (sequence number, publication time, {channel: State})}.
+    - states (dict): {channel: State} of all the devices.
+    """
+    __slots__ = ("epoch", "devices", "states")
+
+    def __init__(self, epoch, devices):
+        self.epoch = epoch
+        self.devices = devices
+        self.states = {}
+        for _, _, states in devices.values():
+            self.states.update(states)
+
+    def get_sequence(self, device):
+        """ Sequence number of the snapshot of a device in this view (0 if it never published). """
+        return self.devices.get(device, (0, None, {}))[0]
+
+
+class SnapshotHub:
+    """
+    Latest complete snapshot of every device: each device GUI publishes the States of all its
+    channels after every read cycle (see DeviceGUI.publish_snapshot) with a per-device sequence
+    number, and every publication increases a global epoch.
+
+    Readers take a SnapshotView of all the devices at once without any device lock, so the
+    multidevice checks see a coherent set of readings (every device at the end of a read cycle)
+    and never stall the device command queues. Only a short internal lock is held to swap the
+    references (the States are immutable).
+
+    Subscribers (see subscribe) are called after every publication, from the publishing thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = 0
+        self.devices = {} # {device name: (sequence number, publication time, {channel: State})}
+        self.view = SnapshotView(0, {})
+        self.subscribers = []
+
+    def publish(self, device, states : dict):
+        """ Publish the States ({channel: State}) of a device read in the same cycle. Returns the new epoch. """
+        with self.lock:
+            sequence = self.devices.get(device, (0, None, {}))[0] + 1
+            devices = dict(self.devices)
+            devices[device] = (sequence, time.time(), dict(states))
+            self.devices = devices
+            self.epoch += 1
+            self.view = None # built on demand
+            epoch = self.epoch
+            subscribers = list(self.subscribers)
+        channels = tuple(states.keys())
+        for callback in subscribers:
+            try:
+                callback(device, epoch, channels)
+            except Exception as e:
+                print(f"Snapshot hub subscriber {callback} failed: {e}")
+        return epoch
+
+    def subscribe(self, callback):
+        """
+        Call callback(device, epoch, channel names) after every publication. It runs in the reading
+        thread of the device, so it must return quickly (e.g. just set an Event).
+        """
+        with self.lock:
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def get_view(self):
+        """ SnapshotView of the latest snapshot of every device. """
+        with self.lock:
+            if self.view is None:
+                self.view = SnapshotView(self.epoch, self.devices)
+            return self.view
+
+    def get_epoch(self):
+        return self.epoch
+
+
+_default_snapshot_hub = None
+_default_snapshot_hub_lock = threading.Lock()
+
+def get_snapshot_hub():
+    """ Returns the SnapshotHub shared by all the devices. """
+    global _default_snapshot_hub
+    with _default_snapshot_hub_lock:
+        if _default_snapshot_hub is None:
+            _default_snapshot_hub = SnapshotHub()
+        return _default_snapshot_hub
@@ -0,0 +1,352 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from spellmanClass import Spellman, SpellmanProtocol
+
+
+class AsyncSpellman(SpellmanProtocol):
+    """
+    asyncio counterpart of spellmanClass.Spellman. It keeps a single connection (asyncio streams)
+    to the device and exposes the same methods as coroutines. Cancelling a coroutine in the middle
+    of a request closes the connection, so the next request starts from a clean stream.
+    """
+
+    def __init__(self, host='192.168.17.1', port=50001, max_backoff=30):
+        self.server_host = host
+        self.server_port = port
+        self.name = 'Spellman SL30'
+        self.max_backoff = max_backoff # maximum seconds to wait between reconnection attempts
+        self._reader = None
+        self._writer = None
+        self._lock = None # created lazily, it must belong to the loop that runs the coroutines
+        self._vset = None # last setpoints read, used when their reply fails in read_snapshot
+        self._iset = None
+        self._backoff = 0
+        self._next_connect_time = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def connect(self, tOut=1):
+        """ Open the connection to the device. """
+        async with self._get_lock():
+            await self._connect(tOut)
+
+    async def close(self):
+        """ Close the connection to the device. """
+        async with self._get_lock():
+            self._close_streams()
+
+    async def _connect(self, tOut=1):
+        if self._writer is not None:
+            return
+        wait = self._next_connect_time - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(f"{self.name}: reconnection delayed {wait:.1f} s after previous failure")
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.server_host, self.server_port), tOut
+            )
+        except (OSError, asyncio.TimeoutError):
+            self._backoff = min(self.max_backoff, max(0.5, self._backoff * 2))
+            self._next_connect_time = time.monotonic() + self._backoff
+            raise
+        self._backoff = 0
+        self._next_connect_time = 0
+
+    def _close_streams(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def _read_frame(self, tOut):
+        frame = await asyncio.wait_for(self._reader.readuntil(self.ETX.encode('ascii')), tOut)
+        # drop anything received before the start of the frame
+        start = frame.rfind(self.STX.encode('ascii'))
+        if start > 0:
+            frame = frame[start:]
+        return frame
+
+    @staticmethod
+    def _command_code(frame):
+        """ Command code of a message or reply frame (b'\x0260,...\x03' -> b'60'). """
+        return frame.strip(b'\x02\x03').split(b',', 1)[0]
+
+    async def _read_reply(self, code, tOut):
+        """ Read frames until the reply to the command code arrives, skipping the frames of other commands. """
+        deadline = time.monotonic() + tOut
+        while True:
+            resp = await self._read_frame(max(0, deadline - time.monotonic()))
+            if self._command_code(resp) == code:
+                return resp
+
+    async def send_recv(self, message, tOp=0, tOut=1):
+        """ Send a message and wait for the response. """
+        if isinstance(message, str):
+            message = message.encode('ascii')
+
+        async with self._get_lock():
+            # one transparent reconnection if the connection was dropped
+            for attempt in range(2):
+                await self._connect(tOut)
+                try:
+                    self._writer.write(message)
+                    await asyncio.wait_for(self._writer.drain(), tOut)
+                    resp = await self._read_reply(self._command_code(message), tOut + tOp)
+                    return resp.decode('ascii')
+                except asyncio.TimeoutError:
+                    # a late reply to this command (or part of it) could be taken as the reply to the
+                    # next one: the next request starts from a new connection
+                    self._close_streams()
+                    raise
+                except asyncio.CancelledError:
+                    # the stream is in an unknown state, start again from a clean connection
+                    self._close_streams()
+                    raise
+                except (OSError, asyncio.IncompleteReadError):
+                    self._close_streams()
+                    if attempt == 1:
+                        raise
+
+    async def execute_many(self, messages, tOp=0, tOut=1):
+        """
+        Send several messages back-to-back and return the list of responses (in the same order),
+        matching the replies to the messages by their command code. tOut can be a list with a
+        timeout per message (the batch waits up to the largest). A failed message gets an empty string.
+        """
+        messages = [m.encode('ascii') if isinstance(m, str) else m for m in messages]
+        if isinstance(tOut, (int, float)):
+            tOut = [tOut] * len(messages)
+        if len(tOut) != len(messages):
+            raise ValueError("tOut must be a number or a list with one timeout per message")
+
+        async with self._get_lock():
+            for attempt in range(2):
+                try:
+                    await self._connect(max(tOut))
+                    self._writer.write(b''.join(messages))
+                    await asyncio.wait_for(self._writer.drain(), max(tOut))
+                except asyncio.CancelledError:
+                    self._close_streams()
+                    raise
+                except (OSError, asyncio.TimeoutError):
+                    self._close_streams()
+                    if attempt == 1:
+                        return [''] * len(messages)
+                    continue
+                break
+
+            # the replies are matched to the commands by their command code, not by their order, so a
+            # dropped or late reply only times out its own command
+            pending = {} # {command code: [indices of the messages waiting for a reply]}
+            for i, message in enumerate(messages):
+                pending.setdefault(self._command_code(message), []).append(i)
+            responses = [''] * len(messages)
+            deadline = time.monotonic() + max(tOut) + tOp
+            while pending:
+                try:
+                    resp = await self._read_frame(max(0, deadline - time.monotonic()))
+                except asyncio.CancelledError:
+                    self._close_streams()
+                    raise
+                except asyncio.TimeoutError:
+                    # the commands still pending get no reply; their late replies must not reach the
+                    # next requests, so they start from a new connection
+                    self._close_streams()
+                    break
+                except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    self._close_streams() # connection lost or garbage in the stream
+                    break
+                waiting = pending.get(self._command_code(resp))
+                if not waiting:
+                    continue # not a reply to these commands
+                i = waiting.pop(0)
+                if not waiting:
+                    del pending[self._command_code(resp)]
+                responses[i] = resp.decode('ascii')
+        return responses
+
+    async def _command(self, cmd, arg=None):
+        try:
+            return self.split_response(await self.send_recv(self.build_message(cmd, arg)))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return []
+
+    # Methods for interacting with the hardware
+    async def get_vset(self):
+        """Request voltage setpoint."""
+        ans = await self._command(14)
+        try:
+            return int(ans[1]) * self.V_COEF
+        except (IndexError, ValueError):
+            return -1
+
+    async def set_vset(self, voltage_V):
+        """Set voltage setpoint."""
+        return await self._command(10, int(voltage_V / self.V_COEF))
+
+    async def get_iset(self):
+        """Request current setpoint."""
+        ans = await self._command(15)
+        try:
+            return int(ans[1]) * self.I_COEF
+        except (IndexError, ValueError):
+            return -1
+
+    async def set_iset(self, current_mA):
+        """Set current setpoint."""
+        return await self._command(11, int(current_mA / self.I_COEF))
+
+    async def get_vmon(self):
+        """Request voltage monitor."""
+        ans = await self._command(20)
+        try:
+            return int(ans[3]) * self.V_COEF
+        except (IndexError, ValueError):
+            return -1
+
+    async def get_imon(self):
+        """Request current monitor."""
+        ans = await self._command(20)
+        try:
+            return int(ans[4]) * self.I_COEF
+        except (IndexError, ValueError):
+            return -1
+
+    async def get_status(self):
+        """Get system and status information."""
+        stat = self.parse_status(await self._command(76))
+        stat.update(self.parse_system(await self._command(22)))
+        return stat
+
+    async def read_snapshot(self):
+        """Read DAC setpoints, analog monitors, status and system once and return a SpellmanSnapshot."""
+        messages = [self.build_message(cmd) for cmd in self.SNAPSHOT_COMMANDS]
+        responses = await self.execute_many(messages)
+        snapshot = self.snapshot_from_replies(
+            {cmd: self.split_response(resp) for cmd, resp in zip(self.SNAPSHOT_COMMANDS, responses)}
+        )
+        snapshot, self._vset, self._iset = self.keep_setpoints(snapshot, self._vset, self._iset)
+        return snapshot
+
+    async def turn_remote_on(self):
+        return await self._command(85, 1)
+
+    async def turn_remote_off(self):
+        return await self._command(85, 0)
+
+    async def turn_hv_on(self):
+        return await self._command(99, 1)
+
+    async def turn_hv_off(self):
+        return await self._command(99, 0)
+
+    async def turn_on(self):
+        return await self.turn_hv_on()
+
+    async def turn_off(self):
+        return await self.turn_hv_off()
+
+
+class EventLoopThread:
+    """ asyncio event loop running forever in a daemon thread, shared by several devices. """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine, timeout=None, pending=None):
+        """
+        Run a coroutine in the loop and block until it finishes (cancelling it on timeout). While it
+        runs, its future is kept in the pending set if given, so other threads can cancel it.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if pending is not None:
+            pending.add(future)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+        finally:
+            if pending is not None:
+                pending.discard(future)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_default_loop_thread = None
+
+def get_event_loop_thread():
+    """ Returns the event loop thread shared by all the async devices (started on first use). """
+    global _default_loop_thread
+    if _default_loop_thread is None:
+        _default_loop_thread = EventLoopThread()
+    return _default_loop_thread
+
+
+class SyncSpellman(Spellman):
+    """
+    Blocking shim around AsyncSpellman, so the existing GUI (SpellmanFrame) can use the asyncio backend.
+    All the Spellman methods and properties are available, the communication is delegated to an
+    AsyncSpellman running in a shared event loop thread.
+    """
+
+    # requests that only read the device, they can be cancelled (see cancel_pending)
+    READ_COMMANDS = {str(cmd).encode('ascii') for cmd in Spellman.SNAPSHOT_COMMANDS}
+
+    def __init__(self, host='192.168.17.1', port=50001, loop_thread=None, max_backoff=30):
+        super().__init__(host, port, persistent=True, max_backoff=max_backoff)
+        self.loop_thread = loop_thread if loop_thread is not None else get_event_loop_thread()
+        self.async_device = AsyncSpellman(host, port, max_backoff=max_backoff)
+        self.pending_reads = set() # futures of the read requests in flight
+
+    def cancel_pending(self):
+        """
+        Cancel the read requests in flight (e.g. when a protocol is stopped), so the next command does
+        not wait for them. They fail as a timed out request would. The set commands are left to finish,
+        cancelling them would leave the setpoint of the device unknown.
+        """
+        for future in list(self.pending_reads):
+            future.cancel()
+
+    def connect(self, tOut=1):
+        self.loop_thread.run(self.async_device.connect(tOut), timeout=tOut + 1)
+
+    def disconnect(self):
+        self.loop_thread.run(self.async_device.close(), timeout=1)
+
+    def send_recv(self, message, tOp=0, tOut=1):
+        code = self._command_code(message.encode('ascii') if isinstance(message, str) else message)
+        # extra second to let the coroutine time out by itself before cancelling it
+        return self.loop_thread.run(
+            self.async_device.send_recv(message, tOp, tOut),
+            timeout=tOut + tOp + 1,
+            pending=self.pending_reads if code in self.READ_COMMANDS else None,
+        )
+
+    def execute_many(self, messages, tOp=0, tOut=1):
+        total = sum(tOut) if isinstance(tOut, (list, tuple)) else tOut * len(messages)
+        codes = {self._command_code(m.encode('ascii') if isinstance(m, str) else m) for m in messages}
+        try:
+            return self.loop_thread.run(
+                self.async_device.execute_many(messages, tOp, tOut),
+                timeout=total + tOp * len(messages) + 1,
+                pending=self.pending_reads if codes <= self.READ_COMMANDS else None,
+            )
+        except concurrent.futures.CancelledError:
+            return [''] * len(messages) # as if all the replies had been lost
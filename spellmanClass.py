@@ -1,6 +1,39 @@
 import socket
+import threading
+import time
+import datetime as dt
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+
+
+@dataclass(frozen=True)
+class SpellmanSnapshot:
+    """
+    Immutable record of a single Spellman read cycle (all the values come from the same cycle).
+    It exposes the same attributes as the Spellman class so it can be used in place of the device.
+    A value whose reply failed is '??' (see channel.UNKNOWN), never a number.
+    """
+    vset: float
+    iset: float
+    vmon: float
+    imon: float
+    stat: MappingProxyType
+    timestamp: dt.datetime = field(default_factory=dt.datetime.now)
 
-class Spellman:
+    @property
+    def on(self):
+        return self.stat.get('HV', '??')
+
+    @property
+    def remote(self):
+        return self.stat.get('REMOTE', '??')
+
+
+class SpellmanProtocol:
+    """
+    Constants and message formatting/parsing of the Spellman protocol, shared by the
+    blocking (Spellman) and asyncio (spellmanAsync.AsyncSpellman) drivers.
+    """
     STX = '\x02'  # Start of Text character
     ETX = '\x03'  # End of Text character
     SUCCESS = '\x24'  # Character $
@@ -8,8 +41,88 @@ class Spellman:
     V_COEF = V_MAX / 4095
     I_MAX = 0.6  # 0.6 mA max spellman
     I_COEF = I_MAX / 4095
+    SNAPSHOT_COMMANDS = (14, 15, 20, 76, 22) # vset DAC, iset DAC, analog, status, system
+    # flags of parse_status and parse_system (the 'stat' value)
+    STATUS_FLAGS = ('SYSFAULT', 'SYSILK', 'REMOTE', 'SYSHV', 'HC', 'REG', 'ARC', 'OT', 'HV', 'ILK', 'FAULT')
+
+    def build_message(self, cmd, arg=None):
+        """ Returns a formatted Spellman message str. """
+        if arg is None:
+            return f"{self.STX}{cmd},,{self.ETX}"
+        else:
+            return f"{self.STX}{cmd},{arg},{self.ETX}"
+
+    def split_response(self, resp):
+        """ Returns the list of fields of a response ([] for an empty response). """
+        if not resp:
+            return []
+        return resp.strip(self.STX + self.ETX + ',').split(',')
+
+    def parse_system(self, ans):
+        status = {}
+        try:
+            status['HV'] = bool(int(ans[1]))
+            status['ILK'] = bool(int(ans[2]))
+            status['FAULT'] = bool(int(ans[3]))
+        except (IndexError, ValueError):
+            status['HV'] = '??'
+            status['ILK'] = '??'
+            status['FAULT'] = '??'
+        return status
+
+    def parse_status(self, ans):
+        stat = {}
+        try:
+            stat['SYSFAULT'] = bool(int(ans[1])) # Fault
+            stat['SYSILK'] = bool(int(ans[2])) # Interlock
+            stat['REMOTE'] = bool(int(ans[3])) # Remote
+            stat['SYSHV'] = bool(int(ans[4])) # High voltage
+            stat['HC'] = bool(int(ans[5])) # High current
+            stat['REG'] = bool(int(ans[6])) # Regulation error
+            stat['ARC'] = bool(int(ans[7])) # Arc
+            stat['OT'] = bool(int(ans[8])) # Over temperature
+        except (IndexError, ValueError):
+            stat['REMOTE'] = '??'
+            stat['ARC'] = '??'
+        return stat
 
-    def __init__(self, host='192.168.17.1', port=50001):
+    @staticmethod
+    def keep_setpoints(snapshot, vset, iset):
+        """
+        Returns (snapshot, vset, iset): the setpoints whose reply failed are replaced by the last
+        good ones (vset, iset, None if unknown), which are updated with the ones read.
+        """
+        if snapshot.vset == '??' and vset is not None:
+            snapshot = replace(snapshot, vset=vset)
+        if snapshot.iset == '??' and iset is not None:
+            snapshot = replace(snapshot, iset=iset)
+        return (
+            snapshot,
+            snapshot.vset if snapshot.vset != '??' else vset,
+            snapshot.iset if snapshot.iset != '??' else iset,
+        )
+
+    def snapshot_from_replies(self, replies):
+        """ Build a SpellmanSnapshot from the split responses of the SNAPSHOT_COMMANDS. """
+        def value(cmd, i, coef):
+            try:
+                return int(replies[cmd][i]) * coef
+            except (IndexError, ValueError):
+                return '??' # not a value the checks or the logs could take as a real reading
+
+        stat = self.parse_status(replies[76])
+        stat.update(self.parse_system(replies[22]))
+        return SpellmanSnapshot(
+            vset=value(14, 1, self.V_COEF),
+            iset=value(15, 1, self.I_COEF),
+            vmon=value(20, 3, self.V_COEF),
+            imon=value(20, 4, self.I_COEF),
+            stat=MappingProxyType(stat),
+        )
+
+
+class Spellman(SpellmanProtocol):
+    def __init__(self, host='192.168.17.1', port=50001, persistent=False, max_backoff=30):
         self.server_host = host
         self.server_port = port
         self.name = 'Spellman SL30'
@@ -19,12 +132,127 @@ class Spellman:
         self._imon = None
         self._stat = None
 
+        # persistent connection mode: one long-lived socket shared by all the commands
+        self.persistent = persistent
+        self.max_backoff = max_backoff # maximum seconds to wait between reconnection attempts
+        self._socket = None
+        self._socket_lock = threading.Lock() # serializes the request/response pairs over the socket
+        self._recv_buffer = b''
+        self._backoff = 0
+        self._next_connect_time = 0
+
+    def __enter__(self):
+        if self.persistent:
+            self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def connect(self, tOut=1):
+        """ Open the persistent connection (only used in persistent mode). """
+        with self._socket_lock:
+            self._connect(tOut)
+
+    def disconnect(self):
+        """ Close the persistent connection if it is open. """
+        with self._socket_lock:
+            self._close_socket()
+
+    def close(self):
+        """ Close the persistent connection. (Alias for disconnect) """
+        self.disconnect()
+
+    def _connect(self, tOut=1):
+        if self._socket is not None:
+            return self._socket
+        # do not hammer the supply with connection attempts if it is not answering
+        wait = self._next_connect_time - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(f"{self.name}: reconnection delayed {wait:.1f} s after previous failure")
+        try:
+            so = socket.create_connection((self.server_host, self.server_port), timeout=tOut)
+            so.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self._backoff = min(self.max_backoff, max(0.5, self._backoff * 2))
+            self._next_connect_time = time.monotonic() + self._backoff
+            raise
+        self._backoff = 0
+        self._next_connect_time = 0
+        self._socket = so
+        self._recv_buffer = b''
+        return so
+
+    def _close_socket(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._recv_buffer = b''
+
+    def _read_frame(self, so, tOut):
+        """ Read from the socket until a full ETX-terminated reply is available. """
+        deadline = time.monotonic() + tOut
+        while b'\x03' not in self._recv_buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out waiting for the reply")
+            so.settimeout(remaining)
+            chunk = so.recv(1024)
+            if not chunk:
+                raise ConnectionError("connection closed by the device")
+            self._recv_buffer += chunk
+        frame, _, self._recv_buffer = self._recv_buffer.partition(b'\x03')
+        # drop anything received before the start of the frame
+        start = frame.rfind(b'\x02')
+        if start > 0:
+            frame = frame[start:]
+        return frame + b'\x03'
+
+    @staticmethod
+    def _command_code(frame):
+        """ Command code of a message or reply frame (b'\x0260,...\x03' -> b'60'). """
+        return frame.strip(b'\x02\x03').split(b',', 1)[0]
+
+    def _read_reply(self, so, code, tOut):
+        """ Read frames until the reply to the command code arrives, skipping the frames of other commands. """
+        deadline = time.monotonic() + tOut
+        while True:
+            resp = self._read_frame(so, max(0, deadline - time.monotonic()))
+            if self._command_code(resp) == code:
+                return resp
+
+    def _send_recv_persistent(self, message, tOp=0, tOut=1):
+        with self._socket_lock:
+            # one transparent reconnection if the long-lived socket was dropped
+            for attempt in range(2):
+                so = self._connect(tOut)
+                try:
+                    so.settimeout(tOut)
+                    so.sendall(message)
+                    resp = self._read_reply(so, self._command_code(message), tOut + tOp)
+                    return resp.decode('ascii')
+                except socket.timeout:
+                    # a late reply to this command (or part of it) could be taken as the reply to the
+                    # next one: the next request starts from a new connection with an empty buffer
+                    self._close_socket()
+                    raise
+                except OSError:
+                    self._close_socket()
+                    if attempt == 1:
+                        raise
+
     def send_recv(self, message, tOp=0, tOut=1):
         """ Send a message and wait for the response. """
         msg = message
         if isinstance(message, str):
             message = message.encode('ascii')
 
+        if self.persistent:
+            return self._send_recv_persistent(message, tOp, tOut)
+
         try:
             so = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             so.settimeout(tOut)
@@ -48,12 +276,71 @@ class Spellman:
             so.close()
         return resp.decode('ascii')
 
-    def build_message(self, cmd, arg=None):
-        """ Returns a formatted Spellman message str. """
-        if arg is None:
-            return f"{self.STX}{cmd},,{self.ETX}"
-        else:
-            return f"{self.STX}{cmd},{arg},{self.ETX}"
+    def execute_many(self, messages, tOp=0, tOut=1):
+        """
+        Send several messages and return the list of responses (in the same order).
+        In persistent mode all the messages are written back-to-back on the connection and the
+        ETX-delimited responses are read afterwards and matched to the messages by their command
+        code. tOut can be a list with a timeout per message (the batch waits up to the largest).
+        A failed or timed out message gets an empty string as response.
+        """
+        messages = [m.encode('ascii') if isinstance(m, str) else m for m in messages]
+        if isinstance(tOut, (int, float)):
+            tOut = [tOut] * len(messages)
+        if len(tOut) != len(messages):
+            raise ValueError("tOut must be a number or a list with one timeout per message")
+
+        if not self.persistent:
+            responses = []
+            for message, t in zip(messages, tOut):
+                try:
+                    responses.append(self.send_recv(message, tOp, t))
+                except Exception:
+                    responses.append('')
+            return responses
+
+        with self._socket_lock:
+            for attempt in range(2):
+                try:
+                    so = self._connect(max(tOut))
+                    so.settimeout(max(tOut))
+                    so.sendall(b''.join(messages))
+                except socket.timeout:
+                    self._close_socket()
+                    return [''] * len(messages)
+                except OSError:
+                    self._close_socket()
+                    if attempt == 1:
+                        return [''] * len(messages)
+                    continue
+                break
+
+            # the replies are matched to the commands by their command code, not by their order, so a
+            # dropped or late reply only times out its own command
+            pending = {} # {command code: [indices of the messages waiting for a reply]}
+            for i, message in enumerate(messages):
+                pending.setdefault(self._command_code(message), []).append(i)
+            responses = [''] * len(messages)
+            deadline = time.monotonic() + max(tOut) + tOp
+            while pending:
+                try:
+                    resp = self._read_frame(so, max(0, deadline - time.monotonic()))
+                except socket.timeout:
+                    # the commands still pending get no reply; their late replies must not reach the
+                    # next requests, so they start from a new connection
+                    self._close_socket()
+                    break
+                except OSError:
+                    self._close_socket() # connection lost
+                    break
+                waiting = pending.get(self._command_code(resp))
+                if not waiting:
+                    continue # not a reply to these commands
+                i = waiting.pop(0)
+                if not waiting:
+                    del pending[self._command_code(resp)]
+                responses[i] = resp.decode('ascii')
+        return responses
 
     # Properties
     @property
@@ -143,6 +430,14 @@ class Spellman:
         stat.update(self.system_parsed())
         return stat
 
+    def read_snapshot(self):
+        """Read DAC setpoints, analog monitors, status and system once and return a SpellmanSnapshot."""
+        messages = [self.build_message(cmd) for cmd in self.SNAPSHOT_COMMANDS]
+        responses = self.execute_many(messages)
+        replies = {cmd: self.split_response(resp) for cmd, resp in zip(self.SNAPSHOT_COMMANDS, responses)}
+        snapshot, self._vset, self._iset = self.keep_setpoints(self.snapshot_from_replies(replies), self._vset, self._iset)
+        return snapshot
+
     # Methods for specific commands
     def set_DAC(self, i, n):
         """Set digital analog converter."""
@@ -194,35 +489,15 @@ class Spellman:
         except Exception:
             return ''
 
-    def system_parsed(self):
-        ans = self.system()
-        status = {}
-        try:
-            status['HV'] = bool(int(ans[1]))
-            status['ILK'] = bool(int(ans[2]))
-            status['FAULT'] = bool(int(ans[3]))
-        except IndexError:
-            status['HV'] = '??'
-            status['ILK'] = '??'
-            status['FAULT'] = '??'
-        return status
+    def system_parsed(self, ans=None):
+        if ans is None:
+            ans = self.system()
+        return self.parse_system(ans)
 
-    def status_parsed(self):
-        ans = self.status()
-        stat = {}
-        try:
-            stat['SYSFAULT'] = bool(int(ans[1])) # Fault
-            stat['SYSILK'] = bool(int(ans[2])) # Interlock
-            stat['REMOTE'] = bool(int(ans[3])) # Remote
-            stat['SYSHV'] = bool(int(ans[4])) # High voltage
-            stat['HC'] = bool(int(ans[5])) # High current
-            stat['REG'] = bool(int(ans[6])) # Regulation error
-            stat['ARC'] = bool(int(ans[7])) # Arc
-            stat['OT'] = bool(int(ans[8])) # Over temperature
-        except IndexError:
-            stat['REMOTE'] = '??'
-            stat['ARC'] = '??'
-        return stat
+    def status_parsed(self, ans=None):
+        if ans is None:
+            ans = self.status()
+        return self.parse_status(ans)
 
     def turn_remote_on(self):
         '''Turn on remote mode
@@ -0,0 +1,186 @@
+import asyncio
+import argparse
+import random
+import threading
+import time
+
+from spellmanClass import Spellman, SpellmanProtocol
+from simulators import SpellmanSimulator
+
+
+class SpellmanEmulatorServer(SpellmanProtocol):
+    """
+    TCP server speaking the Spellman STX/ETX protocol, backed by the SpellmanSimulator physics.
+    It accepts both one connection per command (the client half-closes after sending) and
+    long-lived connections with several commands in flight.
+
+    Parameters:
+    - host, port: address to listen on.
+    - latency (float): seconds to wait before answering each command.
+    - jitter (float): extra random delay (uniform between 0 and jitter seconds).
+    - drop_probability (float): probability of not answering a command at all.
+    - max_connections (int): simultaneous connections allowed, extra ones are closed (0 = no limit).
+
+    delay_next(cmd, seconds) answers the next command with that code late (e.g. after the client timed out).
+    """
+
+    SUPPORTED_COMMANDS = (10, 11, 14, 15, 20, 22, 76, 85, 99)
+
+    def __init__(self, host='127.0.0.1', port=50001, latency=0.0, jitter=0.0, drop_probability=0.0, max_connections=0, simulator=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_probability = drop_probability
+        self.max_connections = max_connections
+        self.simulator = simulator if simulator is not None else SpellmanSimulator()
+        self.server = None
+        self.active_connections = 0
+        self.stats = {"connections": 0, "rejected": 0, "commands": 0, "dropped": 0}
+        self.delayed_commands = {} # {command code: extra seconds for its next answer}
+
+    def delay_next(self, cmd, seconds):
+        """ Answer the next command cmd seconds later than the others. """
+        self.delayed_commands[int(cmd)] = seconds
+
+    def answer(self, cmd, arg):
+        """ Returns the response (without STX/ETX) to a command, updating the simulator. """
+        sim = self.simulator
+        stat = sim.stat
+        if cmd == 10:
+            sim.set_vset(int(arg) * self.V_COEF)
+            return f"{cmd},{self.SUCCESS}"
+        if cmd == 11:
+            sim.set_iset(int(arg) * self.I_COEF)
+            return f"{cmd},{self.SUCCESS}"
+        if cmd == 14:
+            return f"{cmd},{round(sim.get_vset() / self.V_COEF)}"
+        if cmd == 15:
+            return f"{cmd},{round(sim.get_iset() / self.I_COEF)}"
+        if cmd == 20:
+            vmon = max(0, min(4095, round(sim.get_vmon() / self.V_COEF)))
+            imon = max(0, min(4095, round(sim.get_imon() / self.I_COEF)))
+            return f"{cmd},0,0,{vmon},{imon},0,0,0"
+        if cmd == 22:
+            return f"{cmd},{int(stat['HV'])},{int(stat['ILK'])},{int(stat['FAULT'])}"
+        if cmd == 76:
+            return (f"{cmd},{int(stat['FAULT'])},{int(stat['ILK'])},{int(stat['REMOTE'])},{int(stat['HV'])},"
+                    f"0,0,{int(stat['ARC'])},0")
+        if cmd == 85:
+            if arg == '1':
+                sim.turn_remote_on()
+            else:
+                sim.turn_remote_off()
+            return f"{cmd},{self.SUCCESS}"
+        if cmd == 99:
+            if arg == '1':
+                sim.turn_hv_on()
+            else:
+                sim.turn_hv_off()
+            return f"{cmd},{self.SUCCESS}"
+        return f"{cmd},?" # unknown command
+
+    async def handle_connection(self, reader, writer):
+        if self.max_connections and self.active_connections >= self.max_connections:
+            self.stats["rejected"] += 1
+            writer.close()
+            return
+        self.active_connections += 1
+        self.stats["connections"] += 1
+        try:
+            while True:
+                try:
+                    frame = await reader.readuntil(self.ETX.encode('ascii'))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break # client closed the connection (or half-closed it after its last command)
+                fields = frame.decode('ascii', errors='replace').strip(self.STX + self.ETX).split(',')
+                try:
+                    cmd = int(fields[0])
+                except ValueError:
+                    continue
+                arg = fields[1] if len(fields) > 1 else ''
+                self.stats["commands"] += 1
+
+                delay = self.latency + random.uniform(0, self.jitter) + self.delayed_commands.pop(cmd, 0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if random.random() < self.drop_probability:
+                    self.stats["dropped"] += 1
+                    continue
+                try:
+                    writer.write(f"{self.STX}{self.answer(cmd, arg)},{self.ETX}".encode('ascii'))
+                    await writer.drain()
+                except ConnectionError:
+                    break # client gave up waiting and closed the connection
+        finally:
+            self.active_connections -= 1
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1] # in case port 0 (any free port) was requested
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start_in_thread(self):
+        """ Start the server in a background event loop and return once it is listening. """
+        started = threading.Event()
+
+        async def run():
+            await self.start()
+            started.set()
+            await self.serve_forever()
+
+        threading.Thread(target=lambda: asyncio.run(run()), daemon=True).start()
+        started.wait()
+        return self
+
+
+def benchmark(server, n_reads=200):
+    """ Measure the read_snapshot rate of the Spellman driver against the emulator. """
+    results = {}
+    for mode, persistent in (("per-command connection", False), ("persistent connection", True)):
+        spellman = Spellman(server.host, server.port, persistent=persistent)
+        failed = 0
+        start = time.perf_counter()
+        for _ in range(n_reads):
+            if spellman.read_snapshot().vmon == '??':
+                failed += 1
+        elapsed = time.perf_counter() - start
+        spellman.disconnect()
+        results[mode] = elapsed / n_reads
+        print(f"{mode}: {elapsed / n_reads * 1000:.2f} ms per snapshot ({failed} failed)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spellman SL30 TCP emulator")
+    parser.add_argument("--host", type=str, help="Host to listen on", default='127.0.0.1')
+    parser.add_argument("--port", type=int, help="Port to listen on", default=50001)
+    parser.add_argument("--latency", type=float, help="Seconds before answering each command", default=0.0)
+    parser.add_argument("--jitter", type=float, help="Extra random delay (seconds)", default=0.0)
+    parser.add_argument("--drop", type=float, help="Probability of not answering a command", default=0.0)
+    parser.add_argument("--max-connections", type=int, help="Maximum simultaneous connections (0 = no limit)", default=0)
+    parser.add_argument("--benchmark", type=int, metavar="N", help="Run N snapshot reads with each driver mode and exit", default=0)
+
+    args = parser.parse_args()
+
+    server = SpellmanEmulatorServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        drop_probability=args.drop,
+        max_connections=args.max_connections,
+    )
+    if args.benchmark:
+        server.start_in_thread()
+        benchmark(server, args.benchmark)
+    else:
+        print(f"Spellman emulator listening on {args.host}:{args.port}")
+        asyncio.run(server.serve_forever())
@@ -21,6 +21,7 @@ class SpellmanFrame(DeviceGUI):
         self.state_tooltip = None
         self.security_frame = None
         self.checks_frame = None
+        self.arc_detected = True # to avoid a trip capture when the GUI is started with the arc flag already on
         
         channelstate = ChannelState(
             channel_name='cathode',
@@ -29,6 +30,7 @@ class SpellmanFrame(DeviceGUI):
             precisions={'vmon': 0, 'imon': 5},
             units={'vset': 'V', 'iset': 'mA', 'vmon': 'V', 'imon': 'mA'},
             save_value={'vset': False, 'iset': False, 'vmon': True, 'imon': True, 'stat': False},
+            status_flags={'stat': Spellman.STATUS_FLAGS},
             )
 
         super().__init__(
@@ -198,7 +200,7 @@ class SpellmanFrame(DeviceGUI):
         security_frame.grid(row=3, column=1, sticky='ew', padx=5, pady=5)
         channels = {self.channels_name[0] : self.device}
         locks = tuple([self.device_lock])
-        self.checks_frame = ChecksFrame(security_frame, checks=self.checks, channels=channels, locks=locks)
+        self.checks_frame = ChecksFrame(security_frame, checks=self.checks, channels=channels, locks=locks, channels_states=self.channels_state, snapshot_hub=self.snapshot_hub)
         return security_frame
 
     def turn_remote_on(self):
@@ -284,18 +286,14 @@ class SpellmanFrame(DeviceGUI):
         self.labels['lastring_i_right'].config(text=f"{imon_right:.5f}")
 
     def read_values(self):
-        vmon = self.device.vmon
-        imon = self.device.imon
-        vset = self.device.vset
-        iset = self.device.iset
-        stat = self.device.stat
+        snapshot = self.device.read_snapshot() # all the values from the same read cycle
         self.channels_state['cathode'].set_state(
             {
-                'vmon': vmon,
-                'imon': imon,
-                'vset': vset,
-                'iset': iset,
-                'stat': stat,
+                'vmon': snapshot.vmon,
+                'imon': snapshot.imon,
+                'vset': snapshot.vset,
+                'iset': snapshot.iset,
+                'stat': dict(snapshot.stat),
             }
         )
     
@@ -310,10 +308,15 @@ class SpellmanFrame(DeviceGUI):
         hv = stat.get('HV', '--')
         arc = stat.get('ARC', '--')
 
-        self.label_vars['voltage'].set(f"{vmon:.0f}")
-        self.labels['current_s'].config(text=f"{imon:.5f}")
-        self.labels['voltage_dac_label'].config(text=f"{vset:.0f}")
-        self.labels['current_dac_label'].config(text=f"{iset:.5f}")
+        # the values that could not be read ('??') keep the last value shown (the protocols parse these labels)
+        if isinstance(vmon, (int, float)):
+            self.label_vars['voltage'].set(f"{vmon:.0f}")
+        if isinstance(imon, (int, float)):
+            self.labels['current_s'].config(text=f"{imon:.5f}")
+        if isinstance(vset, (int, float)):
+            self.labels['voltage_dac_label'].config(text=f"{vset:.0f}")
+        if isinstance(iset, (int, float)):
+            self.labels['current_dac_label'].config(text=f"{iset:.5f}")
         if isinstance(remote, bool):
             self.labels['remote_s'].config(text='ON' if remote else 'OFF')
             self.labels['remote_s'].config(fg='green' if remote else 'red')
@@ -334,6 +337,9 @@ class SpellmanFrame(DeviceGUI):
         else:
             self.labels['arc'].config(text=arc)
             self.labels['arc'].config(fg='black')
+        if arc is True and not self.arc_detected:
+            self.trigger_trip_capture("arc")
+        self.arc_detected = arc is True
 
         if stat['FAULT']:
             state_indicator_color = 'red'
@@ -358,11 +364,17 @@ if __name__ == "__main__":
     parser.add_argument("--test", action="store_true", help="Enable test mode")
     parser.add_argument("--port", type=int, help="Select port", default=50001)
     parser.add_argument("--host", type=str, help="Select host", default='192.168.17.1')
+    parser.add_argument("--persistent", action="store_true", help="Keep a single TCP connection open to the device")
+    parser.add_argument("--asyncio", action="store_true", help="Use the asyncio backend to communicate with the device")
 
     args = parser.parse_args()
 
     if not args.test:
-        spll = Spellman(args.host, args.port)
+        if args.asyncio:
+            from spellmanAsync import SyncSpellman
+            spll = SyncSpellman(args.host, args.port)
+        else:
+            spll = Spellman(args.host, args.port, persistent=args.persistent)
         app = SpellmanFrame(spll)
     else:
         from simulators import SpellmanSimulator
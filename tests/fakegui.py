@@ -0,0 +1,88 @@
+import logging
+
+from checkframe import ChecksFrame
+from devicegui import DeviceGUI
+
+# with a parent "app" logger the DeviceGUI loggers propagate to it instead of configuring the
+# Slack/Mattermost handlers
+logging.getLogger("app")
+
+
+class FakeFrame:
+    """ Stand-in for the Tk parent frame of a DeviceGUI (no display needed). """
+
+    def __init__(self):
+        self.options = {"cursor": ""}
+
+    def register(self, func):
+        return func
+
+    def config(self, **options):
+        self.options.update(options)
+
+    def cget(self, option):
+        return self.options.get(option, "")
+
+    def update(self):
+        pass
+
+    def after(self, ms, func):
+        pass
+
+
+class FakeDevice:
+    def __init__(self, name="fake", n_channels=2):
+        self.name = name
+        self.on = [False] * n_channels
+        self.reads = 0
+
+    def turn_on_channel(self, channel_number):
+        self.on[channel_number] = True
+
+    def turn_off_channel(self, channel_number):
+        self.on[channel_number] = False
+
+    def turn_hv_off(self):
+        self.on = [False] * len(self.on)
+
+
+class FakeDeviceGUI(DeviceGUI):
+    """
+    DeviceGUI built through its __init__ without Tk and without the background threads: the
+    commands are executed by calling process_next_command.
+    """
+
+    def __init__(self, device, channels_states, **kwargs):
+        super().__init__(device, channels_states, parent_frame=FakeFrame(), logging_enabled=False, **kwargs)
+
+    def create_gui(self):
+        pass
+
+    def read_values(self):
+        self.device.reads += 1
+
+    def update_gui(self):
+        pass
+
+    def start_background_threads(self):
+        pass
+
+    def run_commands(self):
+        """ Execute all the queued commands, returning their names in order. """
+        names = []
+        while not self.command_queue.empty():
+            names.append(self.command_queue.queue[0].name)
+            self.process_next_command(block=False)
+        return names
+
+
+class FakeChecksFrame(ChecksFrame):
+    """ ChecksFrame built through its __init__ without Tk: the check states are kept, without widgets. """
+
+    def create_security_frame(self):
+        self.root = FakeFrame()
+        self.set_checks_channels_and_locks()
+        self.checks_states = ["unavailable"] * len(self.checks)
+
+    def update_gui(self):
+        pass
@@ -0,0 +1,46 @@
+import datetime as dt
+
+import binarystore
+from binarystore import BinaryRecordFormat
+from channel import StatusFlags, UNKNOWN
+
+
+def write_records(path, record_format, rows):
+    with open(path, "wb") as file:
+        file.write(record_format.header_bytes())
+        for timestamp, values in rows:
+            file.write(record_format.encode(timestamp, values))
+
+
+def test_unknown_status_round_trip(tmp_path):
+    t0 = dt.datetime(2025, 3, 1, 12, 0, 0)
+    rows = [
+        (t0, {"vmon": 100.0, "stat": {"ON": True, "TRIP": False}}),
+        (t0 + dt.timedelta(seconds=1), {"vmon": 101.0, "stat": {"ON": UNKNOWN, "TRIP": False}}),
+        (t0 + dt.timedelta(seconds=2), {"vmon": 102.0, "stat": StatusFlags(("ON", "TRIP"), bits=0b01, unknown=0b10)}),
+    ]
+    record_format = BinaryRecordFormat.from_values("cathode", rows[0][1])
+    path = str(tmp_path / "cathode.bin")
+    write_records(path, record_format, rows)
+
+    read_format, records = binarystore.load_file(path)
+    status = binarystore.decode_status(read_format, records, "stat")
+    assert list(status["ON"]) == [True, UNKNOWN, True]
+    assert list(status["TRIP"]) == [False, False, UNKNOWN]
+    assert list(records["vmon"]) == [100.0, 101.0, 102.0]
+
+
+def test_unknown_is_not_set(tmp_path):
+    record_format = BinaryRecordFormat("cathode", [("stat", "status")], status_flags={"stat": ["ON", "TRIP"]})
+    assert record_format.encode_status("stat", {"ON": UNKNOWN, "TRIP": True}) == (0b10, 0b01)
+    assert record_format.encode_status("stat", {"TRIP": False}) == (0, 0b01) # missing flag
+
+
+def test_files_without_unknown_mask(tmp_path):
+    record_format = BinaryRecordFormat("cathode", [("stat", "status")], status_flags={"stat": ["ON"]}, status_unknown=False)
+    path = str(tmp_path / "cathode.bin")
+    write_records(path, record_format, [(dt.datetime(2025, 3, 1), {"stat": {"ON": True}})])
+
+    read_format, records = binarystore.load_file(path)
+    assert not read_format.status_unknown
+    assert list(binarystore.decode_status(read_format, records, "stat")["ON"]) == [True]
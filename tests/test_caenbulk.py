@@ -0,0 +1,105 @@
+import pytest
+
+from caenbulk import CHANNEL_STATUS_BITS, CaenBulkReader, CaenSerialMonitor, decode_channel_status
+
+
+class FakeSerial:
+    """ Serial port answering the queries with scripted replies (one per PAR). """
+    def __init__(self, replies):
+        self.replies = replies
+        self.written = []
+        self.is_open = True
+
+    def write(self, command):
+        self.written.append(command)
+
+    def readline(self):
+        parameter = self.written[-1].decode().strip().split("PAR:")[1]
+        return self.replies[parameter]
+
+
+class FakeChannel:
+    def __init__(self, i):
+        self.vset = 10.0 * i
+        self.vmon = 10.0 * i
+        self.imon = 0.0
+        self.stat = {"ON": False}
+
+
+class FakeModule:
+    name = "fake"
+    number_of_channels = 4
+
+    def __init__(self, serial, bd=0):
+        self._serial = serial
+        self.bd = bd
+        self.channels = [FakeChannel(i) for i in range(self.number_of_channels)]
+
+
+REPLIES = {
+    "VSET": b"#BD:00,CMD:OK,VAL:100.0;200.0;0.0;350.5\r\n",
+    "VMON": b"#BD:00,CMD:OK,VAL:99.8;200.1;0.0;350.4\r\n",
+    "IMON": b"#BD:00,CMD:OK,VAL:0.01;0.02;0.00;1.50\r\n",
+    "STAT": b"#BD:00,CMD:OK,VAL:1;3;0;129\r\n",
+}
+
+
+def test_decode_channel_status():
+    status = decode_channel_status("129") # ON | TRIP
+    assert list(status) == CHANNEL_STATUS_BITS
+    assert status["ON"] is True
+    assert status["TRIP"] is True
+    assert [flag for flag in CHANNEL_STATUS_BITS if status[flag]] == ["ON", "TRIP"]
+    assert decode_channel_status(0b110)["RUP"] and decode_channel_status(0b110)["RDW"]
+    assert not any(decode_channel_status(1 << len(CHANNEL_STATUS_BITS)).values()) # bits beyond NOCAL ignored
+
+
+def test_all_channels_query_and_reply():
+    serial = FakeSerial(REPLIES)
+    monitor = CaenSerialMonitor(serial, bd=0)
+    assert monitor.read_all_channels(4, "vmon") == ["99.8", "200.1", "0.0", "350.4"]
+    assert serial.written == [b"$BD:00,CMD:MON,CH:4,PAR:VMON\r\n"]
+
+
+@pytest.mark.parametrize("reply", [
+    b"",                                    # no reply
+    b"#BD:00,CMD:ERR\r\n",                  # error reply
+    b"#BD:01,CMD:OK,VAL:1;2;3;4\r\n",       # another board
+    b"#BD:00,CMD:OK,VAL:1;2;3\r\n",         # not all the channels
+])
+def test_invalid_replies_raise(reply):
+    monitor = CaenSerialMonitor(FakeSerial({"VMON": reply}), bd=0)
+    with pytest.raises(ValueError):
+        monitor.read_all_channels(4, "VMON")
+
+
+def test_bulk_read():
+    module = FakeModule(FakeSerial(REPLIES))
+    reader = CaenBulkReader(module, CaenSerialMonitor.from_module(module, hvps_version="0.1.0"))
+    readings = reader.read()
+    assert [r["vset"] for r in readings] == [100.0, 200.0, 0.0, 350.5]
+    assert [r["imon"] for r in readings] == [0.01, 0.02, 0.0, 1.5]
+    assert [r["stat"]["ON"] for r in readings] == [True, True, False, True]
+    assert [r["stat"]["TRIP"] for r in readings] == [False, False, False, True]
+    assert len(module._serial.written) == len(CaenBulkReader.PARAMETERS) # one query per parameter
+
+
+def test_untested_hvps_version_or_no_serial_reads_per_channel():
+    module = FakeModule(FakeSerial(REPLIES))
+    assert CaenSerialMonitor.from_module(module, hvps_version="0.0.39") is None
+    assert CaenSerialMonitor.from_module(object(), hvps_version="0.1.0") is None
+
+    reader = CaenBulkReader(module)
+    reader.monitor = None # as returned by from_module above
+    assert not reader.bulk_supported
+    assert [r["vset"] for r in reader.read()] == [0.0, 10.0, 20.0, 30.0]
+    assert module._serial.written == []
+
+
+def test_falls_back_after_consecutive_failures():
+    replies = dict(REPLIES, STAT=b"#BD:00,CMD:OK,VAL:1;3\r\n")
+    module = FakeModule(FakeSerial(replies))
+    reader = CaenBulkReader(module, CaenSerialMonitor(module._serial, module.bd))
+    for _ in range(CaenBulkReader.MAX_CONSECUTIVE_FAILURES):
+        assert [r["vset"] for r in reader.read()] == [0.0, 10.0, 20.0, 30.0]
+    assert not reader.bulk_supported
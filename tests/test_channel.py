@@ -0,0 +1,52 @@
+import datetime as dt
+import os
+
+import binarystore
+import history
+from binarystore import BinaryRecordFormat
+from channel import ChannelLogWriter, ChannelState, UNKNOWN
+from spellmanClass import Spellman
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, filename, header, rows, date=None):
+        self.writes.append((filename, header, rows))
+
+
+def spellman_channel(writer):
+    return ChannelState("cathode", ["vmon", "imon", "stat"], log_writer=writer, storage="binary",
+                        status_flags={"stat": Spellman.STATUS_FLAGS})
+
+
+def test_binary_layout_does_not_depend_on_the_first_reading():
+    full_stat = {flag: False for flag in Spellman.STATUS_FLAGS}
+    partial_stat = {"REMOTE": UNKNOWN, "ARC": UNKNOWN, "HV": True, "ILK": False, "FAULT": False} # dropped status reply
+
+    headers = []
+    for first_stat in (full_stat, partial_stat):
+        writer = RecordingWriter()
+        chstate = spellman_channel(writer)
+        chstate.set_state({"vmon": 100.0, "imon": 0.1, "stat": first_stat})
+        chstate.save_state(force=True)
+        headers.append(writer.writes[0][1])
+    assert headers[0] == headers[1]
+
+
+def test_records_with_another_layout_go_to_a_new_segment(tmp_path):
+    filename = str(tmp_path / "20250301_cathode.bin")
+    old_format = BinaryRecordFormat("cathode", [("vmon", "float")])
+    new_format = BinaryRecordFormat("cathode", [("vmon", "float"), ("imon", "float")])
+    t0 = dt.datetime(2025, 3, 1, 12)
+
+    for record_format, values in ((old_format, {"vmon": 1.0}), (new_format, {"vmon": 2.0, "imon": 0.5})):
+        writer = ChannelLogWriter() # a new session
+        writer.write(filename, record_format.header_bytes(), [record_format.encode(t0, values)])
+        writer.close()
+
+    segments = binarystore.segment_filenames(filename)
+    assert [os.path.basename(f) for f in segments] == ["20250301_cathode.bin", "20250301_cathode.1.bin"]
+    assert [len(binarystore.load_file(f)[1]) for f in segments] == [1, 1]
+    assert list(history.read_binary_file(segments[1])["imon"]) == [0.5]
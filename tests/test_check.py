@@ -0,0 +1,172 @@
+import datetime as dt
+
+import pytest
+
+from channel import State, StatusFlags, UNKNOWN
+from check import Check, get_snapshot_value
+
+
+class FakeChannel:
+    def __init__(self, name, vset, vmon, imon=0.0, on=True):
+        self.name = name
+        self.vset = vset
+        self.vmon = vmon
+        self.imon = imon
+        self.on = on
+        self._secret = "not for the conditions"
+
+
+def make_channels(cathode_vset=1000, cathode_vmon=998.5, cathode_on=True, gemtop_vset=290, gemtop_vmon=291.2, gemtop_on=True):
+    return {
+        "cathode": FakeChannel("cathode", cathode_vset, cathode_vmon, imon=0.004, on=cathode_on),
+        "gem top": FakeChannel("gem top", gemtop_vset, gemtop_vmon, imon=0.0, on=gemtop_on),
+    }
+
+
+CONDITIONS = [
+    "cathode.vset < 1000",
+    "abs(cathode.vset*0.29 - gem top.vset) < 101",
+    "0 <= gem top.vmon < gem top.vset + 5",
+    "cathode.vmon > gem top.vmon > 100 >= gem top.imon",
+    "not cathode.on or cathode.vmon > 10",
+    "cathode.on and gem top.on",
+    "cathode.on and gem top.vmon or cathode.imon",
+    "int(cathode.vmon / 100) == 9",
+    "int(-cathode.vmon / 100)",
+    "gem top.vset if cathode.on else 0",
+    "float(cathode.imon) != 0.0 or bool(gem top.imon)",
+    "cathode.vset - gem top.vset in (710, 700)",
+    "gem top.vset in [290, 300] and cathode.vset not in [0]",
+    "cathode.name == 'cathode'",
+    "str(cathode.on) == 'True'",
+    "(cathode.vmon ** 2) // 1000 % 7",
+    "cathode.on is True and gem top is not None",
+    "-cathode.vset + +gem top.vset",
+]
+
+CHANNELS_VALUES = [
+    {},
+    {"cathode_vset": 0, "cathode_vmon": 0.3, "cathode_on": False},
+    {"gemtop_vset": 300, "gemtop_vmon": 120.0, "gemtop_on": False},
+    {"cathode_vset": 1010, "cathode_vmon": -5.0},
+]
+
+
+@pytest.mark.parametrize("values", CHANNELS_VALUES)
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_compiled_condition_matches_eval(condition, values):
+    channels = make_channels(**values)
+    check = Check("test", condition, channels)
+    assert check.code is not None, check.error
+    expected = eval(condition.replace("gem top", "gemtop"), {}, {k.replace(" ", ""): v for k, v in channels.items()})
+    assert check.eval_condition() == expected
+
+
+@pytest.mark.parametrize("condition", [
+    "cathode.vset.real > 0",                    # attribute chain
+    "cathode.vset.__class__.__mro__",           # attribute chain to dunders
+    "cathode.__class__",                        # dunder attribute
+    "cathode._secret == ''",                    # private attribute
+    "cathode.missing > 0",                      # not an attribute of the channel
+    "anode.vset > 0",                           # not a channel
+    "__builtins__",                             # dunder name
+    "__import__('os').system('true')",          # call outside the whitelist
+    "open('/etc/passwd')",
+    "getattr(cathode, 'vset') > 0",
+    "abs.__call__(cathode.vset)",               # call of an attribute
+    "(lambda: 1)()",
+    "[ch for ch in (cathode,)]",
+    "cathode.vset[0]",
+    "{'vset': cathode.vset}",
+    "f'{cathode.vset}'",
+    "(x := cathode.vset) > 0",
+])
+def test_disallowed_conditions_are_rejected(condition):
+    check = Check("test", condition, make_channels())
+    assert check.code is None
+    assert check.error is not None and "invalid condition" in check.error
+    assert not check.is_available()
+    assert check.eval_condition() is False
+
+
+def snapshot(timestamp=None, **values):
+    return State(timestamp, values)
+
+
+def test_missing_and_unknown_snapshot_values_use_the_live_values():
+    channels = make_channels(cathode_vmon=998.5, gemtop_vmon=291.2)
+    check = Check("test", "cathode.vmon - gem top.vmon", channels)
+    live = 998.5 - 291.2
+    snap = 900.0 - 300.0
+
+    states = {"cathode": snapshot(vmon=900.0), "gemtop": snapshot(vmon=300.0)}
+    assert check.eval_condition(use_snapshots=True, states=states) == pytest.approx(snap)
+
+    for states in (
+        {"cathode": snapshot(vmon=UNKNOWN), "gemtop": snapshot(vmon=300.0)},   # could not be read
+        {"cathode": snapshot(vset=1000), "gemtop": snapshot(vmon=300.0)},     # value not in the snapshot
+        {"gemtop": snapshot(vmon=300.0)},                                     # channel not in the snapshots
+        {"cathode": snapshot(dt.datetime.now() - dt.timedelta(seconds=60), vmon=900.0), "gemtop": snapshot(vmon=300.0)}, # too old
+    ):
+        assert check.eval_condition(use_snapshots=True, max_age=10, states=states) == pytest.approx(live)
+        assert check.simulate_eval_condition({"gem top.vmon": 0}, use_snapshots=True, max_age=10, states=states) == pytest.approx(998.5)
+
+
+def test_unknown_status_flags():
+    flags = ["ON", "TRIP"]
+    assert get_snapshot_value(snapshot(stat=StatusFlags(flags, bits=0b01)), "on") is True
+    assert get_snapshot_value(snapshot(stat=StatusFlags(flags, bits=0b10)), "on") is False
+    assert get_snapshot_value(snapshot(stat=StatusFlags(flags, unknown=0b01)), "on") is None
+    assert get_snapshot_value(snapshot(stat={"ON": UNKNOWN}), "on") is None
+    assert get_snapshot_value(snapshot(vset=UNKNOWN), "vset") is None
+    assert get_snapshot_value(snapshot(), "vset") is None
+
+    check = Check("test", "not cathode.on", make_channels(cathode_on=False))
+    assert check.eval_condition(use_snapshots=True, states={"cathode": snapshot(stat=StatusFlags(flags, bits=0b01))}) is False
+    assert check.eval_condition(use_snapshots=True, states={"cathode": snapshot(stat=StatusFlags(flags, unknown=0b01))}) is True # live
+
+
+# steps of a plan: cathode and gem top vset, and cathode on (simulated), with zeros to test the short-circuits
+PLAN = {
+    "cathode.vset": [0, 100, 300.5, 700, 1000, 1000, 1200, -50],
+    "gem top.vset": [0, 0, 90, 200.25, 290, 310, 0, 10],
+    "cathode.on": [False, True, True, True, True, False, True, True],
+}
+
+PLAN_CONDITIONS = [
+    "0 <= gem top.vset < cathode.vset * 0.3 <= 300",                                   # chained comparisons
+    "cathode.vset > gem top.vset > 100 != cathode.vmon",
+    "gem top.vset != 0 and cathode.vset / gem top.vset > 3",                           # short-circuit avoids /0
+    "gem top.vset == 0 or cathode.vset // gem top.vset < 4",
+    "(cathode.on and gem top.vset) > 100",                                             # and/or values, not booleans
+    "(cathode.on or gem top.vset) == 1",
+    "(gem top.vset and cathode.vset or 5) > 50",
+    "cathode.on and gem top.vset and cathode.vset",
+    "not cathode.on or cathode.vset < 1100",
+    "cathode.on + gem top.on == 2",                                                    # booleans as numbers
+    "(cathode.vset / gem top.vset if gem top.vset else 0) < 4",                        # ternaries
+    "(gem top.vset if cathode.on else cathode.vset) >= 0",
+    "(1 if cathode.vset > 500 else -1 if cathode.vset < 0 else 0) * gem top.vset >= 0",
+    "int(cathode.vset / 100) == 3",                                                    # int()
+    "int(-cathode.vset / 100) > -7",
+    "int(cathode.vset) % 3 == 0",
+    "abs(cathode.vset * 0.29 - gem top.vset) < 101",                                   # abs
+    "abs(-gem top.vset) > 50 and abs(int(cathode.on) - 1) == 0",
+    "float(gem top.vset) + bool(cathode.vset) > 1",
+]
+
+
+@pytest.mark.parametrize("condition", PLAN_CONDITIONS)
+def test_simulate_eval_plan_matches_eval_of_every_step(condition):
+    check = Check("test", condition, make_channels())
+    assert check.vector_code is not None, check.error
+    n_steps = len(PLAN["cathode.vset"])
+    overrides = check.get_overrides(PLAN)
+    namespace = check.get_namespace(skip=overrides)
+    expected = [bool(check.simulate_eval_condition({k: v[i] for k, v in PLAN.items()})) for i in range(n_steps)]
+
+    vectorized = check.eval_plan_vectorized(namespace, overrides, n_steps)
+    assert vectorized is not None # evaluated element-wise, not step by step
+    assert vectorized.tolist() == expected
+    assert check.eval_plan_steps(namespace, overrides, n_steps).tolist() == expected
+    assert check.simulate_eval_plan(PLAN, n_steps).tolist() == expected
@@ -0,0 +1,45 @@
+from channel import State, UNKNOWN
+from check import Check
+from fakegui import FakeChecksFrame
+from snapshothub import SnapshotHub
+
+
+class CountingChannel:
+    """ Channel counting the live reads of vmon. """
+    def __init__(self, vmon):
+        self._vmon = vmon
+        self.reads = 0
+
+    @property
+    def vmon(self):
+        self.reads += 1
+        return self._vmon
+
+
+def test_live_fallback_is_rate_limited():
+    channels = {"cathode": CountingChannel(900.0), "gemtop": CountingChannel(300.0)}
+    hub = SnapshotHub()
+    checks = [Check("cathode", "cathode.vmon < 1000"), Check("gem top", "gemtop.vmon < 500")]
+    frame = FakeChecksFrame(checks=checks, channels=channels, snapshot_hub=hub)
+    frame.set_config_params({"show_warning_window": False, "seconds_between_checks": 2, "seconds_between_full_checks": 1000})
+
+    # gem top vmon could not be read: its check needs a live read
+    hub.publish("device", {"cathode": State(values={"vmon": 900.0}), "gemtop": State(values={"vmon": UNKNOWN})})
+    frame.check_conditions() # full sweep
+    assert frame.checks_states == ["passed", "passed"]
+    assert channels["gemtop"].reads == 1
+
+    for i in range(10): # many publications in less than seconds_between_checks
+        hub.publish("device", {"cathode": State(values={"vmon": 990.0 + 5 * i}), "gemtop": State(values={"vmon": UNKNOWN})})
+        frame.check_conditions()
+    assert frame.checks_states == ["failed", "passed"] # the snapshot checks are still evaluated after every publication
+    assert channels["cathode"].reads == 0
+    assert channels["gemtop"].reads == 1
+    assert frame.pending_live_checks == {1}
+
+    frame.last_live_check_time -= 2 # seconds_between_checks later (e.g. the watchdog wake up)
+    channels["gemtop"]._vmon = 600.0
+    frame.check_conditions()
+    assert frame.checks_states == ["failed", "failed"]
+    assert channels["gemtop"].reads == 2
+    assert frame.pending_live_checks == set()
@@ -0,0 +1,25 @@
+from fakegui import FakeDevice, FakeDeviceGUI
+
+
+def test_turn_off_after_turn_on_leaves_the_channel_off():
+    device = FakeDevice()
+    gui = FakeDeviceGUI(device, {})
+    gui.issue_command(gui.read_values)
+    gui.issue_command(device.turn_on_channel, 0)
+    gui.issue_command(device.turn_on_channel, 1)
+    gui.issue_command(device.turn_off_channel, 0)
+    gui.issue_command(device.turn_hv_off)
+
+    names = gui.run_commands()
+
+    assert names == ["turn_on_channel", "turn_on_channel", "turn_off_channel", "turn_hv_off", "read_values"]
+    assert device.on == [False, False]
+
+
+def test_read_values_is_not_queued_twice():
+    device = FakeDevice()
+    gui = FakeDeviceGUI(device, {})
+    gui.issue_command(gui.read_values)
+    gui.issue_command(gui.read_values)
+    gui.run_commands()
+    assert device.reads == 1
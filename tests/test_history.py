@@ -0,0 +1,41 @@
+import datetime as dt
+import os
+
+import numpy as np
+
+import history
+from channel import LOG_DIR, get_full_filename_from_date
+
+
+def write_log(log_dir, day, suffix, header, rows):
+    filename = get_full_filename_from_date(day, suffix=suffix)
+    filename = os.path.join(log_dir, os.path.relpath(filename, LOG_DIR))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as file:
+        file.write(header + "\n")
+        for time, *values in rows:
+            file.write(" ".join([time.strftime(history.TIME_FORMAT)] + [str(v) for v in values]) + "\n")
+
+
+def test_resolution_with_mixed_coverage(tmp_path):
+    log_dir = str(tmp_path)
+    day1 = dt.datetime(2025, 3, 1)
+    day2 = dt.datetime(2025, 3, 2)
+    # raw logs of both days, one row every 10 s during 3 minutes
+    for day, offset in ((day1, 0), (day2, 1000)):
+        rows = [(day + dt.timedelta(hours=12, seconds=10 * i), offset + i) for i in range(18)]
+        write_log(log_dir, day, "cathode", "Time vmon[V]", rows)
+    # 1min rollup only for the first day
+    tier_rows = [(day1 + dt.timedelta(hours=12, minutes=m), -m, -m, -m, -m) for m in range(3)]
+    write_log(log_dir, day1, history.rollup_channel_name("cathode", "1min"),
+              "Time vmon_min vmon_max vmon_mean vmon_last", tier_rows)
+
+    data = history.load("cathode", day1.date(), day2.date(), log_dir=log_dir, resolution=60)
+
+    times = data["time"].astype("datetime64[s]").astype(dt.datetime)
+    expected_times = [day + dt.timedelta(hours=12, minutes=m) for day in (day1, day2) for m in range(3)]
+    assert list(times) == expected_times
+    # first day from the rollup file, second day rolled up from the raw file
+    assert list(data["vmon_last"]) == [0, -1, -2, 1005, 1011, 1017]
+    assert list(data["vmon_min"][3:]) == [1000, 1006, 1012]
+    assert np.allclose(data["vmon_mean"][3:], [1002.5, 1008.5, 1014.5])
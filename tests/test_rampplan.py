@@ -0,0 +1,23 @@
+import rampplan
+
+
+def test_pending_steps_skip_like_the_protocol():
+    steps = rampplan.raise_voltage_steps({"cathode": 1000, "gem top": 300}, {"cathode": 1, "gem top": 1}, 100)
+    # cathode already at 500 V, gem top at 200 V
+    pending = rampplan.pending_steps(steps, {"cathode": 500, "gem top": 200}, {"cathode": 500, "gem top": 200}, {})
+
+    indices = [index for index, _, _ in pending]
+    # steps 1 and 2 are already done, and so are 4 and 5 after step 3 (and the repeated last step)
+    assert indices == [2, 5, 6, 7, 8, 9]
+    # cathode is above the 300 V of step 3: only gem top is set, the simulated cathode vset stays at 500 V
+    assert pending[0][1] == {"gem top": 300}
+    assert pending[0][2] == {"cathode": 500, "gem top": 300}
+    assert pending[-1][2] == {"cathode": 1000, "gem top": 300}
+
+
+def test_pending_steps_turn_off():
+    steps = rampplan.turn_off_steps({"cathode": 300, "gem top": 100}, {"cathode": 1, "gem top": 1}, 100)
+    pending = rampplan.pending_steps(steps, {"cathode": 300, "gem top": 100}, {"cathode": 300, "gem top": 50}, {}, raising=False)
+
+    assert pending[0][1] == {"cathode": 200, "gem top": 0}
+    assert [vsets for _, _, vsets in pending][-1] == {"cathode": 0, "gem top": 0}
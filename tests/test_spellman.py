@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from channel import State, UNKNOWN
+from check import get_snapshot_value
+from spellmanAsync import SyncSpellman
+from spellmanClass import Spellman
+from spellmanEmulator import SpellmanEmulatorServer
+
+
+@pytest.fixture
+def server():
+    return SpellmanEmulatorServer(port=0).start_in_thread()
+
+
+@pytest.mark.parametrize("client_class", [lambda port: Spellman("127.0.0.1", port, persistent=True),
+                                          lambda port: SyncSpellman("127.0.0.1", port)])
+def test_late_reply_is_not_taken_by_the_next_request(server, client_class):
+    device = client_class(server.port)
+    device.set_vset(1000)
+    assert device.get_vset() == pytest.approx(1000, abs=20) # DAC steps
+
+    server.delay_next(14, 1.5) # answered after the client timed out (1 s)
+    assert device.get_vset() == -1
+    time.sleep(1.6) # the late reply (1000 V) has been sent
+
+    for vset in (2000, 4000, 6000):
+        server.simulator.set_vset(vset) # e.g. from the front panel, no reply to skip in between
+        assert device.get_vset() == pytest.approx(vset, abs=20) # DAC steps
+        assert device.read_snapshot().vset == pytest.approx(vset, abs=20) # DAC steps
+
+
+@pytest.mark.parametrize("client_class", [lambda port: Spellman("127.0.0.1", port, persistent=True),
+                                          lambda port: SyncSpellman("127.0.0.1", port)])
+def test_late_reply_in_a_snapshot(server, client_class):
+    device = client_class(server.port)
+    device.set_vset(100)
+    server.delay_next(14, 1.5)
+    device.read_snapshot() # vset times out
+    time.sleep(1.6)
+
+    server.simulator.set_vset(5000)
+    assert device.read_snapshot().vset == pytest.approx(5000, abs=20) # DAC steps
+    server.simulator.set_vset(100)
+    assert device.read_snapshot().vset == pytest.approx(100, abs=20) # DAC steps
+
+
+@pytest.mark.parametrize("client_class", [lambda port: Spellman("127.0.0.1", port, persistent=True),
+                                          lambda port: SyncSpellman("127.0.0.1", port)])
+def test_failed_snapshot_fields_are_unknown(server, client_class):
+    device = client_class(server.port)
+    device.set_vset(2000)
+    assert device.read_snapshot().vset == pytest.approx(2000, abs=20) # DAC steps
+
+    server.delay_next(14, 1.5) # vset reply lost
+    server.delay_next(20, 1.5) # analog (vmon, imon) reply lost
+    snapshot = device.read_snapshot()
+    assert snapshot.vset == pytest.approx(2000, abs=20) # last good setpoint
+    assert snapshot.vmon == UNKNOWN and snapshot.imon == UNKNOWN
+    state = State(values={"vmon": snapshot.vmon, "vset": snapshot.vset})
+    assert get_snapshot_value(state, "vmon") is None # the checks read the live value instead
+
+
+def run_in_thread(func):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", func()))
+    thread.start()
+    return thread, result
+
+
+def test_cancel_pending_reads(server):
+    device = SyncSpellman("127.0.0.1", server.port)
+    device.set_vset(1000)
+
+    server.delay_next(20, 0.8) # analog (vmon) reply
+    start = time.monotonic()
+    thread, result = run_in_thread(device.get_vmon)
+    time.sleep(0.2)
+    device.cancel_pending() # e.g. a protocol stopped
+    thread.join(2)
+    assert time.monotonic() - start < 0.6 # not waiting for the reply
+    assert result["value"] == -1 # as a timed out read
+
+    assert device.read_snapshot().vset == pytest.approx(1000, abs=20) # DAC steps
+    server.delay_next(14, 0.8)
+    thread, result = run_in_thread(device.read_snapshot)
+    time.sleep(0.2)
+    device.cancel_pending()
+    thread.join(2)
+    assert result["value"].vset == pytest.approx(1000, abs=20) # last good setpoint
+    assert result["value"].vmon == UNKNOWN
+
+    time.sleep(1) # the late replies have been sent, the next requests start from a new connection
+    assert device.get_vset() == pytest.approx(1000, abs=20) # DAC steps
+
+
+def test_cancel_pending_does_not_cancel_set_commands(server):
+    device = SyncSpellman("127.0.0.1", server.port)
+    server.delay_next(10, 0.5) # vset command
+    thread, _ = run_in_thread(lambda: device.set_vset(3000))
+    time.sleep(0.2)
+    device.cancel_pending()
+    thread.join(2)
+    assert device.get_vset() == pytest.approx(3000, abs=20) # DAC steps
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+
+from channel import ChannelState
+from fakegui import FakeDevice, FakeDeviceGUI
+from tripcapture import TripCapture, load_capture
+
+
+def capture_stable_channel(tmp_path, **capture_kwargs):
+    """
+    Feed a stable channel at the read interval of its DeviceGUI (the real ChannelHistory of the
+    ChannelState) and capture a trip. Returns (event time, sample times of the capture).
+    """
+    chstate = ChannelState("cathode", ["vmon"])
+    gui = FakeDeviceGUI(FakeDevice(), {"cathode": chstate}, stable_time_before_slow=0) # slow polling right away
+    trip_capture = TripCapture(directory=str(tmp_path), **capture_kwargs)
+    gui.set_trip_capture(trip_capture)
+    t0 = time.time() - 200
+    t = t0
+    while t < t0 + 200:
+        chstate.history.append(t, {"vmon": 100.0})
+        t += gui.get_read_loop_time()
+    event_time = t0 + 150
+    filename = trip_capture.save_capture("alarm", "caen", event_time)
+    _, channels = load_capture(filename)
+    return event_time, channels["cathode"]["time"]
+
+
+def test_capture_sample_spacing_with_sample_period(tmp_path):
+    event_time, times = capture_stable_channel(tmp_path, pre_seconds=60, post_seconds=30, sample_period=1)
+    assert len(times) >= 89
+    assert np.all(np.diff(times) <= 1 + 1e-9)
+    assert times[0] - (event_time - 60) <= 1 and (event_time + 30) - times[-1] <= 1
+
+
+def test_capture_follows_the_slow_polling_by_default(tmp_path):
+    _, times = capture_stable_channel(tmp_path, pre_seconds=60, post_seconds=30)
+    assert np.allclose(np.diff(times), 5) # slow_read_loop_time
+
+
+def test_disabled_capture_ignores_triggers(tmp_path):
+    trip_capture = TripCapture(directory=str(tmp_path), sample_period=1, enabled=False)
+    assert trip_capture.max_read_interval() is None
+    assert not trip_capture.trigger("alarm")
@@ -16,16 +16,19 @@ import spellmanClass as spll
 import rigolClass as rgl
 
 import utils
+import rampplan
 from checkframe import ChecksFrame
 from check import load_checks_from_toml_file
-from utilsgui import PrintToTextWidget, ToolTip, enable_children, validate_numeric_entry_input
+from tripcapture import TripCapture
+from snapshothub import get_snapshot_hub
+from utilsgui import PrintToTextWidget, ToolTip, PerformanceWindow, enable_children, validate_numeric_entry_input
 from daqmetrics import MetricsFetcherSSH, FeminosDaqMetrics, FemDaqMetrics
 from daqmetricsgui import DaqMetricsGUI
 import logger
 
 
 class HVGUI:
-    def __init__(self, caen_module=None, spellman_module=None, rigol_module_1=None, rigol_module_2=None, checks_caen=None, checks_spellman=None, checks_multidevice=None, log=True):
+    def __init__(self, caen_module=None, spellman_module=None, rigol_module_1=None, rigol_module_2=None, checks_caen=None, checks_spellman=None, checks_multidevice=None, log=True, trip_capture_period=None):
         if checks_caen is None:
             checks_caen = []
         if checks_spellman is None:
@@ -146,6 +149,12 @@ class HVGUI:
             self.rigol_frame_2.pack(side="top", fill="x", anchor="n", expand=True)
             self.rigol_gui_2 = rigolgui.RigolGUI(device=self.rigol_module_2, parent_frame=self.rigol_frame_2, channel_names=rigolgui.CHANNEL_NAMES_RIGHT, log=self.logging_enabled)
             self.all_guis['rigol right'] = self.rigol_gui_2
+
+        # one trip capture for all the devices: a trip in any of them saves the readings of all the channels
+        self.trip_capture = TripCapture(sample_period=trip_capture_period)
+        for gui in self.all_guis.values():
+            if isinstance(getattr(gui, "channels_state", None), dict):
+                gui.set_trip_capture(self.trip_capture)
         
         # Create the toggle button with a downward triangle (initially visible text)
         if self.rigol_gui_1 is None and self.rigol_gui_2 is None:
@@ -166,6 +175,7 @@ class HVGUI:
         self.menu_config.add_command(label="Verbose", command=self.open_verbose_window)
         self.menu_config.add_command(label="Checks", command=self.open_checks_window)
         self.menu_config.add_command(label="Device GUI configuration", command=self.open_devicegui_config_window)
+        self.menu_config.add_command(label="Performance", command=self.open_performance_window)
         self.menu_bar.add_cascade(label="Config", menu=self.menu_config)
         self.root.config(menu=self.menu_bar)
 
@@ -293,6 +303,10 @@ class HVGUI:
             gui.make_config_menu(device_frame)
             row += 1
 
+    def open_performance_window(self):
+        stats = {name: gui.performance for name, gui in self.all_guis.items() if hasattr(gui, "performance")}
+        PerformanceWindow(self.root, stats)
+
     def create_multidevice_frame(self, frame):
         self.multidevice_frame = tk.LabelFrame(frame, text="Multi-device control", font=("", 16), labelanchor="n", padx=10, pady=10, bd=4)
         self.multidevice_frame.pack(side="bottom", fill="both", expand=False)
@@ -396,7 +410,14 @@ class HVGUI:
         right_frame.pack(side="right", anchor="center", padx=20)
         self.create_trip_recovery_frame(right_frame)
         all_devices_locks = tuple([gui.device_lock for gui in self.all_guis.values()])
-        self.checks_frame = ChecksFrame(right_frame, checks=self.checks, channels=self.all_channels, locks=all_devices_locks)
+        all_channels_states = {}
+        for gui in self.all_guis.values():
+            if not isinstance(getattr(gui, "channels_state", None), dict):
+                continue
+            for name, chstate in gui.channels_state.items():
+                if name in self.all_channels:
+                    all_channels_states[name] = chstate
+        self.checks_frame = ChecksFrame(right_frame, checks=self.checks, channels=self.all_channels, locks=all_devices_locks, channels_states=all_channels_states, snapshot_hub=get_snapshot_hub())
 
     def create_daq_frame(self, frame):
         metrics_fetcher = MetricsFetcherSSH(
@@ -689,11 +710,20 @@ class HVGUI:
     def stop_protocol(self):
         self.protocol_stop_flag = True
         print("Stopping protocol...")
+        # do not wait for the reads in flight of the asyncio devices (see SyncSpellman.cancel_pending)
+        for device in self.all_channels.values():
+            if hasattr(device, "cancel_pending"):
+                device.cancel_pending()
         if self.protocol_thread and self.protocol_thread.is_alive():
             self.protocol_thread.join() # this will block the main thread until the protocol thread finishes
         print("Protocol stopped.")
 
+    def set_fast_polling(self, fast=True):
+        for gui in set(self.channels_gui.values()):
+            gui.request_fast_polling(fast)
+
     def protocol_cleanup(self):
+        self.set_fast_polling(False)
         if self.step_entry:
             # avoid enabling it if the whole frame is disabled (use channel_optmenus to check)
             if self.channel_optmenus and self.channel_optmenus[0].cget("state") == "normal":
@@ -740,6 +770,7 @@ class HVGUI:
         if self.protocol_thread and self.protocol_thread.is_alive():
             print("Protocol thread already running")
             return
+        self.set_fast_polling(True)
         self.protocol_thread = utils.ExceptionThread(target=self.raise_voltage_protocol, args=(step_number,))
         self.protocol_thread.start()
 
@@ -761,9 +792,29 @@ class HVGUI:
         if self.protocol_thread and self.protocol_thread.is_alive():
             print("Protocol thread already running")
             return
+        self.set_fast_polling(True)
         self.protocol_thread = threading.Thread(target=self.turn_off_protocol, args=(step_number,))
         self.protocol_thread.start()
 
+    def get_checks_frames(self):
+        """ Multidevice and individual device ChecksFrames: {name: ChecksFrame}. """
+        checks_frames = {}
+        if self.checks_frame is not None:
+            checks_frames["multidevice"] = self.checks_frame
+        for device, gui in self.all_guis.items():
+            if getattr(gui, "checks_frame", None) is not None:
+                checks_frames[device] = gui.checks_frame
+        return checks_frames
+
+    def simulate_plan(self, pending):
+        """ Simulate the steps that a protocol will apply (see rampplan.pending_steps) against all the checks. Returns True if they all pass. """
+        failed = rampplan.simulate_plan([vsets for _, _, vsets in pending], self.get_checks_frames())
+        for device, failed_checks in failed.items():
+            for name, step_index in failed_checks.items():
+                index, _, vsets = pending[step_index]
+                print(f"Step {index+1} {vsets} did not pass the {device} check '{name}'.")
+        return not failed
+
     def raise_voltage_protocol(self, step = 100, timeout = 60):
         # final_vset = {'cathode' : 2000, 'gem top' : 600, 'gem bottom' : 350, 'mesh left' : 250}
         def get_vmon(ch_name):
@@ -785,13 +836,6 @@ class HVGUI:
                 if v - vmon > prec:
                     return False
             return True
-        
-        def are_all_channels_vset_above(vsets):
-            for ch, v in vsets.items():
-                vset = float(self.channels_vset_guilabel[ch].cget("text"))
-                if vset < v:
-                    return False
-            return True
 
         final_vset = {}
         factors = {}
@@ -831,53 +875,28 @@ class HVGUI:
         if self.step_entry:
             self.step_entry.config(state="disabled")
 
-        temp_vset = {k: 0 for k in final_vset.keys()} # initialize the temporary voltage setpoints
+        # pre-flight: simulate all the steps that will be applied against the checks before applying anything
+        steps = rampplan.raise_voltage_steps(final_vset, factors, step)
+        current_vset = {ch: float(self.channels_vset_guilabel[ch].cget("text")) for ch in final_vset}
+        current_vmon = {ch: get_vmon(ch) for ch in final_vset}
+        # steps already done are skipped and channels above a step are not set (see rampplan.pending_steps)
+        pending = rampplan.pending_steps(steps, current_vset, current_vmon, precision, raising=True)
+        print(f"Number of steps: {len(pending)} (of {len(steps)})")
+        if not self.simulate_plan(pending):
+            self.protocol_cleanup()
+            raise AssertionError("The protocol steps did not pass the checks.")
+            return
 
-        max_vset = max([round(v*f) for v, f in zip(final_vset.values(), factors.values())])
-        n_steps = int( max_vset / step ) + 1
-        print(f"Number of steps: {n_steps}")
-        vset = 0
-        for _ in range(n_steps):
+        for index, applied_vset, _ in pending:
             if self.protocol_stop_flag:
                 break
-            vset = vset + step
-            temp_vset = {k: round(vset/f) for k, f in zip(final_vset.keys(), factors.values())}
-            for ch, f in final_vset.items():
-                temp_vset[ch] = f if temp_vset[ch] >= f else temp_vset[ch]
-            if (are_all_channels_vset_above(temp_vset)
-                and have_all_channels_reached(temp_vset, precision)
-            ):
-                continue
-            print(f"Step {_+1}: {temp_vset}")
-
-            # simulate the checks results before applying the new vsets
-            parameters_values = {}
-            for ch, v in temp_vset.items():
-                parameters_values[ch.replace(" ", "") + ".vset"] = v
-            # multidevice checks
-            if not self.checks_frame.simulate_check_conditions(parameters_values):
-                print("Step did not pass the multidevice checks.")
-                self.protocol_cleanup()
-                raise AssertionError("Step did not pass the multidevice checks.")
-                return
-            # individual device checks
-            for device, gui in self.all_guis.items():
-                try:
-                    if not gui.checksframe.simulate_check_conditions(parameters_values):
-                        print(f"Step did not pass the {device} checks.")
-                        self.protocol_cleanup()
-                        raise AssertionError(f"Step did not pass the {device} checks.")
-                        return
-                except AttributeError:
-                    pass
+            temp_vset = steps[index]
+            print(f"Step {index+1}: {temp_vset}")
 
             if self.protocol_stop_flag:
                 break
             # apply vsets to the channels
-            for ch, v in temp_vset.items():
-                if get_vmon(ch) > v:
-                    #print(f"Voltage monitor for channel {ch} is higher than the setpoint. Skipping the step.")
-                    continue
+            for ch, v in applied_vset.items():
                 # change the vset entry to the new value (emulate the human manually changing the value)
                 self.channels_vset_guientries[ch].delete(0, tk.END)
                 self.channels_vset_guientries[ch].insert(0, str(v))
@@ -955,48 +974,26 @@ class HVGUI:
         if self.step_entry:
             self.step_entry.config(state="disabled")
 
-        temp_vset = current_vset # initialize the temporary voltage setpoints
+        # pre-flight: simulate all the steps that will be applied against the checks before applying anything
+        steps = rampplan.turn_off_steps(current_vset, factors, step)
+        current_vmon = {ch: get_vmon(ch) for ch in current_vset}
+        # channels below a step are not set (see rampplan.pending_steps)
+        pending = rampplan.pending_steps(steps, current_vset, current_vmon, precision, raising=False)
+        print(f"Number of steps: {len(pending)}")
+        if not self.simulate_plan(pending):
+            self.protocol_cleanup()
+            return
 
-        max_vset = max([round(v*f) for v, f in zip(current_vset.values(), factors.values())])
-        n_steps = int( max_vset / step ) + 1
-        print(f"Number of steps: {n_steps}")
-        channels_reached = 0
-        for _ in range(n_steps):
+        for index, applied_vset, _ in pending:
             if self.protocol_stop_flag:
                 break
-            temp_vset = {k: round(t-step/f) for k, t, f in zip(current_vset.keys(), temp_vset.values(), factors.values())}
-            if any([t <= 0 for t in temp_vset.values()]):
-                channels_reached += 1
-            for ch in temp_vset.keys():
-                temp_vset[ch] = 0 if temp_vset[ch] <= 0 else temp_vset[ch]
-            print(f"Step {_+1}: {temp_vset}")
-
-            # simulate the checks results before applying the new vsets
-            parameters_values = {}
-            for ch, v in temp_vset.items():
-                parameters_values[ch.replace(" ", "") + ".vset"] = v
-            # multidevice checks
-            if not self.checks_frame.simulate_check_conditions(parameters_values):
-                print("Step did not pass the multidevice checks.")
-                self.protocol_cleanup()
-                return
-            # individual device checks
-            for device, gui in self.all_guis.items():
-                try:
-                    if not gui.checksframe.simulate_check_conditions(parameters_values):
-                        print(f"Step did not pass the {device} checks.")
-                        self.protocol_cleanup()
-                        return
-                except AttributeError:
-                    pass
+            temp_vset = steps[index]
+            print(f"Step {index+1}: {temp_vset}")
 
             if self.protocol_stop_flag:
                 break
             # apply vsets to the channels
-            for ch, v in temp_vset.items():
-                if get_vmon(ch) < v:
-                    # print(f"Voltage monitor for channel {ch} is lower than the setpoint. Skipping the step.")
-                    continue
+            for ch, v in applied_vset.items():
                 # change the vset entry to the new value (emulate the human manually changing the value)
                 self.channels_vset_guientries[ch].delete(0, tk.END)
                 self.channels_vset_guientries[ch].insert(0, str(v))
@@ -1047,6 +1044,9 @@ if __name__ == "__main__":
     parser.add_argument("--test", action="store_true", help="Enable test mode")
     parser.add_argument("--port", type=str, help="Select port for CAEN", default="/dev/ttyUSB0")
     parser.add_argument("--checks", type=str, help="Select checks configuration file", default="checks_config.toml")
+    parser.add_argument("--spellman-persistent", action="store_true", help="Keep a single TCP connection open to the Spellman")
+    parser.add_argument("--spellman-asyncio", action="store_true", help="Use the asyncio backend to communicate with the Spellman")
+    parser.add_argument("--trip-capture-period", type=float, help="Read the devices at least every given seconds for the trip captures (disables the slow polling if shorter)", default=None)
 
     args = parser.parse_args()
 
@@ -1059,7 +1059,11 @@ if __name__ == "__main__":
             print("port:", caen.port)
             print("baudrate:", caen.baudrate)
             m = caen.module(0)
-            spellman = spll.Spellman()
+            if args.spellman_asyncio:
+                from spellmanAsync import SyncSpellman
+                spellman = SyncSpellman()
+            else:
+                spellman = spll.Spellman(persistent=args.spellman_persistent)
             #rigol1 = rgl.RigolPowerSupply(name="Rigol Left", resource_name='USB0::6833::42152::DP9D263500831::0::INSTR')
             #rigol2 = rgl.RigolPowerSupply(name="Rigol Right", resource_name='USB0::6833::42152::DP9D263500827::0::INSTR')
             app = HVGUI(
@@ -1069,7 +1073,8 @@ if __name__ == "__main__":
                     #rigol_module_2=rigol2,
                     checks_caen=checks_caen,
                     checks_spellman=checks_spellman,
-                    checks_multidevice=checks_multidevice
+                    checks_multidevice=checks_multidevice,
+                    trip_capture_period=args.trip_capture_period,
                 )
 
     else:
@@ -1085,7 +1090,8 @@ if __name__ == "__main__":
                     checks_caen=checks_caen,
                     checks_spellman=checks_spellman,
                     checks_multidevice=checks_multidevice,
-                    log=False
+                    log=False,
+                    trip_capture_period=args.trip_capture_period,
                 )
 
 
@@ -0,0 +1,143 @@
+import datetime as dt
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from channel import LOG_DIR, create_directory_recursive
+
+TRIPS_DIR = LOG_DIR + "/trips"
+INDEX_FILENAME = "index.csv"
+
+
+class TripCapture:
+    """
+    Saves the readings of the channels around a trip (board alarm, interlock, arc...).
+
+    The readings come from the in-memory history of the channels (ChannelState.history), so
+    nothing extra is done in the polling loop. When triggered, a timer waits post_seconds and
+    then writes the pre_seconds before and post_seconds after the event of every channel to a
+    compressed .npz file in logs/trips, adding a line to logs/trips/index.csv.
+
+    The history is fed at the polling rate of the devices: fast (0.25 s by default) during activity
+    (ramps, trips, arcs), normal (read_loop_time) and slow (slow_read_loop_time, 5 s by default)
+    when everything has been stable for a while, so the samples before a trip can be that far
+    apart. With sample_period (opt-in, None by default) the devices are read at least every
+    sample_period seconds (plus the time the reading takes) while the capture is enabled, which
+    also means the slow polling rate is not used if sample_period is shorter than it.
+
+    The .npz file contains, for every channel, '<channel>.time' (epoch seconds) and
+    '<channel>.<value>' arrays, plus 'metadata' (JSON string with the event, the channels and
+    the flag names of the status bitmasks).
+    """
+
+    def __init__(self, channels_states=None, pre_seconds=60, post_seconds=30, directory=TRIPS_DIR, min_interval=5, sample_period=None, enabled=True):
+        self.channels_states = {}
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.sample_period = sample_period # seconds, maximum time between the readings of the channels (None or 0 for no limit, the default)
+        self.enabled = enabled # triggers are ignored and the reading rate is not limited when disabled
+        self.directory = directory
+        self.min_interval = min_interval # seconds, triggers closer than this to the previous one are ignored
+        self.last_trigger_time = {} # {reason: time}
+        self.lock = threading.Lock()
+        if channels_states:
+            self.add_channels(channels_states)
+
+    def add_channels(self, channels_states, prefix=""):
+        """ Add channels ({name: ChannelState}) to the capture. """
+        with self.lock:
+            for name, chstate in channels_states.items():
+                self.channels_states[f"{prefix}{name}"] = chstate
+
+    def max_read_interval(self):
+        """ Longest time (seconds) the devices can wait between readings of the captured channels, None if there is no limit. """
+        if not self.enabled or not self.sample_period:
+            return None
+        return self.sample_period
+
+    def trigger(self, reason, source="", event_time=None):
+        """
+        Schedule a capture around event_time (epoch seconds, default now). It returns immediately,
+        the file is written from a background timer after post_seconds.
+        """
+        if not self.enabled:
+            return False
+        event_time = event_time if event_time is not None else time.time()
+        with self.lock:
+            key = (source, reason)
+            if event_time - self.last_trigger_time.get(key, float("-inf")) < self.min_interval:
+                return False
+            self.last_trigger_time[key] = event_time
+        timer = threading.Timer(self.post_seconds, self._save_capture, args=(reason, source, event_time))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _save_capture(self, reason, source, event_time):
+        try:
+            filename = self.save_capture(reason, source, event_time)
+            print(f"Trip capture ({source} {reason}) saved to {filename}")
+        except Exception as e:
+            print(f"Error saving the trip capture ({source} {reason}): {e}")
+
+    def save_capture(self, reason, source, event_time):
+        """ Write the capture file and its index line. Returns the filename. """
+        with self.lock:
+            channels_states = dict(self.channels_states)
+
+        arrays = {}
+        metadata = {
+            "reason": reason,
+            "source": source,
+            "event_time": event_time,
+            "pre_seconds": self.pre_seconds,
+            "post_seconds": self.post_seconds,
+            "sample_period": self.sample_period,
+            "channels": {},
+        }
+        for name, chstate in channels_states.items():
+            history = getattr(chstate, "history", None)
+            if history is None:
+                continue
+            times, values = history.snapshot(self.pre_seconds + self.post_seconds, end=event_time + self.post_seconds)
+            arrays[f"{name}.time"] = times
+            for value_name, array in values.items():
+                arrays[f"{name}.{value_name}"] = array
+            metadata["channels"][name] = {
+                "values": list(values),
+                "status_flags": {k: list(v) for k, v in history.status_names.items()},
+            }
+        arrays["metadata"] = np.array(json.dumps(metadata))
+
+        event_dt = dt.datetime.fromtimestamp(event_time)
+        safe_reason = re.sub(r"[^A-Za-z0-9]+", "_", f"{source}_{reason}").strip("_")
+        filename = os.path.join(self.directory, f"{event_dt.strftime('%Y%m%d_%H%M%S')}_{safe_reason}.npz")
+        create_directory_recursive(filename)
+        np.savez_compressed(filename, **arrays)
+
+        index_filename = os.path.join(self.directory, INDEX_FILENAME)
+        new_index = not os.path.isfile(index_filename)
+        with open(index_filename, "a") as file:
+            if new_index:
+                file.write("time,source,reason,file,channels\n") # channels separated by ';'
+            file.write(
+                f"{event_dt.strftime('%Y-%m-%d %H:%M:%S')},{source},{reason},"
+                f"{os.path.basename(filename)},{';'.join(metadata['channels']).replace(',', '')}\n"
+            )
+        return filename
+
+
+def load_capture(filename):
+    """ Returns (metadata dict, {channel: {"time": array, value: array}}) of a capture file. """
+    with np.load(filename) as data:
+        metadata = json.loads(str(data["metadata"]))
+        channels = {}
+        for name, info in metadata["channels"].items():
+            channels[name] = {"time": data[f"{name}.time"]}
+            for value_name in info["values"]:
+                channels[name][value_name] = data[f"{name}.{value_name}"]
+    return metadata, channels
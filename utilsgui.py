@@ -79,3 +79,28 @@ class PrintToTextWidget(object):
 
     def flush(self): # needed
         pass
+
+class PerformanceWindow:
+    """
+    Window showing the command latency statistics (performance.CommandStats) of one or several devices.
+    """
+
+    def __init__(self, parent, stats, refresh_time=2):
+        self.stats = stats # {device name: CommandStats}
+        self.refresh_time = refresh_time
+        self.window = tk.Toplevel(parent)
+        self.window.title("Performance")
+        tk.Label(self.window, text="Command latencies (ms)", font=("", 12, "bold")).pack(anchor="w", padx=5)
+        self.text = tk.Text(self.window, font=("Courier", 9), width=83, height=30, state="disabled")
+        self.text.pack(fill="both", expand=True, padx=5, pady=5)
+        self.refresh()
+
+    def refresh(self):
+        if not self.window.winfo_exists():
+            return
+        content = "\n\n".join(f"{name}\n{stats.format_table()}" for name, stats in self.stats.items())
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("end", content)
+        self.text.configure(state="disabled")
+        self.window.after(int(self.refresh_time * 1000), self.refresh)